@@ -0,0 +1,144 @@
+import os
+import glob
+import shutil
+import hashlib
+import multiprocessing
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from util import resample, resample_timeframes, merge_ohlc
+
+# Persistent cache of resampled bars.
+# Every entry is a directory of .npy arrays (int64 nanosecond timestamps and
+# float64 open/high/low/close for bid and ask) named after the source file, the
+# timeframe, a hash of the source path and a hash of the source path, size and
+# mtime. A log that hasn't changed is never resampled again, and loading an
+# entry memory-maps the arrays instead of parsing anything. Writing an entry
+# removes the older entries of the same source paths, logs with the same name
+# in other directories keep theirs.
+
+CACHE_DIR = ".bar_cache"
+COLUMNS = ["open", "high", "low", "close"]
+
+
+def source_key(filenames, timeframe):
+    # Changes whenever one of the source files is touched
+    parts = [timeframe]
+    for filename in filenames:
+        stat = os.stat(filename)
+        parts.append("{}|{}|{}".format(os.path.abspath(filename), stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()[:16]
+
+
+def path_key(filenames):
+    # Changes only with the paths of the source files, not with their contents
+    return hashlib.sha1("\n".join(os.path.abspath(filename) for filename in filenames).encode()).hexdigest()[:8]
+
+
+def entry_path(filenames, timeframe, cache_dir=CACHE_DIR):
+    # Path of the entry and the name every entry of these source paths starts with
+    name = "{}.{}.{}".format(os.path.basename(filenames[0]), timeframe, path_key(filenames))
+    return os.path.join(cache_dir, "{}.{}".format(name, source_key(filenames, timeframe))), name
+
+
+def save_frame(path, side, frame):
+    index = pd.to_datetime(frame.index).values.astype("datetime64[ns]").view("int64")
+    np.save(os.path.join(path, "{}_index.npy".format(side)), index)
+    np.save(os.path.join(path, "{}_values.npy".format(side)), frame[COLUMNS].to_numpy(dtype=float))
+
+
+def load_frame(path, side):
+    # Frame over memory-mapped arrays, nothing is read until it is used
+    index = np.load(os.path.join(path, "{}_index.npy".format(side)), mmap_mode="r")
+    values = np.load(os.path.join(path, "{}_values.npy".format(side)), mmap_mode="r")
+    return pd.DataFrame(values, index=pd.DatetimeIndex(index.view("datetime64[ns]"), name="Timestamp"),
+                        columns=COLUMNS, copy=False)
+
+
+def save_entry(path, name, bid, ask):
+    # Write into a temporary directory and rename it, so an interrupted run never leaves half an entry
+    tmp_path = path + ".tmp{}".format(os.getpid())
+    os.makedirs(tmp_path, exist_ok=True)
+    save_frame(tmp_path, "bid", bid)
+    save_frame(tmp_path, "ask", ask)
+    # Entries of older versions of the same source are stale now
+    for old_path in glob.glob(os.path.join(os.path.dirname(path), glob.escape(name) + ".*")):
+        if old_path != tmp_path and os.path.isdir(old_path):
+            shutil.rmtree(old_path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def load_entry(path):
+    return load_frame(path, "bid"), load_frame(path, "ask")
+
+
+def cached_resample(filename, timeframe='15Min', cache_dir=CACHE_DIR):
+    # util.resample through the cache
+    path, name = entry_path([filename], timeframe, cache_dir)
+    if not os.path.isdir(path):
+        bid, ask = resample(filename, timeframe)
+        save_entry(path, name, bid, ask)
+    return load_entry(path)
+
+
+def _cache_file(args):
+    # Pool worker, resamples into the cache without sending the frames back
+    filename, timeframe, cache_dir = args
+    path, name = entry_path([filename], timeframe, cache_dir)
+    if not os.path.isdir(path):
+        bid, ask = resample(filename, timeframe)
+        save_entry(path, name, bid, ask)
+
+
+def load_bars(file_list, timeframe='15Min', cache_dir=CACHE_DIR, workers=None):
+    # Merged bid and ask ohlc of several logs, only logs missing from the cache are resampled (in parallel)
+    stale = [filename for filename in file_list if not os.path.isdir(entry_path([filename], timeframe, cache_dir)[0])]
+    if len(stale) != 0:
+        with multiprocessing.Pool(workers) as pool:
+            list(tqdm(pool.imap(_cache_file, [(filename, timeframe, cache_dir) for filename in stale]),
+                      total=len(stale)))
+
+    entries = [load_entry(entry_path([filename], timeframe, cache_dir)[0]) for filename in file_list]
+    return merge_ohlc([bid for bid, ask in entries]), merge_ohlc([ask for bid, ask in entries])
+
+
+def _cache_timeframes(args):
+    # Resamples the timeframes of a log missing from the cache in one read, also a pool worker
+    filename, timeframes, cache_dir = args
+    missing = [timeframe for timeframe in timeframes
+               if not os.path.isdir(entry_path([filename], timeframe, cache_dir)[0])]
+    if len(missing) != 0:
+        for timeframe, (bid, ask) in resample_timeframes(filename, missing).items():
+            save_entry(*entry_path([filename], timeframe, cache_dir), bid, ask)
+
+
+def cached_timeframes(filename, timeframes, cache_dir=CACHE_DIR):
+    # {timeframe: (bid, ask)} through the cache, one entry per timeframe (see util.resample_timeframes)
+    _cache_timeframes((filename, timeframes, cache_dir))
+    return {timeframe: load_entry(entry_path([filename], timeframe, cache_dir)[0]) for timeframe in timeframes}
+
+
+def load_timeframes(file_list, timeframes, cache_dir=CACHE_DIR, workers=None):
+    # load_bars for several timeframes, every log is read once for all the timeframes it is missing
+    stale = [filename for filename in file_list
+             if any(not os.path.isdir(entry_path([filename], timeframe, cache_dir)[0]) for timeframe in timeframes)]
+    if len(stale) != 0:
+        with multiprocessing.Pool(workers) as pool:
+            list(tqdm(pool.imap(_cache_timeframes, [(filename, list(timeframes), cache_dir) for filename in stale]),
+                      total=len(stale)))
+
+    bars = {}
+    for timeframe in timeframes:
+        entries = [load_entry(entry_path([filename], timeframe, cache_dir)[0]) for filename in file_list]
+        bars[timeframe] = (merge_ohlc([bid for bid, ask in entries]), merge_ohlc([ask for bid, ask in entries]))
+    return bars
+
+
+def cached_ohlc_csv(bid_file, ask_file, cache_dir=CACHE_DIR):
+    # bid/ask ohlc csv files as written by ohlc.py, parsed once and memory-mapped afterwards
+    path, name = entry_path([bid_file, ask_file], "csv", cache_dir)
+    if not os.path.isdir(path):
+        bid = pd.read_csv(bid_file, index_col="Timestamp", parse_dates=["Timestamp"])
+        ask = pd.read_csv(ask_file, index_col="Timestamp", parse_dates=["Timestamp"])
+        save_entry(path, name, bid, ask)
+    return load_entry(path)
@@ -0,0 +1,277 @@
+import os
+import json
+import inspect
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+from util import resample
+from trade import make_long, make_short, ohlc_backtest
+
+# The benchmark has to run on older commits too, to time the "before" of a change,
+# so what came later is looked for and the cases fall back to the plain calls without it
+try:
+    from util import IST_OFFSET
+except ImportError:
+    IST_OFFSET = pd.Timedelta(hours=5, minutes=30)
+try:
+    from trade import ohlc_grid
+except ImportError:
+    ohlc_grid = None
+try:
+    from positions import OpenPositions
+except ImportError:
+    OpenPositions = None
+try:
+    from exits import exit_arrays
+except ImportError:
+    exit_arrays = None
+try:
+    from indicators import IndicatorCache
+except ImportError:
+    IndicatorCache = None
+
+# Benchmarks of the hot paths on seeded synthetic data.
+# The tick logs and bars are a random walk made from a fixed seed, so every run
+# (and every commit) times the same work. Each case is timed repeat times and
+# the best run is kept. Peak memory comes from one extra run under tracemalloc,
+# which is too slow to time with. Results go to a json file with the commit and
+# library versions, and compare() lines two of those files up case by case:
+#
+#     python bench.py --output before.json
+#     python bench.py --output after.json --compare before.json
+
+SEED = 20190121
+START_EPOCH = 1548043200  # 2019-01-21 09:30 IST
+START_PRICE = 400000
+SPREAD = 100
+TIMEFRAME = '1Min'
+
+# Sizes of every case, --quick runs the first size only
+TICK_ROWS = [200000, 800000]
+TRADE_BARS = [20000, 80000]
+SIGNAL_EVERY = 10
+BACKTEST_BARS = [20000, 80000]
+# name: (rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets, stops, overlaps)
+GRIDS = {"1-config": ([14], [40], [60], [7, 42], [600], [300], [True]),
+         "12-configs": ([14, 21], [40, 45], [55, 60], [7, 14, 35], [600, 900], [300, 600], [True])}
+
+
+def synthetic_ticks(rows, seed=SEED):
+    # Epochs (whole seconds), bids and asks of a random walk, a few ticks a second
+    rng = np.random.default_rng(seed)
+    epochs = START_EPOCH + np.cumsum(rng.integers(0, 2, rows))
+    bids = START_PRICE + np.cumsum(rng.integers(-30, 31, rows))
+    return epochs, bids, bids + SPREAD
+
+
+def write_tick_log(filename, rows, seed=SEED):
+    # Tick log in the layout of the raw .log files (36 columns, see util.TICK_COLUMNS)
+    write_ticks(filename, *synthetic_ticks(rows, seed))
+
+
+def write_ticks(filename, epochs, bids, asks):
+    # Tick log of these epochs, bids and asks, with depth a tick apart
+    depth = [bids - 200, bids - 100, bids, asks, asks + 100, asks + 200]
+    fmt = "%d,X,1,2,3," + ",".join(["%d"] * 6) + ",0" * 25
+    np.savetxt(filename, np.column_stack([epochs] + depth), fmt=fmt)
+
+
+def synthetic_ohlc(bars, seed=SEED):
+    # Bid and ask 1 minute bars of a random walk, like util.resample gives after dropna
+    rng = np.random.default_rng(seed)
+    opens = START_PRICE + np.cumsum(rng.integers(-60, 61, bars)).astype(float)
+    closes = opens + rng.integers(-60, 61, bars)
+    highs = np.maximum(opens, closes) + rng.integers(0, 80, bars)
+    lows = np.minimum(opens, closes) - rng.integers(0, 80, bars)
+    index = pd.DatetimeIndex(pd.to_datetime(START_EPOCH, unit="s") + IST_OFFSET +
+                             pd.to_timedelta(np.arange(bars), unit="min"), name="Timestamp")
+    bid = pd.DataFrame({"open": opens, "high": highs, "low": lows, "close": closes}, index=index)
+    return bid, bid + SPREAD
+
+
+def accepts(function, keyword):
+    return keyword in inspect.signature(function).parameters
+
+
+def grid_configs(overlaps, rsi_windows, rsi_overbought_bounds, rsi_oversold_bounds, ema_values):
+    # The configurations of trade.ohlc_grid, for commits before it
+    for overlap in overlaps:
+        for rsi_window in rsi_windows:
+            for rsi_upper in rsi_overbought_bounds:
+                for rsi_lower in rsi_oversold_bounds:
+                    for slow_ema in ema_values:
+                        for fast_ema in ema_values:
+                            if slow_ema <= fast_ema or slow_ema < 28 or fast_ema > 15:
+                                break
+                            yield overlap, rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema
+
+
+def grid_settings(grid):
+    # Number of settings (configuration, target, stop) ohlc_backtest visits at most on a grid
+    rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets, stops, overlaps = grid
+    configs = len(list((ohlc_grid or grid_configs)(overlaps, rsi_windows, rsi_overbought_bounds,
+                                                    rsi_oversold_bounds, ema_values)))
+    return configs * sum(1 for target in targets for stop in stops if stop < target)
+
+
+def resample_case(rows, workdir):
+    filename = os.path.join(workdir, "bench-{}.log".format(rows))
+    if not os.path.exists(filename):
+        write_tick_log(filename, rows)
+
+    def run():
+        bid, ask = resample(filename, TIMEFRAME)
+        return len(ask)
+    return run
+
+
+def trade_case(bars):
+    # The per-signal make_long / make_short API on a signal every SIGNAL_EVERY bars
+    bid, ask = synthetic_ohlc(bars)
+    rows = [(ask.index[p], ask.iloc[p]) for p in range(0, bars - 1, SIGNAL_EVERY)]
+
+    use_book = OpenPositions is not None and accepts(make_long, "book")
+    use_exits = exit_arrays is not None and accepts(make_long, "exits")
+
+    def run():
+        longs, shorts = [], []
+        long_options, short_options = {}, {}
+        if use_book:
+            long_options["book"], short_options["book"] = OpenPositions(), OpenPositions()
+        if use_exits:
+            long_options["exits"], short_options["exits"] = exit_arrays(bid), exit_arrays(ask)
+        for row in rows:
+            longs.append(make_long(longs, bid, row, lots=1, overlap=True, target=600, stop=300, max_lots=10,
+                                   **long_options))
+            shorts.append(make_short(shorts, ask, row, lots=1, overlap=True, target=600, stop=300, max_lots=10,
+                                     **short_options))
+        return len(rows)
+    return run
+
+
+def backtest_case(bars, grid, workdir):
+    bid, ask = synthetic_ohlc(bars)
+    use_cache = IndicatorCache is not None and accepts(ohlc_backtest, "cache")
+
+    def run():
+        options = {"cache": IndicatorCache()} if use_cache else {}
+        # A fresh store in its own directory every run, so the runs all write the same amount.
+        # The store is named relative to it, older write_trades only take relative names
+        cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp(prefix="bench-store-", dir=workdir))
+        try:
+            # The sweep prints its summary, which is not what is being timed
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                ohlc_backtest(bid.copy(), ask.copy(), *grid, 1, 10, "bench-store", **options)
+        finally:
+            os.chdir(cwd)
+        return bars
+    return run
+
+
+def measure(run, repeat):
+    # Best of repeat timed runs, the times of all of them, peak traced memory of one more run
+    # and what run returns (the bars or signals it went through)
+    count = run()  # warm up imports, caches and the page cache
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(seconds), seconds, peak, count
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {"commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count()}
+
+
+def run_benchmarks(repeat=3, quick=False, workdir=None):
+    # Result of every case, see the module comment
+    sizes = (lambda values: values[:1]) if quick else (lambda values: values)
+    cases = []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = workdir or tmp
+        for rows in sizes(TICK_ROWS):
+            cases.append(({"case": "resample", "ticks": rows}, resample_case(rows, workdir)))
+        for bars in sizes(TRADE_BARS):
+            cases.append(({"case": "make_long/make_short", "bars": bars}, trade_case(bars)))
+        for bars in sizes(BACKTEST_BARS):
+            for name, grid in GRIDS.items():
+                cases.append(({"case": "ohlc_backtest", "bars": bars, "grid": name,
+                               "settings": grid_settings(grid)}, backtest_case(bars, grid, workdir)))
+
+        results = []
+        for case, run in cases:
+            best, seconds, peak, count = measure(run, repeat)
+            result = dict(case)
+            result.update({"seconds": best, "runs": seconds, "peak_bytes": peak})
+            if "ticks" in case:
+                result["ticks_per_s"] = case["ticks"] / best
+                result["bars_per_s"] = count / best
+            elif case["case"] == "ohlc_backtest":
+                result["bars_per_s"] = count / best
+                result["settings_per_s"] = case["settings"] / best
+            else:
+                result["bars_per_s"] = case["bars"] / best
+                result["signals_per_s"] = count / best
+            print("{} : {:.4f} s : {:.1f} MB peak".format(case_name(result), best, peak / 1e6))
+            results.append(result)
+    return {"seed": SEED, "repeat": repeat, "quick": quick, "environment": environment(), "results": results}
+
+
+def case_name(result):
+    return "-".join(str(result[key]) for key in ("case", "ticks", "bars", "grid") if key in result)
+
+
+def compare(old, new):
+    # Print the speedup (old time / new time) and peak memory change of every case both runs have
+    old_cases = {case_name(result): result for result in old["results"]}
+    for result in new["results"]:
+        name = case_name(result)
+        before = old_cases.get(name)
+        if before is None:
+            continue
+        print("{} : {:.2f}x faster, peak {:+.1f} MB".format(name, before["seconds"] / result["seconds"],
+                                                             (result["peak_bytes"] - before["peak_bytes"]) / 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths on seeded synthetic data")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="smallest size of every case only")
+    parser.add_argument("--compare", help="earlier output to compare against")
+    args = parser.parse_args()
+
+    report = run_benchmarks(repeat=args.repeat, quick=args.quick)
+    with open(args.output, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as infile:
+            compare(json.load(infile), report)
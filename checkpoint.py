@@ -0,0 +1,135 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+# Durable checkpoint of a sweep, so an interrupted run carries on where it stopped.
+# Every finished setting (the settings string of ohlc_backtest) is appended to a
+# json lines file with its result, or none, and whether it ended the stop loop.
+# On restart those settings are replayed from the file instead of simulated.
+# The first line holds a key made from the bid/ask data and the run arguments;
+# when it doesn't match the file is started over, since the old results no
+# longer apply. Lines are written in batches, after the trade store has been
+# flushed, so a setting in the checkpoint always has its trades on disk.
+
+
+def frame_digest(digest, frame):
+    digest.update(pd.to_datetime(frame.index).values.astype("datetime64[ns]").view("int64").tobytes())
+    digest.update(np.ascontiguousarray(frame[["open", "high", "low", "close"]].to_numpy(dtype=float)).tobytes())
+
+
+def sweep_key(bid, ask, *arguments):
+    # Changes whenever the data or one of the arguments (lots, max_lots...) changes
+    digest = hashlib.sha1()
+    frame_digest(digest, bid)
+    frame_digest(digest, ask)
+    digest.update(repr(arguments).encode())
+    return digest.hexdigest()[:16]
+
+
+def encode_result(result):
+    if result is None:
+        return None
+    result = dict(result)
+    if isinstance(result.get("average_trade_time"), pd.Timedelta):
+        result["average_trade_time"] = result["average_trade_time"].value
+    return result
+
+
+def decode_result(result):
+    if result is None:
+        return None
+    if result.get("average_trade_time") is not None:
+        result["average_trade_time"] = pd.Timedelta(result["average_trade_time"])
+    return result
+
+
+class Checkpoint:
+
+    def __init__(self, path, key, every=100):
+        # path - checkpoint file, key - sweep_key of the run, every - settings per write
+        self.path = path
+        self.key = key
+        self.every = every
+        self.done = {}
+        self.store = None
+        self.writer = None
+        self._pending = []
+
+        if self._load():
+            self._file = open(path, "a")
+        else:
+            self._file = open(path, "w")
+            self._file.write(json.dumps({"key": key}) + "\n")
+            self._sync()
+        if len(self.done) != 0:
+            print("Checkpoint : resuming {} with {} settings done".format(path, len(self.done)))
+
+    def _load(self):
+        # Read a matching checkpoint, returns False when it has to be started over
+        if not os.path.exists(self.path):
+            return False
+        good = 0
+        with open(self.path, "rb") as infile:
+            header = infile.readline()
+            try:
+                if json.loads(header)["key"] != self.key:
+                    print("Checkpoint : input data changed, starting {} over".format(self.path))
+                    return False
+            except (ValueError, KeyError):
+                return False
+            good = infile.tell()
+            for line in infile:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if record is None or not line.endswith(b"\n"):
+                    break  # cut short by the interruption, everything after it is dropped
+                self.done[record["settings"]] = (decode_result(record["result"]), record["stopped"])
+                good = infile.tell()
+        os.truncate(self.path, good)
+        return True
+
+    def bind(self, store, writer=None):
+        # Write through writer (a BackgroundWriter), flushing store (a TradeStore) first
+        self.store = store
+        self.writer = writer
+
+    def outcome(self, settings):
+        # (result, stopped) of a finished setting, None if it still has to run
+        return self.done.get(settings)
+
+    def record(self, settings, result, stopped):
+        self.done[settings] = (result, stopped)
+        self._pending.append(json.dumps({"settings": settings, "result": encode_result(result),
+                                         "stopped": stopped}) + "\n")
+        if len(self._pending) >= self.every:
+            self.commit()
+
+    def commit(self):
+        # The lines are written after everything queued on the writer so far, trades included
+        lines, self._pending = self._pending, []
+        if len(lines) == 0:
+            return
+        if self.writer is None:
+            self._write(lines)
+        else:
+            self.writer.submit(self._write, lines)
+
+    def _write(self, lines):
+        if self.store is not None:
+            self.store.flush()
+        self._file.writelines(lines)
+        self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        # Once the writer has been closed whatever is left is written here
+        self.writer = None
+        self.commit()
+        self._file.close()
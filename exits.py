@@ -0,0 +1,174 @@
+import numpy as np
+from records import to_nanoseconds
+
+# Exit search for make_long / make_short.
+# The bid/ask frames are sorted by timestamp, so instead of walking the frame
+# with iterrows() from the first row we binary search for the first bar after
+# the entry and scan the opens from there as a numpy array.
+
+SCAN_BLOCK = 256
+
+
+def exit_arrays(dataframe):
+    # Timestamps (int64 nanoseconds) and open prices of a bid/ask ohlc frame
+    return to_nanoseconds(dataframe.index), dataframe['open'].to_numpy()
+
+
+def first_bar_after(index, timestamp):
+    # Position of the first bar strictly after timestamp
+    return int(np.searchsorted(index, timestamp, side='right'))
+
+
+def first_touch(opens, start, upper, lower):
+    # Position of the first bar from start whose open is >= upper or <= lower, -1 if none.
+    # Most trades close within a few bars, so scan in growing blocks rather than
+    # comparing the whole remaining frame at once.
+    n = len(opens)
+    block = SCAN_BLOCK
+    while start < n:
+        end = min(start + block, n)
+        window = opens[start:end]
+        hits = np.flatnonzero((window >= upper) | (window <= lower))
+        if len(hits) != 0:
+            return start + int(hits[0])
+        start = end
+        block *= 2
+    return -1
+
+
+def find_exit(index, opens, timestamp_of_entry, upper, lower):
+    # index, opens from exit_arrays.
+    # Returns the position of the exit bar, -1 if neither level is touched
+    return first_touch(opens, first_bar_after(index, timestamp_of_entry), upper, lower)
+
+
+# Batched exits for a whole target x stop grid.
+# The first bar whose open is >= a level is the first bar where the running max of
+# the opens reaches it (and likewise for the running min and a lower level). The
+# running max/min are sorted, so one forward pass per entry resolves every target
+# and every stop with a binary search, and the exit of a (target, stop) pair is
+# whichever of its two levels is touched first.
+
+def touch_arrays(opens):
+    # Opens for the running max and running min, with missing bars never touching a level
+    missing = np.isnan(opens)
+    return np.where(missing, -np.inf, opens), np.where(missing, np.inf, opens)
+
+
+def first_touches(highs, lows, start, uppers, lowers):
+    # First position from start where the open is >= each of uppers and <= each of lowers, -1 if never
+    n = len(highs)
+    upper_positions = np.full(len(uppers), -1)
+    lower_positions = np.full(len(lowers), -1)
+    running_max = -np.inf
+    running_min = np.inf
+    block = SCAN_BLOCK
+    # Every pair is settled once all of its upper levels or all of its lower levels are found
+    while start < n and (upper_positions < 0).any() and (lower_positions < 0).any():
+        end = min(start + block, n)
+        window_max = np.maximum(np.maximum.accumulate(highs[start:end]), running_max)
+        window_min = np.minimum(np.minimum.accumulate(lows[start:end]), running_min)
+
+        pending = np.flatnonzero(upper_positions < 0)
+        found = np.searchsorted(window_max, uppers[pending], side='left')
+        hit = found < len(window_max)
+        upper_positions[pending[hit]] = start + found[hit]
+
+        pending = np.flatnonzero(lower_positions < 0)
+        found = np.searchsorted(-window_min, -lowers[pending], side='left')
+        hit = found < len(window_min)
+        lower_positions[pending[hit]] = start + found[hit]
+
+        running_max = window_max[-1]
+        running_min = window_min[-1]
+        start = end
+        block *= 2
+    return upper_positions, lower_positions
+
+
+def exit_grid(dataframe, ask, positions, targets, stops, side):
+    # Exit positions in dataframe of trades entered at the given positions of the ask frame,
+    # for every target and stop. side is 1 for longs and -1 for shorts.
+    # Returns an int array of shape (entries, targets, stops), -1 where the trade never exits.
+    index, opens = exit_arrays(dataframe)
+    highs, lows = touch_arrays(opens)
+    targets = np.asarray(targets, dtype=float)
+    stops = np.asarray(stops, dtype=float)
+    entry_prices = ask['close'].to_numpy()[positions]
+    starts = np.searchsorted(index, to_nanoseconds(ask.index)[positions], side='right')
+
+    exits = np.full((len(positions), len(targets), len(stops)), -1)
+    for i in range(len(positions)):
+        if side == 1:
+            uppers, lowers = entry_prices[i] + targets, entry_prices[i] - stops
+        else:
+            uppers, lowers = entry_prices[i] + stops, entry_prices[i] - targets
+        upper_positions, lower_positions = first_touches(highs, lows, starts[i], uppers, lowers)
+
+        if side == 1:
+            target_positions, stop_positions = upper_positions[:, None], lower_positions[None, :]
+        else:
+            target_positions, stop_positions = lower_positions[:, None], upper_positions[None, :]
+        # earliest of the two touches, ignoring the one that never happens
+        both = np.minimum(target_positions, stop_positions)
+        either = np.maximum(target_positions, stop_positions)
+        exits[i] = np.where(both < 0, either, both)
+    return exits
+
+
+# Tick-accurate exits.
+# A level is first touched inside the first bar whose high/low reaches it, so
+# the same running max/min search over highs and lows finds the one bar that
+# needs its ticks read; the exit is the first tick of that bar at or past the
+# target or the stop, filled at that tick's price.
+
+def tick_exit_grid(dataframe, ask, positions, targets, stops, side, ticks):
+    # Like exit_grid, with ticks a tickindex.TickIndex of the logs dataframe was resampled from.
+    # Longs (side 1) exit on the bid ticks and shorts (side -1) on the ask ticks.
+    # Returns the exit bars (-1 when the trade never exits), exit prices and exit
+    # timestamps (int64 nanoseconds), each of shape (entries, targets, stops).
+    index = to_nanoseconds(dataframe.index)
+    highs = dataframe['high'].to_numpy(dtype=float)
+    lows = dataframe['low'].to_numpy(dtype=float)
+    highs = np.where(np.isnan(highs), -np.inf, highs)
+    lows = np.where(np.isnan(lows), np.inf, lows)
+    tick_side = "B" if side == 1 else "A"
+    targets = np.asarray(targets, dtype=float)
+    stops = np.asarray(stops, dtype=float)
+    entry_prices = ask['close'].to_numpy()[positions]
+    starts = np.searchsorted(index, to_nanoseconds(ask.index)[positions], side='right')
+
+    shape = (len(positions), len(targets), len(stops))
+    exits = np.full(shape, -1)
+    prices = np.full(shape, np.nan)
+    times = np.zeros(shape, dtype="int64")
+    for i in range(len(positions)):
+        if side == 1:
+            uppers, lowers = entry_prices[i] + targets, entry_prices[i] - stops
+        else:
+            uppers, lowers = entry_prices[i] + stops, entry_prices[i] - targets
+        upper_positions, lower_positions = first_touches(highs, lows, starts[i], uppers, lowers)
+
+        for t in range(len(targets)):
+            for s in range(len(stops)):
+                u, l = (t, s) if side == 1 else (s, t)
+                bar = first_of(upper_positions[u], lower_positions[l])
+                while bar >= 0:
+                    touch = ticks.first_touch(index[bar], tick_side, uppers[u], lowers[l])
+                    if touch is not None:
+                        exits[i, t, s] = bar
+                        times[i, t, s], prices[i, t, s] = touch
+                        break
+                    # The bar and its ticks disagree, carry on from the next bar
+                    upper, lower = first_touches(highs, lows, bar + 1, uppers[u:u + 1], lowers[l:l + 1])
+                    bar = first_of(upper[0], lower[0])
+    return exits, prices, times
+
+
+def first_of(first, second):
+    # Earliest of two positions, ignoring -1
+    if first < 0:
+        return second
+    if second < 0:
+        return first
+    return min(first, second)
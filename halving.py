@@ -0,0 +1,198 @@
+import math
+import numpy as np
+from trade import make_longs, make_shorts, settings_name, is_result
+from exits import exit_grid
+from indicators import IndicatorCache
+from strategies import ema_rsi, entry_positions
+from metrics import trade_metrics, sample_span
+from tradestore import TradeStore
+from writer import BackgroundWriter
+from util import write_result
+from records import to_nanoseconds
+
+# Successive halving search over the ohlc_backtest grid.
+# Every setting (indicator configuration + target + stop) is first scored on a
+# short prefix of the data; only the best fraction survives to the next rung,
+# which runs on a longer prefix, until the last rung runs the survivors on all
+# of it. The indicators are causal, so the signals on a prefix are the first
+# bars of the signals on the full data and are computed once per configuration.
+#
+# Pruning is explicit: GRID_RULES drop settings before anything runs, on the
+# earlier rungs settings are cut by rank on the score (early_rules can drop
+# more), and RESULT_RULES are applied to the metrics of the last rung. Survivors
+# of the last rung are results under the same condition as in ohlc_backtest
+# (trade.is_result), their trades are stored either way. A short
+# prefix may hold no signals for a good setting, so those are ranked last
+# rather than dropped outright. Unlike the breaks in ohlc_backtest a rule only
+# drops the setting that fails it, never the rest of a loop. Every decision
+# goes to the report returned next to the results.
+
+# (share of the bars, share of the scored settings kept) for every rung
+SCHEDULE = [(0.125, 0.25), (0.25, 0.25), (0.5, 0.5), (1.0, 1.0)]
+
+# A setting is (overlap, rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema, target, stop).
+# These are the limits ohlc_backtest applies with breaks.
+GRID_RULES = [("slow_ema <= fast_ema", lambda setting: setting[4] <= setting[5]),
+              ("slow_ema < 28", lambda setting: setting[4] < 28),
+              ("fast_ema > 15", lambda setting: setting[5] > 15),
+              ("stop >= target", lambda setting: setting[7] >= setting[6])]
+
+RESULT_RULES = [("no longs closed", lambda metrics: metrics["num_longs"] == 0),
+                ("no shorts closed", lambda metrics: metrics["num_shorts"] == 0),
+                ("profitability_total < 0.3", lambda metrics: metrics["profitability_total"] < 0.3),
+                ("netpnl < 0", lambda metrics: metrics["netpnl"] < 0)]
+
+
+def full_grid(overlaps, rsi_windows, rsi_overbought_bounds, rsi_oversold_bounds, ema_values, targets, stops):
+    # Every setting, in the order ohlc_backtest visits them
+    for overlap in overlaps:
+        for rsi_window in rsi_windows:
+            for rsi_upper in rsi_overbought_bounds:
+                for rsi_lower in rsi_oversold_bounds:
+                    for slow_ema in ema_values:
+                        for fast_ema in ema_values:
+                            for target in targets:
+                                for stop in stops:
+                                    yield overlap, rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema, target, stop
+
+
+def broken_rule(rules, value):
+    # Name of the first rule that prunes value, None if it passes them all
+    for name, prune in rules:
+        if prune(value):
+            return name
+    return None
+
+
+def setting_score(metrics, score):
+    # Settings without signals or with an undefined score rank last
+    if metrics is None or metrics[score] is None or math.isnan(metrics[score]):
+        return -math.inf
+    return metrics[score]
+
+
+def time_window(frame, ask, start, end):
+    # Bars of frame from the time of ask bar start up to the time of ask bar end (excluded),
+    # open ended at the start and the end of the data
+    index = to_nanoseconds(frame.index)
+    ask_index = to_nanoseconds(ask.index)
+    first = 0 if start <= 0 else int(np.searchsorted(index, ask_index[start], side='left'))
+    last = len(frame) if end >= len(ask) else int(np.searchsorted(index, ask_index[end], side='left'))
+    return frame.iloc[first:last]
+
+
+def evaluate(bid, ask, settings, bars, lots, max_lots, instrument, cache, close, start=0, strategy=ema_rsi):
+    # Run settings on the bars from start up to bars, with the signals of the full data from strategy.
+    # Yields (setting, metrics, long_log, short_log), metrics is None when a side has no signals.
+    # bid and ask are dropna'd on their own, so their rows don't line up and bid is cut by time
+    bid_prefix = time_window(bid, ask, start, bars)
+    ask_prefix = ask.iloc[start:bars]
+    span = sample_span(ask_prefix)
+
+    by_config = {}
+    for setting in settings:
+        by_config.setdefault(setting[:6], []).append(setting)
+
+    for config, config_settings in by_config.items():
+        overlap = config[0]
+        long_mask, short_mask = strategy(cache, instrument, close, *config[1:])
+        long_positions, short_positions = entry_positions(long_mask[start:bars], short_mask[start:bars])
+
+        # One exit grid over the targets and stops this configuration still has
+        targets = sorted(set(setting[6] for setting in config_settings))
+        stops = sorted(set(setting[7] for setting in config_settings))
+        long_exits = exit_grid(bid_prefix, ask_prefix, long_positions, targets, stops, 1)
+        short_exits = exit_grid(ask_prefix, ask_prefix, short_positions, targets, stops, -1)
+
+        for setting in config_settings:
+            target, stop = setting[6], setting[7]
+            t, s = targets.index(target), stops.index(stop)
+            long_log = make_longs(bid_prefix, ask_prefix, long_positions, lots=lots, target=target, stop=stop,
+                                  overlap=overlap, max_lots=max_lots, exit_positions=long_exits[:, t, s])
+            short_log = make_shorts(ask_prefix, ask_prefix, short_positions, lots=lots, target=target, stop=stop,
+                                    overlap=overlap, max_lots=max_lots, exit_positions=short_exits[:, t, s])
+            metrics = None
+            if len(long_log) != 0 and len(short_log) != 0:
+                metrics = trade_metrics(long_log, short_log, span=span)
+            yield setting, metrics, long_log, short_log
+
+
+def halving_backtest(bid, ask, rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets, stops,
+                     overlaps, lots, max_lots, filename_parent, schedule=SCHEDULE, grid_rules=GRID_RULES,
+                     result_rules=RESULT_RULES, early_rules=(), score="netpnl", min_keep=1, cache=None,
+                     report_file=None, instrument=None, strategy=ema_rsi):
+    # Same arguments as ohlc_backtest plus the search settings:
+    # schedule - list of (share of bars, share kept) rungs, the last one should use all the bars
+    # grid_rules / result_rules / early_rules - lists of (name, function) that return True to prune,
+    # result_rules apply on the last rung and early_rules on the others
+    # score - result field the survivors are ranked on, higher is better
+    # min_keep - never keep fewer settings than this on a rung
+    # report_file - write the pruning report there as well (csv, see write_result)
+    # instrument - name of bid / ask in cache, filename_parent by default (as in ohlc_backtest)
+    # strategy - entry signals of a configuration, see strategies.py
+    # Returns the results of the last rung, in grid order, and the report
+    if cache is None:
+        cache = IndicatorCache()
+    if instrument is None:
+        instrument = filename_parent
+    close = ask['close'].to_numpy(dtype=float)
+
+    report = []
+    survivors = []
+    for setting in full_grid(overlaps, rsi_windows, rsi_overbought_bounds, rsi_oversold_bounds, ema_values, targets,
+                             stops):
+        rule = broken_rule(grid_rules, setting)
+        if rule is None:
+            survivors.append(setting)
+        else:
+            report.append({"settings": settings_name(setting), "rung": 0, "bars": 0, "score": None,
+                           "reason": "rule: " + rule})
+    print("Halving : {} settings after grid rules, {} pruned".format(len(survivors), len(report)))
+
+    results = []
+    with TradeStore(filename_parent) as store, BackgroundWriter(store) as writer:
+        for rung, (share, keep) in enumerate(schedule, 1):
+            bars = max(1, int(math.ceil(len(ask) * share)))
+            last = rung == len(schedule)
+
+            rules = result_rules if last else early_rules
+            scored = []
+            for setting, metrics, long_log, short_log in evaluate(bid, ask, survivors, bars, lots, max_lots,
+                                                                  instrument, cache, close, strategy=strategy):
+                if metrics is None:
+                    rule = "no signals" if last else None
+                else:
+                    rule = broken_rule(rules, metrics)
+                if rule is not None:
+                    report.append({"settings": settings_name(setting), "rung": rung, "bars": bars,
+                                   "score": setting_score(metrics, score), "reason": "rule: " + rule})
+                    continue
+                # Trades are only kept for the last rung
+                scored.append((setting, metrics, (long_log, short_log) if last else None))
+
+            kept = max(min_keep, int(math.ceil(len(scored) * keep)))
+            # sorted is stable, equal scores keep grid order
+            ranking = sorted(range(len(scored)), key=lambda i: setting_score(scored[i][1], score), reverse=True)
+            for i in ranking[kept:]:
+                setting, metrics, _ = scored[i]
+                report.append({"settings": settings_name(setting), "rung": rung, "bars": bars,
+                               "score": setting_score(metrics, score), "reason": "rank"})
+            kept = sorted(ranking[:kept])
+            survivors = [scored[i][0] for i in kept]
+            print("Halving rung {} : {} bars, {} scored, {} kept".format(rung, bars, len(scored), len(survivors)))
+
+            if last:
+                for i in kept:
+                    setting, metrics, (long_log, short_log) = scored[i]
+                    settings = settings_name(setting)
+                    if is_result(metrics):
+                        results.append(dict(settings=settings, **metrics))
+                    else:
+                        report.append({"settings": settings, "rung": rung, "bars": bars,
+                                       "score": setting_score(metrics, score), "reason": "not a result"})
+                    writer.append(settings, long_log, short_log)
+
+    if report_file is not None and len(report) != 0:
+        # Not results, kept out of the catalog
+        write_result(report, report_file, catalog=None)
+    return results, report
@@ -0,0 +1,93 @@
+import time
+import hashlib
+import talib
+import numpy as np
+from collections import OrderedDict
+
+# Memoized indicator series shared across the parameter grid.
+# For a given instrument and period the RSI / EMA series never changes, so the
+# sweeps look them up here instead of recomputing them for every target/stop.
+# Series are keyed by a digest of the close prices as well, so a cache reused
+# on other bars under the same instrument name (another date range, a
+# walk-forward fold) computes them again instead of returning stale ones.
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+INDICATORS = {
+    "RSI": lambda close, period: talib.RSI(close, timeperiod=period),
+    "EMA": lambda close, period: talib.EMA(close, timeperiod=period),
+}
+
+
+class IndicatorCache:
+    # LRU cache of indicator arrays keyed by (instrument, indicator, period, digest of the close prices),
+    # bounded by the total size of the cached arrays
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.seconds = 0.0  # spent computing the series that missed
+        self._series = OrderedDict()
+        self._close = None  # (close, digest) of the last close prices looked up
+
+    def close_key(self, close):
+        # Digest of close. Sweeps look up every series with the same array, which is only hashed once
+        if self._close is not None and self._close[0] is close:
+            return self._close[1]
+        values = np.ascontiguousarray(close, dtype=float)
+        digest = hashlib.sha1(values).hexdigest()
+        self._close = (close, digest)
+        return digest
+
+    def get(self, instrument, indicator, period, close):
+        key = (instrument, indicator, period, self.close_key(close))
+        values = self._series.get(key)
+        if values is not None:
+            self.hits += 1
+            self._series.move_to_end(key)
+            return values
+
+        self.misses += 1
+        start = time.perf_counter()
+        values = np.asarray(INDICATORS[indicator](np.asarray(close, dtype=float), period), dtype=float)
+        self.seconds += time.perf_counter() - start
+        return self.put(instrument, indicator, period, values, close)
+
+    def put(self, instrument, indicator, period, values, close):
+        # Add a series of close computed elsewhere, e.g. by another process
+        # Shared between settings, nobody should write into it
+        values.setflags(write=False)
+        key = (instrument, indicator, period, self.close_key(close))
+        replaced = self._series.pop(key, None)
+        if replaced is not None:
+            self.nbytes -= replaced.nbytes
+        self._series[key] = values
+        self.nbytes += values.nbytes
+        self._evict()
+        return values
+
+    def rsi(self, instrument, close, period):
+        return self.get(instrument, "RSI", period, close)
+
+    def ema(self, instrument, close, period):
+        return self.get(instrument, "EMA", period, close)
+
+    def _evict(self):
+        # Drop least recently used series until we are back under budget, always keeping the newest one
+        while self.nbytes > self.max_bytes and len(self._series) > 1:
+            key, values = self._series.popitem(last=False)
+            self.nbytes -= values.nbytes
+
+    def clear(self):
+        self._series.clear()
+        self._close = None
+        self.nbytes = 0
+
+    def stats(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._series),
+                "bytes": self.nbytes,
+                "seconds": self.seconds}
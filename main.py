@@ -1,14 +1,16 @@
-import pandas as pd
 from trade import ohlc_backtest
+from sweep import parallel_ohlc_backtest
+from halving import halving_backtest
 from util import write_result
+from indicators import IndicatorCache
+from barcache import cached_ohlc_csv
+from writer import BackgroundWriter
 
 if __name__ == "__main__":
-    bid = pd.read_csv("bid_ohlc_1min.csv")
-    bid.set_index(["Timestamp"], drop=True, inplace=True)
-    bid.dropna(inplace=True)
-    ask = pd.read_csv("ask_ohlc_1min.csv")
-    ask.set_index(["Timestamp"], drop=True, inplace=True)
-    ask.dropna(inplace=True)
+    # Parsed once into the bar cache, later runs memory-map the arrays
+    bid, ask = cached_ohlc_csv("bid_ohlc_1min.csv", "ask_ohlc_1min.csv")
+    bid = bid.dropna()
+    ask = ask.dropna()
     # file_list = get_list_of_files('./', '.log')
 
     # file_list = ['CRUDEOIL.2019FEB.211960.20190121.log','CRUDEOIL.2019FEB.211960.20190128.log']
@@ -18,8 +20,6 @@ if __name__ == "__main__":
     #     if int(parts[-2]) < 20190129:
     #         file_list.remove(file)
 
-    # pool = multiprocessing.Pool(2)
-    # output = pool.map(get_default_backtest, ["bid_ohlc.csv","ask_ohlc.csv"])
     # NORMAL
     # rsi_windows = [14,21,28]  # 3
     # rsi_oversold_bounds = [35,40,45] # 3
@@ -45,11 +45,46 @@ if __name__ == "__main__":
     lots = 1
     max_lots = range(5,20)
 
+    # Finished settings are checkpointed per max_lots, an interrupted run picks up where it stopped.
+    # Number of worker processes for the sweep, None uses every core and 1 runs in this process
+    workers = None
+
+    # Successive halving instead of the exhaustive sweep, see halving.SCHEDULE for the pruning schedule
+    halving = False
+
+    # Indicator series don't depend on max_lots, compute them once for the whole run
+    cache = IndicatorCache()
+
+    # Results are written in the background while the next max_lots sweep runs
+    result_writer = BackgroundWriter()
+
     for m_lot in max_lots:
-        results = ohlc_backtest(bid, ask, rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets,
-                                stops,
-                                overlaps, lots, m_lot, filename_parent="new-test-1min")
+        # Trades of every max_lots go to their own store, the indicator series are shared as "new-test-1min"
+        run = "new-test-1min - {}".format(m_lot)
+        if halving:
+            results, report = halving_backtest(bid, ask, rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds,
+                                               ema_values, targets, stops,
+                                               overlaps, lots, m_lot, filename_parent=run, cache=cache,
+                                               report_file="Pruning-1min - {}".format(m_lot),
+                                               instrument="new-test-1min")
+        elif workers == 1:
+            results = ohlc_backtest(bid, ask, rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values,
+                                    targets, stops,
+                                    overlaps, lots, m_lot, filename_parent=run, cache=cache,
+                                    checkpoint=run + ".checkpoint", instrument="new-test-1min")
+        else:
+            results = parallel_ohlc_backtest(bid, ask, rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds,
+                                             ema_values, targets, stops,
+                                             overlaps, lots, m_lot, filename_parent=run, workers=workers,
+                                             checkpoint=run + ".checkpoint")
 
         print(results)
 
-        write_result(results,file="Finalresults-1min - {}.csv".format(m_lot))
+        # Also indexed in the result catalog, see resultcatalog.top for the best settings
+        result_writer.submit(write_result, results, "Finalresults-1min - {}.csv".format(m_lot),
+                             data_file="bid_ohlc_1min.csv", timeframe="1Min", lots=lots, max_lots=m_lot)
+
+    result_writer.close()
+
+    if workers == 1 or halving:
+        print("Indicator cache : {}".format(cache.stats()))
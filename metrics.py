@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+from records import ExitType, NAT
+
+# Result metrics of one setting, worked out in a single vectorized pass over the
+# TradeLog records of both sides instead of a Python loop per metric.
+# Besides the original fields this gives a real drawdown: closed trades are
+# booked at their exit time into an equity curve and max_DD is the largest drop
+# from a running peak of that curve (worst_trade is what max_DD used to be).
+# sharpe is per closed trade (mean / standard deviation of trade pnl, not
+# annualised) and exposure is the share of the sample with a position open.
+
+BROKERAGE = 838 / 1000000000  # per rupee of turnover
+
+
+def side_metrics(records, turnover_lots=1):
+    pnl = records["pnl"]
+    codes = records["type_of_exit"]
+    has_pnl = ~np.isnan(pnl)
+    wins = int(np.count_nonzero(codes == ExitType.WIN))
+    losses = int(np.count_nonzero(codes == ExitType.LOSS))
+    gross = pnl[has_pnl].sum()
+    # Rejected shorts carry a pnl of 0 but no entry price, so they add nothing to turnover
+    turnover = np.nansum(records["entry_price"][has_pnl]) * turnover_lots
+    return {"net": float(gross - turnover * BROKERAGE),
+            "wins": wins,
+            "closed": wins + losses}
+
+
+def equity_drawdown(exits, pnl):
+    # Largest peak to trough drop of the cumulative pnl of closed trades, booked in exit order (0 or negative)
+    if len(pnl) == 0:
+        return 0.0
+    equity = np.cumsum(pnl[np.argsort(exits, kind="mergesort")])
+    peak = np.maximum(np.maximum.accumulate(equity), 0)
+    return float((equity - peak).min())
+
+
+def exposure(entries, exits, span):
+    # Share of span (nanoseconds) covered by at least one open trade
+    if span is None or span <= 0 or len(entries) == 0:
+        return float("nan")
+    order = np.argsort(entries, kind="mergesort")
+    starts, ends = entries[order], exits[order]
+    # With trades sorted by entry, each one only adds the time past the latest exit before it
+    reach = np.concatenate(([starts[0]], np.maximum.accumulate(ends)[:-1]))
+    covered = np.maximum(ends - np.maximum(starts, reach), 0).sum()
+    return float(covered / span)
+
+
+def trade_metrics(long_log, short_log, turnover_lots=1, span=None):
+    # Metrics of one setting from its long and short TradeLogs.
+    # turnover_lots multiplies the entry prices for turnover (do_backtest uses lots),
+    # span is the length of the sample in nanoseconds, for exposure
+    longs = side_metrics(long_log.records, turnover_lots)
+    shorts = side_metrics(short_log.records, turnover_lots)
+
+    records = np.concatenate((long_log.records, short_log.records))
+    pnl = records["pnl"]
+    pnl = pnl[~np.isnan(pnl)]
+    closed = records[records["timestamp_of_exit"] != NAT]
+    entries = closed["timestamp_of_entry"]
+    exits = closed["timestamp_of_exit"]
+    closed_pnl = closed["pnl"]
+
+    num_longs, num_shorts = longs["closed"], shorts["closed"]
+    number_of_trades = num_longs + num_shorts
+    max_dd = equity_drawdown(exits, closed_pnl)
+    average_pnl = float(pnl.mean()) if len(pnl) != 0 else float("nan")
+    sharpe = float("nan")
+    if len(closed_pnl) > 1 and closed_pnl.std(ddof=1) != 0:
+        sharpe = float(closed_pnl.mean() / closed_pnl.std(ddof=1))
+    average_trade_time = None
+    if len(closed) != 0:
+        average_trade_time = pd.Timedelta(int((exits - entries).sum())) / len(closed)
+
+    return {"netlongpnl": longs["net"],
+            "netshortpnl": shorts["net"],
+            "netpnl": shorts["net"] + longs["net"],
+            "profitability_longs": longs["wins"] / num_longs if num_longs != 0 else float("nan"),
+            "profitability_shorts": shorts["wins"] / num_shorts if num_shorts != 0 else float("nan"),
+            "profitability_total": (longs["wins"] + shorts["wins"]) / number_of_trades
+            if number_of_trades != 0 else float("nan"),
+            "number_of_trades": number_of_trades,
+            "num_longs": num_longs,
+            "num_shorts": num_shorts,
+            "max_profit": float(pnl.max()) if len(pnl) != 0 else float("nan"),
+            "max_DD": max_dd,
+            "average_pnl": average_pnl,
+            "apnl/max_DD": average_pnl / abs(max_dd) if max_dd != 0 else float("nan"),
+            "average_trade_time": average_trade_time,
+            "long_max_concurrent": int(long_log.records["open_lots"].max()) if len(long_log) != 0 else 0,
+            "short_max_concurrent": int(short_log.records["open_lots"].min()) if len(short_log) != 0 else 0,
+            "worst_trade": float(pnl.min()) if len(pnl) != 0 else float("nan"),
+            "sharpe": sharpe,
+            "exposure": exposure(entries, exits, span)}
+
+
+def sample_span(frame):
+    # Length in nanoseconds of an ohlc frame's sample, for trade_metrics
+    if len(frame) == 0:
+        return None
+    index = pd.to_datetime(frame.index[[0, -1]])
+    return int(index[1].value - index[0].value)
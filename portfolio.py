@@ -0,0 +1,258 @@
+import os
+import heapq
+import multiprocessing
+from contextlib import ExitStack
+import numpy as np
+import pandas as pd
+from trade import ohlc_grid, run_ohlc_config, target_stop_pairs
+from sweep import share_frame, attach_frame, chunk_grid, _CollectTrades
+from indicators import IndicatorCache
+from metrics import BROKERAGE, equity_drawdown, sample_span
+from positions import STILL_OPEN
+from records import NAT
+from runstats import RunStats
+from signalcache import SignalCache
+from tradestore import TradeStore
+from writer import BackgroundWriter
+from barcache import load_bars
+
+# Portfolio backtest over several instruments (contracts / expiries).
+# The ohlc_backtest sweeps of all the instruments share one process pool. The
+# grid of every instrument is cut into chunks of configurations and the chunks
+# are handed out longest first (bars x configurations), so a long contract
+# starts early instead of holding up the end of the batch. Each instrument keeps
+# its own trade store, written in grid order as in sweep.py.
+#
+# The best setting of every instrument (by score) is then replayed as one
+# portfolio: trades of all instruments are taken in entry order against shared
+# capital and a shared lot limit. A trade is rejected when the portfolio already
+# holds portfolio_max_lots or its margin doesn't fit in the equity left, and the
+# accepted trades make one equity curve booked at their exit times.
+
+# Per-process state set up by _init_worker
+_worker = {}
+
+
+def group_logs(file_list):
+    # Logs by contract, e.g. CRUDEOIL.2019FEB.211960.20190121.log goes to CRUDEOIL.2019FEB.211960
+    groups = {}
+    for filename in sorted(file_list):
+        contract = ".".join(os.path.basename(filename).split(".")[:-2])
+        groups.setdefault(contract, []).append(filename)
+    return groups
+
+
+def load_instruments(groups, timeframe='1Min'):
+    # {name: (bid, ask)} of every group of logs, through the bar cache
+    instruments = {}
+    for name, file_list in groups.items():
+        bid, ask = load_bars(file_list, timeframe)
+        instruments[name] = (bid.dropna(), ask.dropna())
+    return instruments
+
+
+def _init_worker(specs, targets, stops, lots, max_lots, stats, reuse_signals):
+    frames = {}
+    blocks = []
+    for name, (bid_spec, ask_spec) in specs.items():
+        bid, bid_blocks = attach_frame(bid_spec)
+        ask, ask_blocks = attach_frame(ask_spec)
+        frames[name] = (bid, ask, ask['close'].to_numpy(dtype=float), sample_span(ask))
+        blocks += bid_blocks + ask_blocks
+    _worker.update({"frames": frames,
+                    # keep the blocks referenced for as long as the frames live
+                    "blocks": blocks,
+                    # series and entry sets are keyed by instrument, one cache of each serves all of them
+                    "cache": IndicatorCache(),
+                    "signals": SignalCache() if reuse_signals else None,
+                    "targets": targets,
+                    "stops": stops,
+                    "lots": lots,
+                    "max_lots": max_lots,
+                    "stats": stats})
+
+
+def _run_task(task):
+    name, number, configs = task
+    bid, ask, close, span = _worker["frames"][name]
+    results = []
+    collected = _CollectTrades()
+    stats = _worker["stats"].worker()
+    cache_state = RunStats.cache_state(_worker["cache"])
+    for config in configs:
+        results += run_ohlc_config(bid, ask, config, _worker["targets"], _worker["stops"], _worker["lots"],
+                                   _worker["max_lots"], name, _worker["cache"], collected, close=close, span=span,
+                                   stats=stats, signals=_worker["signals"])
+    stats.add_cache(_worker["cache"], cache_state)
+    return name, number, results, collected.trades, stats.state()
+
+
+def portfolio_tasks(bars, configs, chunk_size):
+    # (instrument, chunk number, configurations) of every chunk, the most expensive first.
+    # bars is {name: number of bars}
+    tasks = [(name, number, chunk) for name in bars for number, chunk in enumerate(chunk_grid(configs, chunk_size))]
+    # sorted is stable, equal costs keep instrument and grid order
+    return sorted(tasks, key=lambda task: bars[task[0]] * len(task[2]), reverse=True)
+
+
+def portfolio_trades(logs, lots, capital=None, margin_per_lot=0, portfolio_max_lots=None):
+    # Replay the trades of several instruments against shared capital and a shared lot limit.
+    # logs is {name: (long TradeLog, short TradeLog)}, margin_per_lot a number or {name: number},
+    # capital None for no capital limit and portfolio_max_lots None for no lot limit.
+    # Returns the accepted trades (in entry order), the equity curve and the counts of rejected trades
+    rows = []
+    for name, side_logs in logs.items():
+        for log in side_logs:
+            records = log.records
+            taken = records[~np.isnan(records["entry_price"])]  # overlaps and lot limits never entered
+            frame = pd.DataFrame({"instrument": name,
+                                  "side": log.side,
+                                  "timestamp_of_entry": taken["timestamp_of_entry"],
+                                  "timestamp_of_exit": taken["timestamp_of_exit"],
+                                  "entry_price": taken["entry_price"],
+                                  "type_of_exit": taken["type_of_exit"],
+                                  "pnl": taken["pnl"]})
+            rows.append(frame)
+    if len(rows) == 0:
+        return pd.DataFrame(), pd.Series(dtype=float), {"rejected_lots": 0, "rejected_capital": 0}
+    trades = pd.concat(rows, ignore_index=True)
+    # Stable, so trades entered together keep instrument order, longs before shorts
+    trades = trades.iloc[np.argsort(trades["timestamp_of_entry"].to_numpy(), kind="mergesort")]
+    trades["net_pnl"] = trades["pnl"] - trades["entry_price"] * BROKERAGE
+
+    entries = trades["timestamp_of_entry"].to_numpy()
+    exits = trades["timestamp_of_exit"].to_numpy()
+    exits = np.where(exits == NAT, STILL_OPEN, exits)
+    net = trades["net_pnl"].to_numpy()
+    margins = np.array([(margin_per_lot.get(name, 0) if isinstance(margin_per_lot, dict) else margin_per_lot) * lots
+                        for name in trades["instrument"]], dtype=float)
+
+    accepted = np.zeros(len(trades), dtype=bool)
+    rejected = {"rejected_lots": 0, "rejected_capital": 0}
+    book = []  # (exit, trade) of the open trades
+    open_lots = 0
+    used_margin = 0.0
+    realized = 0.0
+    for i in range(len(trades)):
+        # Trades closed by this entry free their lots and margin and book their pnl
+        while len(book) != 0 and book[0][0] <= entries[i]:
+            _, j = heapq.heappop(book)
+            open_lots -= lots
+            used_margin -= margins[j]
+            realized += net[j]
+        if portfolio_max_lots is not None and open_lots >= portfolio_max_lots:
+            rejected["rejected_lots"] += 1
+            continue
+        if capital is not None and used_margin + margins[i] > capital + realized:
+            rejected["rejected_capital"] += 1
+            continue
+        accepted[i] = True
+        heapq.heappush(book, (exits[i], i))
+        open_lots += lots
+        used_margin += margins[i]
+
+    trades = trades[accepted].reset_index(drop=True)
+    closed = trades[trades["timestamp_of_exit"] != NAT]
+    closed = closed.iloc[np.argsort(closed["timestamp_of_exit"].to_numpy(), kind="mergesort")]
+    equity = pd.Series(np.cumsum(closed["net_pnl"].to_numpy()) + (capital or 0.0),
+                       index=pd.DatetimeIndex(closed["timestamp_of_exit"].to_numpy().view("datetime64[ns]"),
+                                              name="Timestamp"), name="equity")
+    for column in ["timestamp_of_entry", "timestamp_of_exit"]:
+        trades[column] = trades[column].to_numpy().view("datetime64[ns]")
+    return trades, equity, rejected
+
+
+def portfolio_summary(trades, equity, rejected, capital=None):
+    closed = trades[~trades["timestamp_of_exit"].isna()] if len(trades) != 0 else trades
+    netpnl = float(trades["net_pnl"].sum()) if len(trades) != 0 else 0.0
+    max_dd = equity_drawdown(closed["timestamp_of_exit"].to_numpy().view("int64"), closed["net_pnl"].to_numpy()) \
+        if len(closed) != 0 else 0.0
+    summary = {"netpnl": netpnl,
+               "number_of_trades": len(closed),
+               "open_trades": len(trades) - len(closed),
+               "instruments": int(trades["instrument"].nunique()) if len(trades) != 0 else 0,
+               "max_DD": max_dd,
+               "final_equity": float(equity.iloc[-1]) if len(equity) != 0 else capital}
+    summary.update(rejected)
+    if capital:
+        summary["return"] = netpnl / capital
+    return summary
+
+
+def portfolio_backtest(instruments, rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets,
+                       stops, overlaps, lots, max_lots, capital=None, margin_per_lot=0, portfolio_max_lots=None,
+                       score="netpnl", workers=None, chunk_size=None, stats=None, reuse_signals=True):
+    # instruments - {name: (bid, ask)}, e.g. load_instruments(group_logs(file_list)). The name is also the
+    # filename_parent of the instrument's trade store.
+    # Grid arguments as ohlc_backtest, max_lots applies to every instrument on its own and
+    # portfolio_max_lots / capital / margin_per_lot to the portfolio (see portfolio_trades).
+    # score - result field that picks the setting of every instrument for the portfolio, higher is better.
+    # Returns {name: results}, {name: chosen settings}, and the portfolio trades, equity curve and summary
+    if workers is None:
+        workers = os.cpu_count() or 1
+    configs = list(ohlc_grid(overlaps, rsi_windows, rsi_overbought_bounds, rsi_oversold_bounds, ema_values))
+    names = list(instruments)
+    if chunk_size is None:
+        # A few chunks per worker over the whole batch
+        chunk_size = max(1, len(configs) * len(names) // (workers * 4))
+    tasks = portfolio_tasks({name: len(instruments[name][1]) for name in names}, configs, chunk_size)
+    if stats is None:
+        stats = RunStats()
+    stats.total = len(names) * len(configs) * target_stop_pairs(targets, stops)
+
+    results = {name: [] for name in names}
+    best = {}  # name: (score, settings, long_log, short_log)
+    pending = {name: {} for name in names}
+    next_chunk = {name: 0 for name in names}
+    blocks = []
+    try:
+        specs = {}
+        for name in names:
+            bid, ask = instruments[name]
+            bid_blocks, bid_spec = share_frame(bid)
+            blocks += bid_blocks
+            ask_blocks, ask_spec = share_frame(ask)
+            blocks += ask_blocks
+            specs[name] = (bid_spec, ask_spec)
+
+        with ExitStack() as stack:
+            pool = stack.enter_context(multiprocessing.Pool(min(workers, max(len(tasks), 1)), initializer=_init_worker,
+                                                            initargs=(specs, list(targets), list(stops), lots,
+                                                                      max_lots, stats, reuse_signals)))
+            writers = {}
+            for name in names:
+                store = stack.enter_context(TradeStore(name))
+                writers[name] = stack.enter_context(BackgroundWriter(store))
+
+            # Chunks come back in whatever order they finish, each instrument is written in grid order
+            for name, number, chunk_results, chunk_trades, chunk_stats in pool.imap_unordered(_run_task, tasks):
+                stats.merge(chunk_stats)
+                pending[name][number] = (chunk_results, chunk_trades)
+                while next_chunk[name] in pending[name]:
+                    chunk_results, chunk_trades = pending[name].pop(next_chunk[name])
+                    next_chunk[name] += 1
+                    results[name] += chunk_results
+                    trades = {}
+                    with stats.span("io"):
+                        for settings, longs, shorts in chunk_trades:
+                            writers[name].append(settings, longs, shorts)
+                            trades[settings] = (longs, shorts)
+                    for result in chunk_results:
+                        value = result[score]
+                        # Ties keep the first setting in grid order
+                        if value is not None and not np.isnan(value) and \
+                                (name not in best or value > best[name][0]):
+                            best[name] = (value, result["settings"]) + trades[result["settings"]]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    chosen = {name: best[name][1] for name in names if name in best}
+    trades, equity, rejected = portfolio_trades({name: best[name][2:] for name in chosen}, lots, capital,
+                                                margin_per_lot, portfolio_max_lots)
+    summary = portfolio_summary(trades, equity, rejected, capital)
+    stats.report()
+    print("Portfolio : {} instruments, {} trades, netpnl {}".format(summary["instruments"],
+                                                                    summary["number_of_trades"], summary["netpnl"]))
+    return results, chosen, (trades, equity, summary)
@@ -0,0 +1,48 @@
+import heapq
+import numpy as np
+from records import timestamp_nanoseconds
+
+# Book of open positions on one side (longs or shorts) used for the overlap and
+# max_lots checks in make_long / make_short.
+# Signals are generated in time order, so a trade that has closed by the time of
+# one signal is closed for every later signal too. The book keeps the exit
+# timestamps of taken trades in a min-heap and drops them once they are past,
+# which makes each query O(log n) amortized instead of a scan over every trade.
+# Timestamps are int64 nanoseconds, as in records.TradeLog.
+
+# Exit of a trade that never reaches its target or stop, for books that hold it until the end of the
+# data (portfolio.portfolio_trades). make_long / make_short don't, such a trade holds no position there
+STILL_OPEN = np.iinfo(np.int64).max
+
+
+class OpenPositions:
+
+    def __init__(self):
+        self._exits = []
+
+    @classmethod
+    def from_trades(cls, trades):
+        # Build a book from a list of trade dicts as returned by make_long / make_short
+        book = cls()
+        for trade in trades:
+            if trade.get("timestamp_of_exit") is not None:
+                book.add(timestamp_nanoseconds(trade["timestamp_of_exit"]))
+        return book
+
+    def add(self, timestamp_of_exit):
+        # Trades that never exit (or were rejected) don't hold a position, same as before
+        if timestamp_of_exit is not None:
+            heapq.heappush(self._exits, timestamp_of_exit)
+
+    def count_open(self, timestamp):
+        # Number of trades still open at timestamp (exit strictly after it).
+        # timestamp must not go backwards between calls.
+        while len(self._exits) != 0 and self._exits[0] <= timestamp:
+            heapq.heappop(self._exits)
+        return len(self._exits)
+
+    def any_open(self, timestamp):
+        return self.count_open(timestamp) != 0
+
+    def __len__(self):
+        return len(self._exits)
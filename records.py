@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+from enum import IntEnum
+
+# Compact trade records.
+# make_longs / make_shorts append every signal of a run to a TradeLog, a
+# structured numpy array that grows in place, instead of building a dict with
+# eight string keys per trade. Timestamps are int64 nanoseconds and the type of
+# exit is a small integer code. to_dicts() gives back the old trade dicts for
+# the csv writers and anything else that expects them.
+
+
+class ExitType(IntEnum):
+    NONE = 0  # trade never reached target or stop
+    WIN = 1
+    LOSS = 2
+    OVERLAP = 3
+    LOT_LIMIT = 4
+
+
+# Names used in the trade dicts and csv files
+EXIT_NAMES = {ExitType.NONE: None,
+              ExitType.WIN: "Win",
+              ExitType.LOSS: "Loss",
+              ExitType.OVERLAP: "Overlap",
+              ExitType.LOT_LIMIT: "Lot limit"}
+EXIT_CODES = {name: code for code, name in EXIT_NAMES.items()}
+
+TRADE_DTYPE = np.dtype([("timestamp_of_entry", "int64"),
+                        ("timestamp_of_exit", "int64"),  # NaT when there is no exit
+                        ("entry_price", "float64"),  # NaN for rejected signals
+                        ("target_price", "float64"),
+                        ("stop_price", "float64"),
+                        ("type_of_exit", "int8"),
+                        ("pnl", "float64"),
+                        ("open_lots", "int32")])
+
+NAT = np.datetime64("NaT", "ns").view("int64")
+
+
+def to_nanoseconds(timestamps):
+    # int64 nanoseconds of timestamps (strings, Timestamps, an index...), NaT for None
+    if isinstance(timestamps, pd.DatetimeIndex):
+        return timestamps.values.astype("datetime64[ns]").view("int64")
+    return pd.to_datetime(pd.Series(list(timestamps), dtype=object)).values.astype("datetime64[ns]").view("int64")
+
+
+def timestamp_nanoseconds(timestamp):
+    if timestamp is None:
+        return NAT
+    return pd.Timestamp(timestamp).as_unit("ns").value
+
+
+class TradeLog:
+    # Trades of one side (1 for longs, -1 for shorts) of a run, in signal order
+    __slots__ = ("side", "_data", "_size")
+
+    def __init__(self, side, capacity=64):
+        self.side = side
+        self._data = np.empty(capacity, dtype=TRADE_DTYPE)
+        self._size = 0
+
+    def append(self, timestamp_of_entry, timestamp_of_exit, entry_price, target_price, stop_price, type_of_exit,
+               pnl, open_lots):
+        if self._size == len(self._data):
+            self._data = np.resize(self._data, 2 * len(self._data))
+        self._data[self._size] = (timestamp_of_entry, timestamp_of_exit, entry_price, target_price, stop_price,
+                                  type_of_exit, pnl, open_lots)
+        self._size += 1
+
+    def extend(self, records):
+        # Append a structured array of trades (e.g. the records of another TradeLog)
+        size = self._size + len(records)
+        if size > len(self._data):
+            self._data = np.resize(self._data, max(size, 2 * len(self._data)))
+        self._data[self._size:size] = records
+        self._size = size
+
+    def set_exit(self, position, timestamp_of_exit, type_of_exit, pnl):
+        # Close the trade appended at position, for engines that learn the exit later
+        self._data["timestamp_of_exit"][position] = timestamp_of_exit
+        self._data["type_of_exit"][position] = type_of_exit
+        self._data["pnl"][position] = pnl
+
+    @property
+    def records(self):
+        # Structured array view of the trades
+        return self._data[:self._size]
+
+    def __len__(self):
+        return self._size
+
+    def __getstate__(self):
+        return self.side, self.records.copy()
+
+    def __setstate__(self, state):
+        self.side, self._data = state
+        self._size = len(self._data)
+
+    def to_dicts(self):
+        # Trade dicts in the format make_long / make_short return
+        trades = []
+        for record in self.records:
+            trade = {}
+            for name in TRADE_DTYPE.names:
+                value = record[name]
+                if name in ("timestamp_of_entry", "timestamp_of_exit"):
+                    value = None if value == NAT else pd.Timestamp(int(value))
+                elif name == "type_of_exit":
+                    value = EXIT_NAMES[ExitType(int(value))]
+                elif name == "open_lots":
+                    value = int(value)
+                elif np.isnan(value):
+                    value = None
+                trade[name] = value
+            trades.append(trade)
+        return trades
@@ -0,0 +1,200 @@
+import time
+import sqlite3
+import numbers
+import pandas as pd
+
+# Catalog of sweep results in one SQLite file.
+# write_result adds every result it writes to the CSV to the catalog as well, one
+# row per setting with the run's metadata (data file, timeframe, lots, max_lots)
+# and the parameters parsed out of the settings string, so finding the best
+# settings is one indexed query instead of loading and sorting every result CSV:
+#
+#     top("netpnl", 10, rsiwindow=(14, 21), target=(600, None), max_lots=10)
+#     best_per_run("sharpe")
+#
+# Every parameter has an index for the range filters. Metric columns are added as
+# results bring new ones (in any row, not just the first), and a metric gets an index
+# the first time it is ranked on. Writing a run again replaces its rows, like the
+# CSV file is overwritten. import_csv brings results written before the catalog in.
+
+CATALOG_FILE = "results.sqlite"
+
+# Fields of the settings string (see trade.settings_name), in order
+PARAMETERS = ["overlap", "rsiwindow", "rsiupper", "rsilower", "slowema", "fastema", "target", "stop"]
+
+# Metadata of the run every row belongs to
+RUN_COLUMNS = ["run", "data_file", "timeframe", "lots", "max_lots", "written_at"]
+
+BASE_COLUMNS = RUN_COLUMNS + ["settings"] + PARAMETERS
+
+# Columns of the indexes every catalog has, one per parameter for the range filters of top()
+INDEXES = {"run": ["run", "settings"],
+           "data": ["data_file", "timeframe", "max_lots"],
+           "netpnl": ["netpnl"]}
+INDEXES.update((parameter, [parameter]) for parameter in PARAMETERS)
+
+
+def quote(name):
+    # Metric names aren't all identifiers, e.g. apnl/max_DD
+    return '"' + name.replace('"', '""') + '"'
+
+
+def parse_settings(settings):
+    # {parameter: value} of a settings string, e.g. overlap_True-rsiwindow_14-...-stop_300.
+    # Fields that aren't in the string (e.g. another strategy's) are None
+    values = dict.fromkeys(PARAMETERS)
+    for field in str(settings).split("-"):
+        name, _, value = field.partition("_")
+        if name not in values:
+            continue
+        if value in ("True", "False"):
+            values[name] = int(value == "True")
+            continue
+        try:
+            values[name] = int(value)
+        except ValueError:
+            try:
+                values[name] = float(value)
+            except ValueError:
+                values[name] = value
+    return values
+
+
+def sql_value(value):
+    # What a result field is stored as, durations in seconds
+    if value is None or isinstance(value, (str, bool, numbers.Integral)):
+        return int(value) if isinstance(value, bool) else value
+    if isinstance(value, numbers.Real):
+        value = float(value)
+        return None if value != value else value  # NaN
+    if isinstance(value, pd.Timedelta):
+        return None if pd.isna(value) else value.total_seconds()
+    return str(value)
+
+
+def connect(catalog=CATALOG_FILE):
+    # Connection to catalog, with the table and the indexes created if it is new.
+    # The timeout lets several sweeps write to the same catalog
+    connection = sqlite3.connect(catalog, timeout=60)
+    connection.execute("CREATE TABLE IF NOT EXISTS results ({})".format(
+        ", ".join(["id INTEGER PRIMARY KEY"] + [quote(column) for column in BASE_COLUMNS])))
+    columns = columns_of(connection)
+    for name, indexed in INDEXES.items():
+        # netpnl only once results brought it
+        if all(column in columns for column in indexed):
+            create_index(connection, name, indexed)
+    connection.commit()
+    return connection
+
+
+def columns_of(connection):
+    return [row[1] for row in connection.execute("PRAGMA table_info(results)")]
+
+
+def create_index(connection, name, columns):
+    connection.execute("CREATE INDEX IF NOT EXISTS {} ON results ({})".format(
+        quote("results_" + name), ", ".join(quote(column) for column in columns)))
+
+
+def add_results(results, run, catalog=CATALOG_FILE, data_file=None, timeframe=None, lots=None, max_lots=None):
+    # Replace the rows of run with results (the dicts write_result writes), returns the number of rows
+    metadata = {"run": run, "data_file": data_file, "timeframe": timeframe, "lots": lots, "max_lots": max_lots,
+                "written_at": time.time()}
+    connection = connect(catalog)
+    try:
+        with connection:
+            known = set(columns_of(connection))
+            for result in results:
+                for name in result:
+                    if name not in known and name != "id":
+                        connection.execute("ALTER TABLE results ADD COLUMN {}".format(quote(name)))
+                        known.add(name)
+            if "netpnl" in known:
+                create_index(connection, "netpnl", INDEXES["netpnl"])
+
+            connection.execute("DELETE FROM results WHERE run = ?", (run,))
+            rows = []
+            names = {}  # every field of every row, in the order they first come up
+            for result in results:
+                row = dict(metadata)
+                row.update(parse_settings(result.get("settings")))
+                row.update((name, sql_value(value)) for name, value in result.items() if name != "id")
+                names.update(dict.fromkeys(row))
+                rows.append(row)
+            if len(rows) != 0:
+                connection.executemany("INSERT INTO results ({}) VALUES ({})".format(
+                    ", ".join(quote(name) for name in names), ", ".join("?" * len(names))),
+                    [[row.get(name) for name in names] for row in rows])
+    finally:
+        connection.close()
+    return len(rows)
+
+
+def import_csv(filename, run=None, catalog=CATALOG_FILE, **metadata):
+    # Add a result CSV written before the catalog existed, as run (the file name without .csv by default)
+    if run is None:
+        run = filename[:-len(".csv")] if filename.endswith(".csv") else filename
+    results = pd.read_csv(filename).to_dict("records")
+    return add_results(results, run, catalog, **metadata)
+
+
+def where(columns, filters):
+    # SQL condition and its values for filters, {column: value or (low, high)} with either bound None for open
+    conditions = []
+    values = []
+    for name, value in filters.items():
+        if name not in columns:
+            raise ValueError("No column {} in the catalog".format(name))
+        if isinstance(value, (tuple, list)):
+            low, high = value
+            if low is not None:
+                conditions.append("{} >= ?".format(quote(name)))
+                values.append(sql_value(low))
+            if high is not None:
+                conditions.append("{} <= ?".format(quote(name)))
+                values.append(sql_value(high))
+        elif value is None:
+            conditions.append("{} IS NULL".format(quote(name)))
+        else:
+            conditions.append("{} = ?".format(quote(name)))
+            values.append(sql_value(value))
+    return " AND ".join(conditions) or "1", values
+
+
+def ranked(connection, metric):
+    # Check metric is a column and index it for the ORDER BY
+    columns = columns_of(connection)
+    if metric not in columns:
+        raise ValueError("No column {} in the catalog".format(metric))
+    create_index(connection, metric, [metric])
+    return columns
+
+
+def top(metric="netpnl", n=10, catalog=CATALOG_FILE, ascending=False, **filters):
+    # The n best rows by metric (highest first, lowest with ascending) as a DataFrame.
+    # filters are columns (parameters, run metadata or metrics) equal to a value or within (low, high),
+    # e.g. top("sharpe", 5, rsiwindow=(14, 21), max_lots=10). Rows without the metric are left out
+    connection = connect(catalog)
+    try:
+        columns = ranked(connection, metric)
+        condition, values = where(columns, filters)
+        query = "SELECT * FROM results WHERE {} AND {} IS NOT NULL ORDER BY {} {}, id LIMIT ?".format(
+            condition, quote(metric), quote(metric), "ASC" if ascending else "DESC")
+        return pd.read_sql_query(query, connection, params=values + [n])
+    finally:
+        connection.close()
+
+
+def best_per_run(metric="netpnl", catalog=CATALOG_FILE, ascending=False, **filters):
+    # The best row by metric of every run matching filters, best run first
+    connection = connect(catalog)
+    try:
+        columns = ranked(connection, metric)
+        condition, values = where(columns, filters)
+        order = "{} {}".format(quote(metric), "ASC" if ascending else "DESC")
+        query = ("SELECT * FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY run ORDER BY {order}, id) AS place "
+                 "FROM results WHERE {condition} AND {metric} IS NOT NULL) WHERE place = 1 ORDER BY {order}, id"
+                 ).format(order=order, condition=condition, metric=quote(metric))
+        return pd.read_sql_query(query, connection, params=values).drop(columns="place")
+    finally:
+        connection.close()
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import cProfile
+from collections import defaultdict
+from contextlib import contextmanager
+import numpy as np
+from records import ExitType
+
+# Instrumentation of the sweeps, instead of printing every setting.
+# A RunStats adds up the time spent in named spans (signals, exits, trades,
+# metrics, io, and indicators for series computed by the IndicatorCache,
+# which is part of signals) and counts signals, rejected overlaps, lot-limit
+# hits, cache hits and settings stopped early. It prints a progress line at
+# most every progress_seconds and one summary when the sweep ends, or writes
+# the summary as json. Settings picked by profile run under cProfile and their
+# stats are dumped next to each other for pstats / snakeviz.
+#
+# Worker processes keep their own RunStats per task and the parent merges them,
+# so span times of a parallel sweep are summed over the workers.
+
+PROGRESS_SECONDS = 10.0
+
+# Order of the spans in the summary
+SPANS = ["signals", "indicators", "exits", "trades", "metrics", "io"]
+
+
+class RunStats:
+
+    def __init__(self, total=None, progress_seconds=PROGRESS_SECONDS, profile=None, profile_dir=".", json_file=None):
+        # total - settings in the sweep, for the progress line
+        # progress_seconds - least time between progress lines, None for no progress
+        # profile - settings strings to profile, or a function of the settings string that returns True to profile
+        # profile_dir - where the <settings>.prof files go
+        # json_file - write the summary there instead of printing it
+        self.total = total
+        self.progress_seconds = progress_seconds
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.json_file = json_file
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.done = 0
+        self.started = time.perf_counter()
+        self._reported = self.started
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def count_trades(self, long_log, short_log):
+        # Signals, rejected overlaps and lot-limit hits of the trade logs of a setting
+        for side, log in (("long", long_log), ("short", short_log)):
+            types = log.records["type_of_exit"]
+            self.counters["signals_" + side] += len(types)
+            self.counters["overlaps_" + side] += int(np.count_nonzero(types == ExitType.OVERLAP))
+            self.counters["lot_limits_" + side] += int(np.count_nonzero(types == ExitType.LOT_LIMIT))
+
+    @staticmethod
+    def cache_state(cache):
+        return cache.hits, cache.misses, cache.seconds
+
+    def add_cache(self, cache, state):
+        # What an IndicatorCache did since cache_state gave state
+        hits, misses, seconds = state
+        self.counters["cache_hits"] += cache.hits - hits
+        self.counters["cache_misses"] += cache.misses - misses
+        self.seconds["indicators"] += cache.seconds - seconds
+        self.calls["indicators"] += cache.misses - misses
+
+    def settings_done(self, amount=1):
+        # Progress line when progress_seconds went by since the last one
+        self.done += amount
+        if self.progress_seconds is None:
+            return
+        now = time.perf_counter()
+        if now - self._reported >= self.progress_seconds:
+            self._reported = now
+            print(self.progress_line(now))
+
+    def progress_line(self, now):
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        line = "Progress : {} settings, {:.1f} settings/s, {:.0f} s".format(self.done, rate, elapsed)
+        if self.total:
+            line = "Progress : {}/{} settings ({:.0%}), {:.1f} settings/s, {:.0f} s".format(
+                self.done, self.total, self.done / self.total, rate, elapsed)
+            if rate > 0:
+                line += ", about {:.0f} s left".format((self.total - self.done) / rate)
+        return line
+
+    def wants_profile(self, settings):
+        if self.profile is None:
+            return False
+        if callable(self.profile):
+            return self.profile(settings)
+        return settings in self.profile
+
+    @contextmanager
+    def profiled(self, settings):
+        # Run the block under cProfile if profile asks for this setting
+        if not self.wants_profile(settings):
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, settings + ".prof"))
+            self.counters["profiled"] += 1
+
+    def worker(self):
+        # RunStats for a task of a worker process, merged back with merge(state())
+        return RunStats(progress_seconds=None, profile=self.profile, profile_dir=self.profile_dir)
+
+    def state(self):
+        return {"seconds": dict(self.seconds), "calls": dict(self.calls), "counters": dict(self.counters),
+                "done": self.done}
+
+    def merge(self, state):
+        for name, seconds in state["seconds"].items():
+            self.seconds[name] += seconds
+        for name, calls in state["calls"].items():
+            self.calls[name] += calls
+        for name, amount in state["counters"].items():
+            self.counters[name] += amount
+        self.settings_done(state["done"])
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        names = [name for name in SPANS if name in self.seconds] + sorted(set(self.seconds) - set(SPANS))
+        return {"settings": self.done,
+                "total": self.total,
+                "seconds": elapsed,
+                "settings_per_s": self.done / elapsed if elapsed > 0 else None,
+                "spans": {name: {"seconds": self.seconds[name], "calls": self.calls[name]} for name in names},
+                "counters": dict(sorted(self.counters.items()))}
+
+    def report(self):
+        # The summary of the run, printed or written to json_file
+        summary = self.summary()
+        if self.json_file is not None:
+            with open(self.json_file, "w") as outfile:
+                json.dump(summary, outfile, indent=2)
+            return summary
+        print("Sweep : {} settings in {:.1f} s ({:.1f} settings/s)".format(
+            summary["settings"], summary["seconds"], summary["settings_per_s"] or 0.0))
+        for name, span in summary["spans"].items():
+            print("  {:<12} {:>10.3f} s {:>10} calls".format(name, span["seconds"], span["calls"]))
+        for name, amount in summary["counters"].items():
+            print("  {:<24} {:>10}".format(name, amount))
+        return summary
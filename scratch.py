@@ -1,16 +1,11 @@
-import csv
-from util import get_list_of_files
-import pandas as pd
-import matplotlib.pyplot as plt
+from resultcatalog import best_per_run
 
-file_list = get_list_of_files('./', '.csv')
+# Result CSVs from before the catalog, import them once
+# for file in get_list_of_files('./', 'csv'):
+#     import_csv(file)
 
-df_array = []
+# Best setting of every run by netpnl, one indexed query instead of sorting every result CSV
+best = best_per_run("netpnl")
 
-for file in file_list:
-    df = pd.read_csv(file).sort_values(by="netpnl", axis=0, ascending=False).head(1)
-    df = df.reset_index(drop=True)
-    df_array.append(df)
-
-for item in df_array:
-    print(str(item["settings"].iloc[0])+" : "+str(item["netpnl"].iloc[0]/100))
+for _, item in best.iterrows():
+    print(str(item["settings"])+" : "+str(item["netpnl"]/100))
@@ -0,0 +1,111 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from checkpoint import frame_digest
+
+# Reuse of simulations across settings with the same entries.
+# Many indicator configurations of a sweep pick exactly the same entry bars
+# (neighbouring RSI bounds, EMA pairs that cross together). Trades only depend
+# on the entry bars and on target, stop, overlap, lots and max_lots, so the
+# sweep fingerprints the long and short entry positions of a configuration and
+# looks the simulation up here before running make_longs / make_shorts again.
+# The exit grids of an entry set are shared the same way. A cache belongs to
+# one sweep over one instrument's bars, entries are keyed by instrument and a
+# digest of the bars on top of the fingerprint, so a cache passed around by
+# mistake or reused on other bars under the same name can't mix them up.
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def fingerprint(instrument, bars, long_positions, short_positions):
+    # Digest of an instrument's long and short entry positions on bars (SignalCache.bars_key)
+    digest = hashlib.sha1(str(instrument).encode())
+    digest.update(bars.encode())
+    for positions in (long_positions, short_positions):
+        positions = np.ascontiguousarray(positions, dtype="int64")
+        digest.update(np.int64(len(positions)).tobytes())
+        digest.update(positions.tobytes())
+    return digest.hexdigest()
+
+
+def grid_bytes(grids):
+    return sum(grid.nbytes for grid in grids if grid is not None)
+
+
+class SignalCache:
+    # LRU cache of exit grids and simulated trades by entry fingerprint, bounded by their total size
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.grid_hits = 0
+        self.grid_misses = 0
+        self._entries = OrderedDict()
+        self._bars = None  # (bid, ask, digest) of the last bars looked up
+
+    def bars_key(self, bid, ask):
+        # Digest of bid and ask. Sweeps look up every configuration with the same frames, which are only hashed once
+        if self._bars is not None and self._bars[0] is bid and self._bars[1] is ask:
+            return self._bars[2]
+        digest = hashlib.sha1()
+        frame_digest(digest, bid)
+        frame_digest(digest, ask)
+        self._bars = (bid, ask, digest.hexdigest())
+        return self._bars[2]
+
+    def exits(self, key):
+        # (long exits, short exits) grids of key = (fingerprint, targets, stops, tick exits), None if not cached
+        found = self._get(("exits",) + key)
+        if found is None:
+            self.grid_misses += 1
+        else:
+            self.grid_hits += 1
+        return found
+
+    def put_exits(self, key, long_exits, short_exits):
+        self._put(("exits",) + key, (long_exits, short_exits), grid_bytes(long_exits) + grid_bytes(short_exits))
+
+    def outcome(self, key):
+        # (long TradeLog, short TradeLog, metrics or None) of
+        # key = (fingerprint, target, stop, overlap, lots, max_lots, tick exits), None if not cached.
+        # The logs are shared with whoever got them first, nobody should append to them
+        found = self._get(("trades",) + key)
+        if found is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return found
+
+    def put_outcome(self, key, long_log, short_log, metrics):
+        self._put(("trades",) + key, (long_log, short_log, metrics),
+                  long_log.records.nbytes + short_log.records.nbytes)
+
+    def _get(self, key):
+        found = self._entries.get(key)
+        if found is None:
+            return None
+        self._entries.move_to_end(key)
+        return found[0]
+
+    def _put(self, key, value, nbytes):
+        self._entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        # Drop least recently used entries until we are back under budget, always keeping the newest one
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, dropped) = self._entries.popitem(last=False)
+            self.nbytes -= dropped
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+        self._bars = None
+
+    def stats(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "grid_hits": self.grid_hits,
+                "grid_misses": self.grid_misses,
+                "entries": len(self._entries),
+                "bytes": self.nbytes}
@@ -0,0 +1,39 @@
+import numpy as np
+
+# Vectorized entry signals.
+# A strategy looks at whole indicator columns and returns two boolean masks over
+# the bars of the ask frame: where to enter longs and where to enter shorts.
+# The sweeps turn the masks into entry positions and hand them to
+# trade.make_longs / trade.make_shorts in one batch, so adding a new TA-lib
+# strategy only means writing a function like ema_rsi below and passing it as
+# strategy= to the sweeps (ohlc_backtest, parallel_ohlc_backtest,
+# halving_backtest, walk_forward). A strategy is called as
+#
+#     strategy(cache, instrument, close, *parameters)
+#
+# with the indicators.IndicatorCache of the sweep, the name close is cached
+# under, the ask closes as floats and the indicator parameters of a grid
+# configuration (everything but overlap, see trade.ohlc_grid). It has to be a
+# module level function so the parallel sweeps can send it to their workers.
+
+
+def ema_rsi(cache, instrument, close, rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema):
+    # EMA + RSI scalping: long when the fast EMA is above the slow one and RSI is oversold,
+    # short when it is below and RSI is overbought. NaN warm-up bars never signal.
+    rsi = cache.rsi(instrument, close, rsi_window)
+    ma_fast = cache.ema(instrument, close, fast_ema)
+    ma_slow = cache.ema(instrument, close, slow_ema)
+
+    long_mask = (ma_fast > ma_slow) & (rsi < rsi_lower)  # Oversold condition
+    short_mask = (ma_fast < ma_slow) & (rsi > rsi_upper)  # Overbought condition
+    return long_mask, short_mask
+
+
+def strategy_name(strategy):
+    # Name of a strategy function for checkpoint keys
+    return "{}.{}".format(strategy.__module__, strategy.__qualname__)
+
+
+def entry_positions(long_mask, short_mask):
+    # Bar positions of the long and short entries, in time order
+    return np.flatnonzero(long_mask), np.flatnonzero(short_mask)
@@ -0,0 +1,339 @@
+import numpy as np
+import pandas as pd
+from trade import ohlc_grid, ohlc_outcome, settings_name
+from records import TradeLog, ExitType, NAT, to_nanoseconds
+from positions import OpenPositions
+from tradestore import TradeStore
+from writer import BackgroundWriter
+from util import resample
+
+# Event-driven version of ohlc_backtest.
+# Bars are fed one at a time (bid and ask of a timestamp) and every indicator
+# configuration keeps its EMA / Wilder RSI state and its open positions, so a
+# bar costs the same however long the history is and nothing looks ahead. Every
+# signal is taken or rejected on the bar it comes in, with the trades open at
+# that bar, which is what live or paper trading can do. On historical data that
+# gives the trades and results of ohlc_backtest, except behind a trade that
+# never reaches its target or stop: ohlc_backtest knows it never exits and lets
+# it hold no position, here it is open until the data ends.
+#
+# lookahead=n reproduces ohlc_backtest there too, for replays of history: a
+# signal behind a trade that is still open waits until that trade exits or the
+# data ends, and at most n signals wait. Past that the oldest are decided with
+# the open trades counted as open (see StreamingSide).
+#
+# Within a timestamp the opens are checked for exits first (bid for longs, ask
+# for shorts), then the ask close updates the indicators and may enter, which
+# is the order the batch engine works out exits and open positions in.
+
+
+class StreamingEMA:
+    # talib.EMA one value at a time: seeded with the average of the first period closes
+
+    __slots__ = ("period", "k", "count", "total", "value")
+
+    def __init__(self, period):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.count = 0
+        self.total = 0.0
+        self.value = np.nan
+
+    def update(self, close):
+        self.count += 1
+        if self.count < self.period:
+            self.total += close
+        elif self.count == self.period:
+            self.total += close
+            self.value = self.total / self.period
+        else:
+            self.value = ((close - self.value) * self.k) + self.value
+        return self.value
+
+
+class StreamingRSI:
+    # talib.RSI one value at a time: Wilder smoothing seeded with the average of the first period changes
+
+    __slots__ = ("period", "count", "previous", "gain", "loss", "value")
+
+    def __init__(self, period):
+        self.period = period
+        self.count = 0
+        self.previous = 0.0
+        self.gain = 0.0
+        self.loss = 0.0
+        self.value = np.nan
+
+    def update(self, close):
+        self.count += 1
+        if self.count == 1:
+            self.previous = close
+            return self.value
+        change = close - self.previous
+        self.previous = close
+        if self.count > self.period + 1:
+            self.loss *= (self.period - 1)
+            self.gain *= (self.period - 1)
+        if change < 0:
+            self.loss -= change
+        else:
+            self.gain += change
+        if self.count <= self.period:
+            return self.value
+        # The first value averages the first period changes, later ones smooth them
+        self.loss /= self.period
+        self.gain /= self.period
+        total = self.gain + self.loss
+        self.value = 100.0 * (self.gain / total) if not -0.00000001 < total < 0.00000001 else 0.0
+        return self.value
+
+
+class StreamingSide:
+    # Longs (side 1) or shorts (side -1) of one setting, same rules as trade.long_trade / short_trade with
+    # a taken trade open until it exits. Signals are decided on the bar they come in.
+    # With lookahead, a trade that never reaches its target or stop holds no position, as in
+    # trade.long_trade / short_trade. While a taken trade is still open nobody knows yet whether it
+    # blocks the signals after it, so those signals wait in entry order, following their own target and
+    # stop meanwhile, and are taken or rejected once every taken trade before them has exited, or at
+    # finish() when the ones still open turn out never to exit. At most lookahead signals wait.
+
+    __slots__ = ("side", "target", "stop", "lots", "max_lots", "overlap", "lookahead", "log", "open", "waiting",
+                 "book")
+
+    def __init__(self, side, target, stop, lots, max_lots, overlap, lookahead=0):
+        self.side = side
+        self.target = target
+        self.stop = stop
+        self.lots = lots
+        self.max_lots = max_lots
+        self.overlap = overlap
+        self.lookahead = lookahead
+        self.log = TradeLog(side)
+        self.open = []  # (position in log, entry price, target price, stop price) of taken trades
+        self.waiting = []  # [entry timestamp, entry price, target price, stop price, exit or None] to decide
+        self.book = OpenPositions()  # exits of the taken trades that have exited
+
+    def exit_at(self, price, entry_price, target_price, stop_price):
+        # (type of exit, pnl) when the open price reaches target or stop, None otherwise
+        if self.side == 1:
+            if price >= target_price:
+                return ExitType.WIN, ((price - entry_price) * self.lots * 100)
+            if price <= stop_price:
+                return ExitType.LOSS, ((price - entry_price) * self.lots * 100)
+        else:
+            if price <= target_price:
+                return ExitType.WIN, (price - entry_price) * self.lots * (-1) * 100
+            if price >= stop_price:
+                return ExitType.LOSS, (price - entry_price) * self.lots * (-1) * 100
+        return None
+
+    def exits(self, timestamp, price):
+        # Close the positions whose target or stop the open price of this bar reaches
+        still_open = []
+        for trade in self.open:
+            position, entry_price, target_price, stop_price = trade
+            exit = self.exit_at(price, entry_price, target_price, stop_price)
+            if exit is None:
+                still_open.append(trade)
+            else:
+                self.log.set_exit(position, timestamp, *exit)
+                self.book.add(timestamp)
+        self.open = still_open
+        for signal in self.waiting:
+            if signal[4] is None:
+                exit = self.exit_at(price, *signal[1:4])
+                if exit is not None:
+                    signal[4] = (timestamp,) + exit
+        self.decide()
+
+    def enter(self, timestamp, price):
+        if self.side == 1:
+            target_price = price + self.target
+            stop_price = price - self.stop
+        else:
+            target_price = price - self.target
+            stop_price = price + self.stop
+        self.waiting.append([timestamp, price, target_price, stop_price, None])
+        self.decide()
+
+    def decide(self):
+        # Take or reject the waiting signals while no taken trade is still open, and the oldest ones
+        # past lookahead anyway
+        taken = 0
+        while taken < len(self.waiting):
+            if len(self.open) != 0 and len(self.waiting) - taken <= self.lookahead:
+                break
+            self.take(*self.waiting[taken])
+            taken += 1
+        del self.waiting[:taken]
+
+    def take(self, timestamp, price, target_price, stop_price, exit):
+        # Take or reject a signal. Trades that exited after it was signalled were open at the time, and
+        # so are the taken trades that are still open
+        current_lots = 0
+        still_open = self.book.count_open(timestamp) + len(self.open)
+        if self.overlap is not True:
+            if still_open != 0:
+                self.log.append(timestamp, NAT, np.nan, np.nan, np.nan, ExitType.OVERLAP,
+                                np.nan if self.side == 1 else 0.00, current_lots * self.lots)
+                return
+        else:
+            current_lots = still_open
+
+        if current_lots * self.lots >= self.max_lots:
+            self.log.append(timestamp, NAT, np.nan, np.nan, np.nan, ExitType.LOT_LIMIT, np.nan,
+                            self.side * current_lots * self.lots)
+            return
+
+        if exit is None:
+            self.open.append((len(self.log), price, target_price, stop_price))
+            self.log.append(timestamp, NAT, price, target_price, stop_price, ExitType.NONE, 0,
+                            self.side * current_lots * self.lots)
+        else:
+            timestamp_of_exit, type_of_exit, pnl = exit
+            self.book.add(timestamp_of_exit)
+            self.log.append(timestamp, timestamp_of_exit, price, target_price, stop_price, type_of_exit, pnl,
+                            self.side * current_lots * self.lots)
+
+    def finish(self):
+        # End of the data: trades still open never exit and don't block the signals still waiting.
+        # Without lookahead nothing waits and the trades stay in the log as they are
+        while len(self.waiting) != 0 or len(self.open) != 0:
+            self.open = []
+            self.decide()
+
+
+class StreamingEngine:
+    # One indicator configuration of ohlc_backtest with all of its targets and stops.
+    # lookahead - signals a side may hold back for ohlc_backtest's rule on trades that never exit, see StreamingSide
+
+    def __init__(self, config, targets, stops, lots, max_lots, lookahead=0):
+        self.config = config
+        overlap, rsi_window, self.rsi_upper, self.rsi_lower, slow_ema, fast_ema = config
+        self.rsi = StreamingRSI(rsi_window)
+        self.ma_fast = StreamingEMA(fast_ema)
+        self.ma_slow = StreamingEMA(slow_ema)
+        self.targets = list(targets)
+        self.stops = list(stops)
+        self.sides = {}
+        for target in self.targets:
+            for stop in self.stops:
+                if stop >= target:
+                    break
+                self.sides[target, stop] = (StreamingSide(1, target, stop, lots, max_lots, overlap, lookahead),
+                                            StreamingSide(-1, target, stop, lots, max_lots, overlap, lookahead))
+        self.first = None
+        self.last = None
+
+    def on_bar(self, timestamp, bid=None, ask=None):
+        # timestamp in int64 nanoseconds, bid / ask are (open, high, low, close) or None without a bar
+        if bid is not None:
+            for longs, shorts in self.sides.values():
+                longs.exits(timestamp, bid[0])
+        if ask is None:
+            return
+        for longs, shorts in self.sides.values():
+            shorts.exits(timestamp, ask[0])
+
+        close = ask[3]
+        rsi = self.rsi.update(close)
+        ma_fast = self.ma_fast.update(close)
+        ma_slow = self.ma_slow.update(close)
+        if self.first is None:
+            self.first = timestamp
+        self.last = timestamp
+        if ma_fast > ma_slow and rsi < self.rsi_lower:  # Oversold condition
+            for longs, shorts in self.sides.values():
+                longs.enter(timestamp, close)
+        if ma_fast < ma_slow and rsi > self.rsi_upper:  # Overbought condition
+            for longs, shorts in self.sides.values():
+                shorts.enter(timestamp, close)
+
+    def results(self, store):
+        # Results at the end of the data, as run_ohlc_config gives them, the trades go to store.
+        # No more bars can be fed after this
+        span = None if self.first is None else self.last - self.first
+        for longs, shorts in self.sides.values():
+            longs.finish()
+            shorts.finish()
+        results = []
+        for target in self.targets:
+            for stop in self.stops:
+                if stop >= target:
+                    break
+                longs, shorts = self.sides[target, stop]
+                result, stopped = ohlc_outcome(settings_name(self.config + (target, stop)), longs.log, shorts.log,
+                                               span, store)
+                if result is not None:
+                    results.append(result)
+                if stopped:
+                    break
+        return results
+
+
+def frame_bars(bid, ask):
+    # (timestamp, bid bar, ask bar) for every timestamp of either frame, in time order
+    columns = ["open", "high", "low", "close"]
+    bid_index, ask_index = to_nanoseconds(pd.to_datetime(bid.index)), to_nanoseconds(pd.to_datetime(ask.index))
+    bid_values, ask_values = bid[columns].to_numpy(dtype=float), ask[columns].to_numpy(dtype=float)
+    timestamps = np.union1d(bid_index, ask_index)
+    bid_at = np.searchsorted(bid_index, timestamps)
+    ask_at = np.searchsorted(ask_index, timestamps)
+    for timestamp, b, a in zip(timestamps.tolist(), bid_at.tolist(), ask_at.tolist()):
+        bid_bar = tuple(bid_values[b]) if b < len(bid_index) and bid_index[b] == timestamp else None
+        ask_bar = tuple(ask_values[a]) if a < len(ask_index) and ask_index[a] == timestamp else None
+        yield timestamp, bid_bar, ask_bar
+
+
+def log_bars(file_list, timeframe='1Min'):
+    # Bars of tick logs in time order, one log at a time as util.resample aggregates them.
+    # The last bar of a log is held back until the next log starts, in case a session is split
+    # across logs and both have ticks in that bar (merged as util.merge_ohlc does).
+    held = None
+    for filename in file_list:
+        bid, ask = resample(filename, timeframe)
+        for timestamp, bid_bar, ask_bar in frame_bars(bid.dropna(), ask.dropna()):
+            if held is not None:
+                if held[0] == timestamp:
+                    bid_bar = merge_bar(held[1], bid_bar)
+                    ask_bar = merge_bar(held[2], ask_bar)
+                else:
+                    yield held
+            held = (timestamp, bid_bar, ask_bar)
+    if held is not None:
+        yield held
+
+
+def merge_bar(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return first[0], max(first[1], second[1]), min(first[2], second[2]), second[3]
+
+
+def replay(engines, bars):
+    # Feed bars (from frame_bars or log_bars) to every engine
+    count = 0
+    for timestamp, bid_bar, ask_bar in bars:
+        for engine in engines:
+            engine.on_bar(timestamp, bid_bar, ask_bar)
+        count += 1
+    return count
+
+
+def stream_backtest(bid, ask, rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets, stops,
+                    overlaps, lots, max_lots, filename_parent, bars=None, lookahead=0):
+    # Same arguments and results as ohlc_backtest, run bar by bar (see the module comment for lookahead).
+    # bars replaces the bid / ask frames as the source, e.g. log_bars(file_list) to replay tick logs
+    engines = [StreamingEngine(config, targets, stops, lots, max_lots, lookahead)
+               for config in ohlc_grid(overlaps, rsi_windows, rsi_overbought_bounds, rsi_oversold_bounds, ema_values)]
+    if bars is None:
+        bars = frame_bars(bid, ask)
+    print("Streamed {} bars".format(replay(engines, bars)))
+
+    results = []
+    with TradeStore(filename_parent) as store, BackgroundWriter(store) as writer:
+        for engine in engines:
+            results += engine.results(writer)
+    return results
@@ -0,0 +1,197 @@
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from trade import ohlc_grid, run_ohlc_config, open_checkpoint, target_stop_pairs
+from indicators import IndicatorCache
+from tradestore import TradeStore
+from writer import BackgroundWriter
+from metrics import sample_span
+from runstats import RunStats
+from signalcache import SignalCache
+from strategies import ema_rsi
+
+# Parallel version of trade.ohlc_backtest.
+# The indicator grid is split into chunks of configurations which are sent to a
+# process pool. Bid/ask prices are copied once into shared memory and every
+# worker builds its frames on top of those buffers, so the frames are never
+# pickled per task. Chunks are merged back in grid order, which makes the
+# results list and the trade store identical to the sequential sweep.
+
+COLUMNS = ["open", "high", "low", "close"]
+
+# Per-process state set up by _init_worker
+_worker = {}
+
+
+def share_array(array):
+    # Copy an array into a new shared memory block, returns the block and what attach_array needs
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec):
+    # Array over the shared memory block described by spec, without copying
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf), block
+
+
+def share_frame(frame):
+    # Copy an ohlc frame into two shared memory blocks (int64 timestamps, float64 prices)
+    index = pd.to_datetime(frame.index).values.astype("datetime64[ns]").view("int64")
+    values = frame[COLUMNS].to_numpy(dtype=float)
+
+    blocks = []
+    spec = []
+    for array in (index, values):
+        block, array_spec = share_array(array)
+        blocks.append(block)
+        spec.append(array_spec)
+    return blocks, spec
+
+
+def attach_frame(spec):
+    # Rebuild an ohlc frame over the shared memory blocks described by spec, without copying
+    index_spec, values_spec = spec
+    index, index_block = attach_array(index_spec)
+    values, values_block = attach_array(values_spec)
+    frame = pd.DataFrame(values, index=pd.DatetimeIndex(index.view("datetime64[ns]"), name="Timestamp"),
+                         columns=COLUMNS, copy=False)
+    return frame, [index_block, values_block]
+
+
+def _init_worker(bid_spec, ask_spec, targets, stops, lots, max_lots, filename_parent, done, ticks, stats,
+                 reuse_signals, strategy):
+    bid, bid_blocks = attach_frame(bid_spec)
+    ask, ask_blocks = attach_frame(ask_spec)
+    _worker.update({"bid": bid,
+                    "ask": ask,
+                    "close": ask['close'].to_numpy(dtype=float),
+                    "span": sample_span(ask),
+                    # keep the blocks referenced for as long as the frames live
+                    "blocks": bid_blocks + ask_blocks,
+                    "cache": IndicatorCache(),
+                    # entries repeat within the configurations a worker gets, not across workers
+                    "signals": SignalCache() if reuse_signals else None,
+                    "targets": targets,
+                    "stops": stops,
+                    "lots": lots,
+                    "max_lots": max_lots,
+                    "filename_parent": filename_parent,
+                    "done": done,
+                    "ticks": ticks,
+                    "strategy": strategy,
+                    # progress and the summary are the parent's, only the profiling settings are used here
+                    "stats": stats})
+
+
+class _CollectTrades:
+    # Stand-in for the TradeStore inside workers, trades are sent back and written by the parent in grid order
+
+    def __init__(self):
+        self.trades = []
+
+    def append(self, settings, longs, shorts=()):
+        self.trades.append((settings, longs, shorts))
+
+
+class _CollectOutcomes:
+    # Stand-in for the Checkpoint inside workers, finished settings come from the parent's
+    # checkpoint and new ones are sent back to be recorded there
+
+    def __init__(self, done):
+        self.done = done
+        self.outcomes = []
+
+    def outcome(self, settings):
+        return self.done.get(settings)
+
+    def record(self, settings, result, stopped):
+        self.outcomes.append((settings, result, stopped))
+
+
+def _run_chunk(configs):
+    results = []
+    collected = _CollectTrades()
+    outcomes = _CollectOutcomes(_worker["done"])
+    stats = _worker["stats"].worker()
+    cache_state = RunStats.cache_state(_worker["cache"])
+    for config in configs:
+        results += run_ohlc_config(_worker["bid"], _worker["ask"], config, _worker["targets"], _worker["stops"],
+                                   _worker["lots"], _worker["max_lots"], _worker["filename_parent"],
+                                   _worker["cache"], collected, close=_worker["close"],
+                                   span=_worker["span"], checkpoint=outcomes, ticks=_worker["ticks"], stats=stats,
+                                   signals=_worker["signals"], strategy=_worker["strategy"])
+    stats.add_cache(_worker["cache"], cache_state)
+    return results, collected.trades, outcomes.outcomes, stats.state()
+
+
+def chunk_grid(configs, chunk_size):
+    return [configs[i:i + chunk_size] for i in range(0, len(configs), chunk_size)]
+
+
+def parallel_ohlc_backtest(bid, ask, rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets,
+                           stops, overlaps, lots, max_lots, filename_parent, workers=None, chunk_size=None,
+                           checkpoint=None, ticks=None, stats=None, reuse_signals=True, strategy=ema_rsi):
+    # Same arguments and results as ohlc_backtest, plus the number of worker processes
+    # (None uses every core) and the number of indicator configurations per task.
+    # Every worker opens the logs of ticks itself. Span times in stats are summed over the workers.
+    # strategy is sent to the workers, so it has to be a module level function
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    configs = list(ohlc_grid(overlaps, rsi_windows, rsi_overbought_bounds, rsi_oversold_bounds, ema_values))
+    if len(configs) == 0:
+        return []
+    if chunk_size is None:
+        # A few chunks per worker so one slow configuration doesn't leave the others idle
+        chunk_size = max(1, len(configs) // (workers * 4))
+    chunks = chunk_grid(configs, chunk_size)
+    if stats is None:
+        stats = RunStats()
+    stats.total = len(configs) * target_stop_pairs(targets, stops)
+
+    checkpoint = open_checkpoint(checkpoint, bid, ask, lots, max_lots, filename_parent, ticks, strategy)
+    done = checkpoint.done if checkpoint is not None else {}
+    # A resumed sweep keeps the trades of the settings it skips
+    resume = done if checkpoint is not None else None
+
+    blocks = []
+    try:
+        bid_blocks, bid_spec = share_frame(bid)
+        blocks += bid_blocks
+        ask_blocks, ask_spec = share_frame(ask)
+        blocks += ask_blocks
+
+        results = []
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(bid_spec, ask_spec, list(targets), list(stops), lots, max_lots,
+                                            filename_parent, done, ticks, stats, reuse_signals, strategy)) as pool, \
+                TradeStore(filename_parent, resume=resume) as store, BackgroundWriter(store) as writer:
+            if checkpoint is not None:
+                checkpoint.bind(store, writer)
+            try:
+                # imap hands back chunks in grid order, whichever worker finishes first
+                for chunk_results, chunk_trades, chunk_outcomes, chunk_stats in pool.imap(_run_chunk, chunks):
+                    results += chunk_results
+                    stats.merge(chunk_stats)
+                    with stats.span("io"):
+                        for settings, longs, shorts in chunk_trades:
+                            writer.append(settings, longs, shorts)
+                    if checkpoint is not None:
+                        for settings, result, stopped in chunk_outcomes:
+                            checkpoint.record(settings, result, stopped)
+            finally:
+                if checkpoint is not None:
+                    checkpoint.commit()
+        if checkpoint is not None:
+            checkpoint.close()
+        stats.report()
+        return results
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
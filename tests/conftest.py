@@ -0,0 +1,56 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import synthetic_ohlc, synthetic_ticks, write_ticks
+from indicators import IndicatorCache
+from strategies import ema_rsi, entry_positions
+from trade import make_longs, make_shorts
+
+
+@pytest.fixture
+def gapped_bars():
+    # Bid and ask bars missing different rows, as they are after dropna on their own
+    bid, ask = synthetic_ohlc(1200, seed=5)
+    bid_rows = np.ones(len(bid), dtype=bool)
+    bid_rows[:40] = False
+    bid_rows[::7] = False
+    ask_rows = np.ones(len(ask), dtype=bool)
+    ask_rows[::11] = False
+    return bid[bid_rows], ask[ask_rows]
+
+
+@pytest.fixture
+def tick_log(tmp_path):
+    # Tick log of 20000 lines over a morning, an afternoon after a gap of a few hours and the next day
+    epochs, bids, asks = synthetic_ticks(20000, seed=9)
+    epochs[6000:] += 3 * 3600 + 17
+    epochs[14000:] += 15 * 3600
+    filename = str(tmp_path / "ticks.log")
+    write_ticks(filename, epochs, bids, asks)
+    return filename
+
+
+@pytest.fixture
+def window_trades():
+    # Long and short TradeLogs of setting on ask bars start..end, with the bid bars of the same time
+    # and the signals of all the bars
+    def trades(bid, ask, setting, start, end, lots, max_lots):
+        overlap, rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema, target, stop = setting
+        long_mask, short_mask = ema_rsi(IndicatorCache(), "reference", ask["close"].to_numpy(dtype=float),
+                                        rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema)
+        long_positions, short_positions = entry_positions(long_mask[start:end], short_mask[start:end])
+        ask_window = ask.iloc[start:end]
+        times = bid.index >= ask.index[start]
+        if end < len(ask):
+            times &= bid.index < ask.index[end]
+        bid_window = bid[times]
+        return (make_longs(bid_window, ask_window, long_positions, lots=lots, overlap=overlap, target=target,
+                           stop=stop, max_lots=max_lots),
+                make_shorts(ask_window, ask_window, short_positions, lots=lots, overlap=overlap, target=target,
+                            stop=stop, max_lots=max_lots))
+    return trades
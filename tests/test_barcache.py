@@ -0,0 +1,40 @@
+import os
+import numpy as np
+import pandas as pd
+from bench import write_tick_log
+from util import resample
+import barcache
+
+
+def entries(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if os.path.isdir(os.path.join(cache_dir, name)))
+
+
+def test_logs_with_the_same_name_keep_their_entries(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    logs = []
+    for directory, seed in (("one", 1), ("two", 2)):
+        os.makedirs(str(tmp_path / directory))
+        logs.append(str(tmp_path / directory / "day.log"))
+        write_tick_log(logs[-1], 3000, seed=seed)
+
+    for log in logs:
+        barcache.cached_resample(log, "1Min", cache_dir)
+    assert len(entries(cache_dir)) == 2
+    for log in logs:
+        bid, ask = barcache.cached_resample(log, "1Min", cache_dir)
+        expected_bid, expected_ask = resample(log, "1Min")
+        np.testing.assert_array_equal(bid.to_numpy(), expected_bid.to_numpy(dtype=float))
+        pd.testing.assert_index_equal(ask.index, expected_ask.index, exact=False)
+    assert len(entries(cache_dir)) == 2
+
+    # A new version of one log replaces its own entry only
+    before = entries(cache_dir)
+    write_tick_log(logs[0], 2500, seed=3)
+    os.utime(logs[0], ns=(os.stat(logs[0]).st_atime_ns, os.stat(logs[0]).st_mtime_ns + 10 ** 9))
+    bid, ask = barcache.cached_resample(logs[0], "1Min", cache_dir)
+    assert len(bid) == len(resample(logs[0], "1Min")[0])
+    after = entries(cache_dir)
+    assert len(after) == 2
+    assert len(set(before) & set(after)) == 1
+    assert barcache.entry_path([logs[1]], "1Min", cache_dir)[0] in [os.path.join(cache_dir, name) for name in after]
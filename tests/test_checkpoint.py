@@ -0,0 +1,93 @@
+import io
+import contextlib
+import pandas as pd
+import pytest
+import trade
+from bench import synthetic_ohlc
+from checkpoint import Checkpoint
+from trade import ohlc_backtest, open_checkpoint
+from sweep import parallel_ohlc_backtest
+from tradestore import read_trades
+
+GRID = ([14, 21], [30, 40, 45], [55, 60, 70], [7, 14, 28, 42], [200, 400, 600, 900], [100, 300, 600], [True])
+
+
+def assert_same_results(results, expected):
+    assert [result["settings"] for result in results] == [result["settings"] for result in expected]
+    for result, wanted in zip(results, expected):
+        for field, value in wanted.items():
+            assert result[field] == value or (pd.isna(value) and pd.isna(result[field])), field
+
+
+def interrupt_after(configs, monkeypatch):
+    # run_ohlc_config that stops the sweep like a Ctrl-C once configs configurations have run
+    run_ohlc_config = trade.run_ohlc_config
+    calls = []
+
+    def interrupted(*args, **kwargs):
+        if len(calls) == configs:
+            raise KeyboardInterrupt
+        calls.append(args[2])
+        return run_ohlc_config(*args, **kwargs)
+    monkeypatch.setattr(trade, "run_ohlc_config", interrupted)
+
+
+def open_checkpoint_key(bid, ask, lots=1, max_lots=3, filename_parent="run", ticks=None):
+    checkpoint = open_checkpoint("key.checkpoint", bid, ask, lots, max_lots, filename_parent, ticks)
+    checkpoint.close()
+    return checkpoint.key
+
+
+@pytest.mark.parametrize("resume", [ohlc_backtest, parallel_ohlc_backtest])
+def test_resumed_sweep_matches_an_uninterrupted_one(tmp_path, monkeypatch, resume):
+    monkeypatch.chdir(tmp_path)
+    bid, ask = synthetic_ohlc(2000, seed=3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = ohlc_backtest(bid, ask, *GRID, 1, 3, "uninterrupted", checkpoint="uninterrupted.checkpoint")
+        checkpoint = Checkpoint("uninterrupted.checkpoint",
+                                open_checkpoint_key(bid, ask, filename_parent="uninterrupted"))
+        settings = len(checkpoint.done)
+        checkpoint.close()
+        with monkeypatch.context() as patch:
+            interrupt_after(7, patch)
+            with pytest.raises(KeyboardInterrupt):
+                ohlc_backtest(bid, ask, *GRID, 1, 3, "run", checkpoint="run.checkpoint")
+        # The interruption left a line half written
+        with open("run.checkpoint", "a") as outfile:
+            outfile.write('{"settings": "overlap_True-rsiwin')
+        checkpoint = Checkpoint("run.checkpoint", open_checkpoint_key(bid, ask))
+        done = len(checkpoint.done)
+        checkpoint.close()
+        kwargs = {"workers": 2, "chunk_size": 3} if resume is parallel_ohlc_backtest else {}
+        results = resume(bid, ask, *GRID, 1, 3, "run", checkpoint="run.checkpoint", **kwargs)
+
+    assert 0 < done < settings
+    assert_same_results(results, expected)
+    pd.testing.assert_frame_equal(read_trades("run"), read_trades("uninterrupted"))
+
+
+def test_changed_arguments_or_data_start_over(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bid, ask = synthetic_ohlc(500, seed=3)
+    key = open_checkpoint_key(bid, ask)
+    assert open_checkpoint_key(bid, ask) == key
+
+    changed_bid = bid.copy()
+    changed_bid.iloc[250, 0] += 1
+    shifted_ask = ask.copy()
+    shifted_ask.index = shifted_ask.index + pd.Timedelta(minutes=1)
+    keys = [open_checkpoint_key(bid, ask, lots=2), open_checkpoint_key(bid, ask, max_lots=5),
+            open_checkpoint_key(bid, ask, filename_parent="other"), open_checkpoint_key(bid, ask, ticks=object()),
+            open_checkpoint_key(changed_bid, ask), open_checkpoint_key(bid, shifted_ask),
+            open_checkpoint_key(bid.iloc[:-1], ask)]
+    assert len(set(keys + [key])) == len(keys) + 1
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        ohlc_backtest(bid, ask, *GRID, 1, 3, "run", checkpoint="run.checkpoint")
+        checkpoint = Checkpoint("run.checkpoint", key)
+        assert len(checkpoint.done) != 0
+        checkpoint.close()
+        # Other data under the same checkpoint file starts over
+        checkpoint = Checkpoint("run.checkpoint", open_checkpoint_key(changed_bid, ask))
+        assert len(checkpoint.done) == 0
+        checkpoint.close()
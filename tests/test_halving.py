@@ -0,0 +1,64 @@
+import io
+import contextlib
+import pandas as pd
+import pytest
+import halving
+from halving import evaluate, time_window, halving_backtest
+from indicators import IndicatorCache
+from bench import synthetic_ohlc
+from metrics import trade_metrics
+from tradestore import read_trades
+
+GRID = ([14, 21], [30, 40, 45], [55, 60, 70], [7, 14, 28, 42], [200, 400, 600, 900], [100, 300, 600], [True])
+
+SETTINGS = [(True, 14, 60, 40, 28, 7, 400, 200), (False, 14, 55, 45, 42, 7, 600, 300),
+            (True, 21, 55, 45, 42, 14, 900, 600)]
+
+
+@pytest.mark.parametrize("start, end", [(0, 600), (300, 900), (500, None)])
+def test_evaluate_cuts_bid_by_time(gapped_bars, window_trades, start, end):
+    bid, ask = gapped_bars
+    end = len(ask) if end is None else end
+    close = ask["close"].to_numpy(dtype=float)
+    found = 0
+    for setting, metrics, long_log, short_log in evaluate(bid, ask, SETTINGS, end, 1, 3, "gapped", IndicatorCache(),
+                                                          close, start=start):
+        longs, shorts = window_trades(bid, ask, setting, start, end, 1, 3)
+        pd.testing.assert_frame_equal(pd.DataFrame(long_log.records), pd.DataFrame(longs.records))
+        pd.testing.assert_frame_equal(pd.DataFrame(short_log.records), pd.DataFrame(shorts.records))
+        found += len(long_log)
+    assert found != 0
+
+
+
+
+def test_time_window(gapped_bars):
+    bid, ask = gapped_bars
+    window = time_window(bid, ask, 300, 900)
+    assert window.index[0] >= ask.index[300] and window.index[-1] < ask.index[900]
+    assert len(time_window(bid, ask, 0, len(ask))) == len(bid)
+
+
+def test_last_rung_keeps_only_results(tmp_path, monkeypatch):
+    # Settings with a side that made nothing aren't results, as in ohlc_backtest
+    monkeypatch.chdir(tmp_path)
+    bid, ask = synthetic_ohlc(2000, seed=3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected, _ = halving_backtest(bid, ask, *GRID, 1, 3, "all")
+
+    def odd_longs_made_nothing(*args, **kwargs):
+        metrics = trade_metrics(*args, **kwargs)
+        if metrics["num_longs"] % 2 == 1:
+            metrics["netlongpnl"] = 0.0
+        return metrics
+    monkeypatch.setattr(halving, "trade_metrics", odd_longs_made_nothing)
+    with contextlib.redirect_stdout(io.StringIO()):
+        results, report = halving_backtest(bid, ask, *GRID, 1, 3, "filtered")
+
+    dropped = [row["settings"] for row in report if row["reason"] == "not a result"]
+    assert len(dropped) != 0 and len(results) != 0
+    assert all(result["num_longs"] % 2 == 0 for result in results)
+    assert sorted(dropped + [result["settings"] for result in results]) == \
+        sorted(result["settings"] for result in expected)
+    # Their trades are stored like ohlc_backtest stores them
+    assert set(read_trades("filtered")["settings"]) == set(read_trades("all")["settings"])
@@ -0,0 +1,37 @@
+import numpy as np
+from bench import synthetic_ohlc
+from indicators import IndicatorCache
+
+
+def test_other_bars_under_the_same_name_miss():
+    bid, ask = synthetic_ohlc(500, seed=2)
+    close = ask["close"].to_numpy(dtype=float)
+    cache = IndicatorCache()
+    full = cache.rsi("instrument", close, 14)
+    assert cache.rsi("instrument", close, 14) is full
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A fold of the same bars, then the same number of bars of another range
+    fold = cache.rsi("instrument", close[100:300], 14)
+    assert len(fold) == 200
+    np.testing.assert_array_equal(fold, IndicatorCache().rsi("other", close[100:300].copy(), 14))
+    other = cache.rsi("instrument", close[::-1].copy(), 14)
+    assert not np.array_equal(other, full, equal_nan=True)
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    # An equal copy of the prices is the same data
+    assert cache.rsi("instrument", close.copy(), 14) is full
+
+
+def test_put_is_found_by_its_close():
+    bid, ask = synthetic_ohlc(300, seed=2)
+    close = ask["close"].to_numpy(dtype=float)
+    values = IndicatorCache().ema("instrument", close, 7)
+    cache = IndicatorCache()
+    cache.put("instrument", "EMA", 7, values.copy(), close)
+    assert cache.nbytes == values.nbytes
+    cache.put("instrument", "EMA", 7, values.copy(), close)
+    assert cache.nbytes == values.nbytes
+    cache.ema("instrument", close, 7)
+    cache.ema("instrument", close[:-1], 7)
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,89 @@
+import math
+import numpy as np
+import pandas as pd
+import pytest
+from metrics import trade_metrics, BROKERAGE
+from records import TradeLog, ExitType, NAT
+
+START = pd.Timestamp("2019-01-21 09:30").value
+MINUTE = 60 * 10 ** 9
+HOUR = 60 * MINUTE
+
+
+def at(minutes):
+    return START + minutes * MINUTE
+
+
+def hand_logs():
+    # Longs: a win, a loss open at the same time, a rejected signal and one still open at the end.
+    # Shorts: a loss, a rejected signal (pnl 0, no entry price, as short_trade logs it) and a win
+    longs = TradeLog(1)
+    longs.append(at(0), at(10), 1000.0, 1500.0, 700.0, ExitType.WIN, 500.0, 0)
+    longs.append(at(5), at(20), 1000.0, 1500.0, 700.0, ExitType.LOSS, -300.0, 1)
+    longs.append(at(6), NAT, np.nan, np.nan, np.nan, ExitType.OVERLAP, np.nan, 0)
+    longs.append(at(30), NAT, 1000.0, 1500.0, 700.0, ExitType.NONE, 0.0, 0)
+    shorts = TradeLog(-1)
+    shorts.append(at(12), at(15), 2000.0, 1900.0, 2400.0, ExitType.LOSS, -400.0, 0)
+    shorts.append(at(13), NAT, np.nan, np.nan, np.nan, ExitType.OVERLAP, 0.0, 0)
+    shorts.append(at(40), at(50), 2000.0, 1900.0, 2400.0, ExitType.WIN, 100.0, -1)
+    return longs, shorts
+
+
+def test_hand_computed_log():
+    metrics = trade_metrics(*hand_logs(), span=HOUR)
+    # The trade still open and the rejected signals have no exit, they aren't closed trades
+    assert metrics["num_longs"] == 2 and metrics["num_shorts"] == 2 and metrics["number_of_trades"] == 4
+    # Turnover counts every trade with an entry price, the open one as well
+    assert metrics["netlongpnl"] == pytest.approx(200 - 3000 * BROKERAGE)
+    assert metrics["netshortpnl"] == pytest.approx(-300 - 4000 * BROKERAGE)
+    assert metrics["profitability_total"] == 0.5
+    assert metrics["max_profit"] == 500.0
+    assert metrics["worst_trade"] == -400.0
+    assert metrics["average_pnl"] == pytest.approx(-100 / 6)
+    # Equity in exit order: +500 (10), -400 (15), -300 (20), +100 (50) is 500, 100, -200, -100
+    assert metrics["max_DD"] == -700.0
+    assert metrics["apnl/max_DD"] == pytest.approx(-100 / 6 / 700)
+    # Closed pnl 500, -300, -400, 100
+    assert metrics["sharpe"] == pytest.approx(-25 / math.sqrt(507500 / 3))
+    # Closed trades cover 09:30-09:50 and 10:10-10:20 of the hour
+    assert metrics["exposure"] == pytest.approx(0.5)
+    assert metrics["average_trade_time"] == pd.Timedelta(minutes=9.5)
+    assert metrics["long_max_concurrent"] == 1 and metrics["short_max_concurrent"] == -1
+
+
+def test_drawdown_from_zero():
+    # Losing from the start is a drawdown from the equity before the first trade
+    longs = TradeLog(1)
+    longs.append(at(0), at(1), 1000.0, 1500.0, 700.0, ExitType.LOSS, -200.0, 0)
+    longs.append(at(2), at(3), 1000.0, 1500.0, 700.0, ExitType.WIN, 50.0, 0)
+    metrics = trade_metrics(longs, TradeLog(-1), span=HOUR)
+    assert metrics["max_DD"] == -200.0
+    assert metrics["num_shorts"] == 0
+    assert math.isnan(metrics["profitability_shorts"])
+
+
+def test_no_trades():
+    metrics = trade_metrics(TradeLog(1), TradeLog(-1), span=HOUR)
+    assert metrics["number_of_trades"] == 0
+    assert metrics["netpnl"] == 0.0
+    assert metrics["max_DD"] == 0.0
+    assert metrics["average_trade_time"] is None
+    assert metrics["long_max_concurrent"] == 0 and metrics["short_max_concurrent"] == 0
+    for field in ("profitability_total", "max_profit", "worst_trade", "average_pnl", "apnl/max_DD", "sharpe",
+                  "exposure"):
+        assert math.isnan(metrics[field]), field
+
+
+def test_only_still_open_trades():
+    longs = TradeLog(1)
+    longs.append(at(0), NAT, 1000.0, 1500.0, 700.0, ExitType.NONE, 0.0, 0)
+    shorts = TradeLog(-1)
+    shorts.append(at(1), NAT, 2000.0, 1900.0, 2400.0, ExitType.NONE, 0.0, 0)
+    metrics = trade_metrics(longs, shorts, span=HOUR)
+    assert metrics["number_of_trades"] == 0
+    # Nothing closed, but the brokerage of the entries is paid
+    assert metrics["netpnl"] == pytest.approx(-3000 * BROKERAGE)
+    assert metrics["max_DD"] == 0.0
+    assert metrics["worst_trade"] == 0.0 and metrics["average_pnl"] == 0.0
+    assert math.isnan(metrics["sharpe"]) and math.isnan(metrics["exposure"])
+    assert metrics["average_trade_time"] is None
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+from metrics import BROKERAGE
+from portfolio import portfolio_trades
+from records import TradeLog, ExitType, NAT, timestamp_nanoseconds
+
+START = pd.Timestamp("2019-01-21 09:30")
+
+
+def minute(m):
+    return timestamp_nanoseconds(START + pd.Timedelta(minutes=m))
+
+
+def trade_log(side, trades):
+    # TradeLog of (entry minute, exit minute or None, entry price, type of exit, pnl)
+    log = TradeLog(side)
+    for entry, exit, price, type_of_exit, pnl in trades:
+        log.append(minute(entry), NAT if exit is None else minute(exit), price, np.nan, np.nan, type_of_exit, pnl, 1)
+    return log
+
+
+@pytest.fixture
+def logs():
+    # CRUDE: a long won at 4, a short never closed, a signal stopped by overlap.
+    # GOLD: a long lost at 5, a short won at 7 and a long from 6 to 8
+    return {"CRUDE": (trade_log(1, [(1, 4, 1000.0, ExitType.WIN, 100.0),
+                                    (3, None, np.nan, ExitType.OVERLAP, np.nan)]),
+                      trade_log(-1, [(2, None, 1000.0, ExitType.NONE, 0.0)])),
+            "GOLD": (trade_log(1, [(3, 5, 2000.0, ExitType.LOSS, -50.0),
+                                   (6, 8, 2000.0, ExitType.WIN, 70.0)]),
+                     trade_log(-1, [(5, 7, 2000.0, ExitType.WIN, 80.0)]))}
+
+
+def accepted(trades):
+    minutes = (trades["timestamp_of_entry"] - START) // pd.Timedelta(minutes=1)
+    return list(zip(trades["instrument"], trades["side"], minutes))
+
+
+def test_shared_lot_limit(logs):
+    trades, equity, rejected = portfolio_trades(logs, 1, portfolio_max_lots=2)
+    # The still open short holds its lot to the end: GOLD's long at 3 and 6 find 2 lots open,
+    # its short at 5 gets the lot CRUDE's long gave back at 4
+    assert accepted(trades) == [("CRUDE", 1, 1), ("CRUDE", -1, 2), ("GOLD", -1, 5)]
+    assert rejected == {"rejected_lots": 2, "rejected_capital": 0}
+    assert trades["timestamp_of_exit"].isna().tolist() == [False, True, False]
+    assert list(trades["net_pnl"]) == [100.0 - 1000.0 * BROKERAGE, -1000.0 * BROKERAGE, 80.0 - 2000.0 * BROKERAGE]
+
+    assert list(equity.index) == [START + pd.Timedelta(minutes=4), START + pd.Timedelta(minutes=7)]
+    assert equity.iloc[0] == 100.0 - 1000.0 * BROKERAGE
+    assert equity.iloc[1] == pytest.approx(equity.iloc[0] + (80.0 - 2000.0 * BROKERAGE))
+
+
+def test_shared_capital(logs):
+    capital = 3950.0
+    trades, equity, rejected = portfolio_trades(logs, 1, capital=capital,
+                                                margin_per_lot={"CRUDE": 1000.0, "GOLD": 3000.0})
+    # 2000 margin is used by both CRUDE trades at 3, GOLD's long needs 3000 more.
+    # At 5 CRUDE's long has given back its 1000 and booked its pnl, so 3950 + 100 covers 4000.
+    # At 6 the still open short and GOLD's short hold 4000
+    assert accepted(trades) == [("CRUDE", 1, 1), ("CRUDE", -1, 2), ("GOLD", -1, 5)]
+    assert rejected == {"rejected_lots": 0, "rejected_capital": 2}
+    assert equity.iloc[0] == pytest.approx(capital + (100.0 - 1000.0 * BROKERAGE))
+    assert equity.iloc[-1] == pytest.approx(capital + (100.0 - 1000.0 * BROKERAGE) + (80.0 - 2000.0 * BROKERAGE))
+
+    # With 50 less capital CRUDE's pnl no longer covers GOLD's short at 5
+    trades, equity, rejected = portfolio_trades(logs, 1, capital=3900.0,
+                                                margin_per_lot={"CRUDE": 1000.0, "GOLD": 3000.0})
+    assert accepted(trades) == [("CRUDE", 1, 1), ("CRUDE", -1, 2)]
+    assert rejected == {"rejected_lots": 0, "rejected_capital": 3}
+
+
+def test_no_limits_take_every_entered_trade(logs):
+    trades, equity, rejected = portfolio_trades(logs, 1)
+    assert accepted(trades) == [("CRUDE", 1, 1), ("CRUDE", -1, 2), ("GOLD", 1, 3), ("GOLD", -1, 5),
+                                ("GOLD", 1, 6)]
+    assert rejected == {"rejected_lots": 0, "rejected_capital": 0}
+    assert len(equity) == 4
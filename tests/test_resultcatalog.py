@@ -0,0 +1,41 @@
+import resultcatalog
+
+
+def settings(target, stop):
+    return "overlap_True-rsiwindow_14-rsiupper_70-rsilower_30-slowema_50-fastema_20-target_{}-stop_{}".format(
+        target, stop)
+
+
+def test_keys_of_later_rows_are_inserted(tmp_path):
+    catalog = str(tmp_path / "results.sqlite")
+    results = [{"settings": settings(300, 100), "netpnl": 5.0},
+               {"settings": settings(600, 100), "netpnl": 7.0, "sharpe": 1.5},
+               {"settings": settings(900, 200), "netpnl": 3.0, "apnl/max_DD": 0.5}]
+    assert resultcatalog.add_results(results, "run", catalog) == 3
+
+    rows = resultcatalog.top("netpnl", 10, catalog).set_index("settings")
+    assert rows.loc[settings(600, 100), "sharpe"] == 1.5
+    assert rows.loc[settings(900, 200), "apnl/max_DD"] == 0.5
+    assert rows["sharpe"].isna().sum() == 2
+
+    assert list(resultcatalog.top("sharpe", 10, catalog)["settings"]) == [settings(600, 100)]
+
+
+def test_parameters_are_indexed(tmp_path):
+    catalog = str(tmp_path / "results.sqlite")
+    results = [{"settings": settings(target, stop), "netpnl": float(target - stop)}
+               for target in (300, 600, 900) for stop in (100, 200)]
+    resultcatalog.add_results(results, "run", catalog)
+
+    connection = resultcatalog.connect(catalog)
+    try:
+        indexes = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        plan = " ".join(row[-1] for row in connection.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM results WHERE target >= 600 AND target <= 900"))
+    finally:
+        connection.close()
+    assert {"results_" + parameter for parameter in resultcatalog.PARAMETERS} <= indexes
+    assert "results_target" in plan
+
+    rows = resultcatalog.top("netpnl", 10, catalog, target=(600, None), stop=200)
+    assert list(rows["settings"]) == [settings(900, 200), settings(600, 200)]
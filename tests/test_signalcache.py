@@ -0,0 +1,72 @@
+import pandas as pd
+from bench import synthetic_ohlc
+from indicators import IndicatorCache
+from signalcache import SignalCache, fingerprint
+from sweep import _CollectTrades
+from trade import ohlc_grid, run_ohlc_config
+
+GRID = ([14, 21], [30, 40, 45], [55, 60, 70], [7, 14, 28, 42], [200, 400, 600, 900], [100, 300, 600], [True])
+
+
+def sweep(bid, ask, signals, configs=None):
+    # Results and trades of run_ohlc_config over the grid (or configs of it), sharing signals
+    rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets, stops, overlaps = GRID
+    if configs is None:
+        configs = list(ohlc_grid(overlaps, rsi_windows, rsi_overbought_bounds, rsi_oversold_bounds, ema_values))
+    cache = IndicatorCache()
+    store = _CollectTrades()
+    results = []
+    for config in configs:
+        results += run_ohlc_config(bid, ask, config, targets, stops, 1, 3, "instrument", cache, store,
+                                   signals=signals)
+    trades = [(settings, longs.to_dicts(), shorts.to_dicts()) for settings, longs, shorts in store.trades]
+    return results, trades
+
+
+def assert_results_equal(results, expected):
+    assert [result["settings"] for result in results] == [result["settings"] for result in expected]
+    for result, wanted in zip(results, expected):
+        for field, value in wanted.items():
+            assert result[field] == value or (pd.isna(value) and pd.isna(result[field])), field
+
+
+def test_reused_signals_match_recomputed():
+    bid, ask = synthetic_ohlc(2000, seed=3)
+    signals = SignalCache()
+    results, trades = sweep(bid, ask, signals)
+    expected, expected_trades = sweep(bid, ask, None)
+
+    assert len(expected) != 0
+    # Configurations picking the same entries were simulated once
+    assert signals.hits != 0 and signals.grid_hits != 0
+    assert_results_equal(results, expected)
+    assert trades == expected_trades
+
+
+def test_other_bars_miss():
+    bid, ask = synthetic_ohlc(2000, seed=3)
+    # Same closes, so the same entries, but other opens, which is where trades exit
+    other_bid, other_ask = bid.copy(), ask.copy()
+    for frame in (other_bid, other_ask):
+        frame["open"] -= 20
+        frame["low"] -= 20
+
+    rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, _, _, overlaps = GRID
+    # Configurations that trade
+    configs = list(ohlc_grid(overlaps, rsi_windows, rsi_overbought_bounds, rsi_oversold_bounds, ema_values))[5:8]
+    signals = SignalCache()
+    _, trades = sweep(bid, ask, signals, configs)
+    hits, grid_hits = signals.hits, signals.grid_hits
+    # The first configuration on the other bars has nothing to reuse
+    other, other_trades = sweep(other_bid, other_ask, signals, configs[:1])
+    assert (signals.hits, signals.grid_hits) == (hits, grid_hits)
+    assert signals.bars_key(other_bid, other_ask) != signals.bars_key(bid, ask)
+    assert fingerprint("instrument", signals.bars_key(other_bid, other_ask), [1, 5], [3]) != \
+        fingerprint("instrument", signals.bars_key(bid, ask), [1, 5], [3])
+
+    # It gets the trades of the other bars
+    expected, expected_trades = sweep(other_bid, other_ask, None, configs[:1])
+    assert_results_equal(other, expected)
+    assert len(other_trades) != 0 and other_trades == expected_trades
+    # which differ from those of the same entries on the first bars
+    assert other_trades != trades[:len(other_trades)]
@@ -0,0 +1,58 @@
+import io
+import contextlib
+import numpy as np
+from bench import synthetic_ohlc
+from trade import ohlc_backtest, open_checkpoint
+from sweep import parallel_ohlc_backtest
+from halving import halving_backtest
+from walkforward import walk_forward
+from strategies import ema_rsi
+
+GRID = ([14, 21], [30, 40, 45], [55, 60, 70], [7, 14, 28, 42], [200, 400, 600, 900], [100, 300, 600], [True])
+
+
+def rsi_only(cache, instrument, close, rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema):
+    # ema_rsi without the EMA trend filter
+    rsi = cache.rsi(instrument, close, rsi_window)
+    return rsi < rsi_lower, rsi > rsi_upper
+
+
+def no_shorts(cache, instrument, close, *parameters):
+    long_mask, short_mask = ema_rsi(cache, instrument, close, *parameters)
+    return long_mask, np.zeros_like(short_mask)
+
+
+def run(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def test_sweeps_take_the_strategy(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bid, ask = synthetic_ohlc(2000, seed=3)
+    default = run(ohlc_backtest, bid, ask, *GRID, 1, 3, "default")
+    serial = run(ohlc_backtest, bid, ask, *GRID, 1, 3, "serial", strategy=rsi_only)
+    parallel = run(parallel_ohlc_backtest, bid, ask, *GRID, 1, 3, "parallel", workers=2, strategy=rsi_only)
+    assert len(default) != 0 and len(serial) != 0
+    assert [result["netpnl"] for result in serial] != [result["netpnl"] for result in default]
+    assert [(result["settings"], result["netpnl"]) for result in parallel] == \
+        [(result["settings"], result["netpnl"]) for result in serial]
+
+    # Without shorts no setting gives a result
+    assert run(ohlc_backtest, bid, ask, *GRID, 1, 3, "none", strategy=no_shorts) == []
+    results, report = run(halving_backtest, bid, ask, *GRID, 1, 3, "halving", strategy=no_shorts)
+    assert results == [] and len(report) != 0
+    assert len(run(halving_backtest, bid, ask, *GRID, 1, 3, "halving")[0]) != 0
+    folds, summary = run(walk_forward, bid, ask, *GRID, 1, 3, "walk", train=800, test=400, workers=2,
+                         strategy=no_shorts)
+    assert len(folds) != 0 and all(fold["settings"] is None for fold in folds) and summary is None
+
+
+def test_strategy_is_in_the_checkpoint_key(tmp_path):
+    bid, ask = synthetic_ohlc(200, seed=3)
+    keys = []
+    for strategy in (ema_rsi, rsi_only):
+        checkpoint = open_checkpoint(str(tmp_path / "run.checkpoint"), bid, ask, 1, 3, "run", strategy=strategy)
+        keys.append(checkpoint.key)
+        checkpoint.close()
+    assert keys[0] != keys[1]
@@ -0,0 +1,52 @@
+import io
+import contextlib
+import numpy as np
+import pandas as pd
+import pytest
+from bench import synthetic_ohlc
+import trade
+from trade import ohlc_backtest
+from stream import stream_backtest
+from positions import OpenPositions, STILL_OPEN
+from tradestore import read_trades
+
+# With lookahead stream_backtest gives the same results and trades as ohlc_backtest.
+# Seed 3 has trades that never reach their target or stop, which hold no
+# position in ohlc_backtest, so signals behind them are taken there. Without
+# lookahead those trades are open until the data ends, as with a book that
+# holds them until then (positions.STILL_OPEN).
+GRID = ([14, 21], [30, 40, 45], [55, 60, 70], [7, 14, 28, 42], [200, 400, 600, 900], [100, 300, 600])
+
+
+class HeldPositions(OpenPositions):
+    # Book of trade.long_trade / short_trade with trades that never exit open until the end
+
+    def add(self, timestamp_of_exit):
+        OpenPositions.add(self, STILL_OPEN if timestamp_of_exit is None else timestamp_of_exit)
+
+
+@pytest.mark.parametrize("overlap", [True, False])
+@pytest.mark.parametrize("max_lots", [3, 10])
+@pytest.mark.parametrize("lookahead", [0, 2000])
+def test_stream_matches_batch(tmp_path, monkeypatch, overlap, max_lots, lookahead):
+    monkeypatch.chdir(tmp_path)
+    bid, ask = synthetic_ohlc(2000, seed=3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        with monkeypatch.context() as patch:
+            if lookahead == 0:
+                patch.setattr(trade, "OpenPositions", HeldPositions)
+            batch = ohlc_backtest(bid, ask, *GRID, [overlap], 1, max_lots, "batch")
+        stream = stream_backtest(bid, ask, *GRID, [overlap], 1, max_lots, "stream", lookahead=lookahead)
+
+    assert len(batch) != 0
+    assert [result["settings"] for result in stream] == [result["settings"] for result in batch]
+    for expected, result in zip(batch, stream):
+        for field, value in expected.items():
+            assert result[field] == value or (pd.isna(value) and pd.isna(result[field])), field
+
+    batch_trades, stream_trades = read_trades("batch"), read_trades("stream")
+    if overlap:
+        # Only means something if some taken trades never exit
+        assert (~np.isnan(batch_trades["entry_price"]) & batch_trades["timestamp_of_exit"].isna()).any()
+    pd.testing.assert_frame_equal(stream_trades, batch_trades)
+
@@ -0,0 +1,29 @@
+import os
+import io
+import contextlib
+import pandas as pd
+import pytest
+from bench import synthetic_ohlc
+from trade import ohlc_backtest
+from sweep import parallel_ohlc_backtest
+from tradestore import read_trades
+
+GRID = ([14, 21], [30, 40, 45], [55, 60, 70], [7, 14, 28, 42], [200, 400, 600, 900], [100, 300, 600])
+
+
+@pytest.mark.parametrize("overlap", [True, False])
+def test_parallel_matches_serial(tmp_path, monkeypatch, overlap):
+    monkeypatch.chdir(tmp_path)
+    bid, ask = synthetic_ohlc(2000, seed=3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        serial = ohlc_backtest(bid, ask, *GRID, [overlap], 1, 3, "serial")
+        parallel = parallel_ohlc_backtest(bid, ask, *GRID, [overlap], 1, 3, "parallel", workers=3, chunk_size=2)
+
+    assert len(serial) != 0
+    assert [result["settings"] for result in parallel] == [result["settings"] for result in serial]
+    for expected, result in zip(serial, parallel):
+        for field, value in expected.items():
+            assert result[field] == value or (pd.isna(value) and pd.isna(result[field])), field
+    pd.testing.assert_frame_equal(read_trades("parallel"), read_trades("serial"))
+    # Workers don't write the indicator debug dump
+    assert not os.path.exists("a.csv")
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from exits import tick_exit_grid
+from records import to_nanoseconds
+from tickindex import tick_index
+from util import resample, read_tick_log
+
+TARGETS = [60, 200]
+STOPS = [40, 150]
+
+
+def with_blank_lines(filename, path):
+    # The log with empty lines in its first edge lines, in the middle and in its last edge lines
+    with open(filename, "rb") as infile:
+        lines = infile.readlines()
+    for line, blank in sorted([(20, b"\n"), (7000, b"\r\n"), (7001, b"\n"), (len(lines) - 10, b"\n")],
+                              reverse=True):
+        lines.insert(line, blank)
+    with open(path, "wb") as outfile:
+        outfile.writelines(lines)
+    return path
+
+
+def first_tick_exits(ticks, frame, ask, positions, side, tick_side):
+    # Exit bar, price and time of every entry, target and stop by going through every tick after the entry bar
+    index = to_nanoseconds(frame.index)
+    tick_times = to_nanoseconds(ticks.index)
+    prices = ticks[tick_side].to_numpy(dtype=float)
+    shape = (len(positions), len(TARGETS), len(STOPS))
+    exits, exit_prices, exit_times = np.full(shape, -1), np.full(shape, np.nan), np.zeros(shape, dtype="int64")
+    for i, p in enumerate(positions):
+        bar = np.searchsorted(index, to_nanoseconds(ask.index)[p], side="right")
+        if bar == len(index):
+            continue
+        after = tick_times >= index[bar]
+        entry_price = ask["close"].iloc[p]
+        for t, target in enumerate(TARGETS):
+            for s, stop in enumerate(STOPS):
+                upper, lower = (entry_price + target, entry_price - stop) if side == 1 else \
+                    (entry_price + stop, entry_price - target)
+                hits = np.flatnonzero(after & ((prices >= upper) | (prices <= lower)))
+                if len(hits) != 0:
+                    exit_times[i, t, s] = tick_times[hits[0]]
+                    exit_prices[i, t, s] = prices[hits[0]]
+                    exits[i, t, s] = np.searchsorted(index, tick_times[hits[0]], side="right") - 1
+    return exits, exit_prices, exit_times
+
+
+@pytest.mark.parametrize("timeframe", ["1Min", "7Min"])
+def test_tick_exits_match_every_tick(tmp_path, tick_log, timeframe):
+    # 7 minutes don't divide a day, resample's bins start at the midnight before the first tick
+    log = with_blank_lines(tick_log, str(tmp_path / "blank.log"))
+    bid, ask = resample(log, timeframe)
+    bid, ask = bid.dropna(), ask.dropna()
+    ticks = read_tick_log(log, engine="c")
+    index = tick_index([log], timeframe, cache_dir=str(tmp_path / "cache"))
+    positions = np.arange(0, len(ask) - 1, 3)
+    for side, frame, tick_side in ((1, bid, "B"), (-1, ask, "A")):
+        found = tick_exit_grid(frame, ask, positions, TARGETS, STOPS, side, index)
+        expected = first_tick_exits(ticks, frame, ask, positions, side, tick_side)
+        assert (expected[0] >= 0).sum() > len(positions)
+        for value, wanted in zip(found, expected):
+            np.testing.assert_array_equal(value, wanted)
+    index.close()
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+import trade
+from trade import make_long, make_short, make_longs, make_shorts
+from bench import synthetic_ohlc
+from exits import exit_arrays
+from positions import OpenPositions
+from stream import StreamingSide
+from records import ExitType, to_nanoseconds
+
+
+def flat_frame(bars=6, price=1000.0):
+    # Prices that never move, so no trade reaches its target or stop
+    index = pd.date_range("2019-01-21 09:30", periods=bars, freq="1min", name="Timestamp")
+    return pd.DataFrame({"open": price, "high": price, "low": price, "close": price}, index=index)
+
+
+@pytest.mark.parametrize("make_trades", [make_longs, make_shorts])
+@pytest.mark.parametrize("overlap", [True, False])
+def test_never_exiting_trade_holds_no_position(make_trades, overlap):
+    frame = flat_frame()
+    log = make_trades(frame, frame, [0, 2, 4], lots=1, overlap=overlap, target=100, stop=100, max_lots=1)
+    # Neither overlap nor max_lots=1 rejects the later signals
+    assert list(log.records["type_of_exit"]) == [ExitType.NONE] * 3
+    assert not np.isnan(log.records["entry_price"]).any()
+
+
+@pytest.mark.parametrize("side", [1, -1])
+@pytest.mark.parametrize("overlap", [True, False])
+def test_streaming_side_matches(side, overlap):
+    # With lookahead the signals behind a trade that never exits wait and are taken as in make_longs
+    frame = flat_frame()
+    make_trades = make_longs if side == 1 else make_shorts
+    batch = make_trades(frame, frame, [0, 2, 4], lots=1, overlap=overlap, target=100, stop=100, max_lots=1)
+    stream = StreamingSide(side, 100, 100, 1, 1, overlap, lookahead=2)
+    for p, timestamp in enumerate(to_nanoseconds(frame.index)):
+        stream.exits(timestamp, frame["open"].iloc[p])
+        if p in (0, 2, 4):
+            stream.enter(timestamp, frame["close"].iloc[p])
+            assert len(stream.waiting) <= 2
+    stream.finish()
+    np.testing.assert_array_equal(stream.log.records, batch.records)
+
+
+@pytest.mark.parametrize("side", [1, -1])
+@pytest.mark.parametrize("lookahead", [0, 1])
+def test_streaming_side_decides_on_the_bar(side, lookahead):
+    # A trade that never exits is open at every later signal. Without lookahead each signal is in the
+    # log on the bar it comes in, with lookahead 1 only one of them waits
+    frame = flat_frame(bars=8)
+    stream = StreamingSide(side, 100, 100, 1, 10, False, lookahead=lookahead)
+    signals = 0
+    for p, timestamp in enumerate(to_nanoseconds(frame.index)):
+        stream.exits(timestamp, frame["open"].iloc[p])
+        if p % 2 == 0:
+            stream.enter(timestamp, frame["close"].iloc[p])
+            signals += 1
+            assert len(stream.log) == signals - len(stream.waiting)
+            assert len(stream.waiting) == min(lookahead, signals - 1)
+    stream.finish()
+    # The signal still waiting at the end is behind a trade that turned out never to exit
+    expected = [ExitType.NONE] + [ExitType.OVERLAP] * 3
+    if lookahead == 1:
+        expected[-1] = ExitType.NONE
+    assert list(stream.log.records["type_of_exit"]) == expected
+
+
+def test_short_overlap_only_while_a_short_is_open():
+    # The short taken at bar 0 reaches its target at bar 2, so bar 1 overlaps and bar 4 is taken again
+    frame = flat_frame()
+    frame.loc[frame.index[2:], ["open", "high", "low", "close"]] = 850.0
+    log = make_shorts(frame, frame, [0, 1, 4], lots=1, overlap=False, target=100, stop=100, max_lots=10)
+    assert list(log.records["type_of_exit"]) == [ExitType.WIN, ExitType.OVERLAP, ExitType.NONE]
+    assert log.records["entry_price"][2] == 850.0
+
+
+@pytest.mark.parametrize("side", [1, -1])
+@pytest.mark.parametrize("overlap", [True, False])
+def test_signal_by_signal_matches_batch(side, overlap, monkeypatch):
+    bid, ask = synthetic_ohlc(600, seed=11)
+    frame = bid if side == 1 else ask
+    positions = list(range(0, 599, 3))
+    make_trades, make_trade = (make_longs, make_long) if side == 1 else (make_shorts, make_short)
+    batch = make_trades(frame, ask, positions, lots=1, overlap=overlap, target=150, stop=100, max_lots=3)
+
+    book, exits = OpenPositions(), exit_arrays(frame)
+
+    def rebuilt(dataframe):
+        raise AssertionError("exit arrays rebuilt for a signal")
+    monkeypatch.setattr(trade, "exit_arrays", rebuilt)
+    trades = []
+    for p in positions:
+        trades.append(make_trade(trades, frame, (ask.index[p], ask.iloc[p]), lots=1, overlap=overlap, target=150,
+                                 stop=100, max_lots=3, book=book, exits=exits))
+    assert trades == batch.to_dicts()
@@ -0,0 +1,57 @@
+import io
+import contextlib
+import pandas as pd
+from bench import synthetic_ohlc
+from records import TradeLog, ExitType
+from trade import ohlc_backtest
+from tradestore import TradeStore, read_trades, read_index
+
+GRID = ([14, 21], [30, 40, 45], [55, 60, 70], [7, 14, 28, 42], [200, 400, 600, 900], [100, 300, 600], [True])
+
+
+def trades(count, price):
+    log = TradeLog(1)
+    for i in range(count):
+        log.append(i, i + 1, price, price + 1, price - 1, ExitType.WIN, 100.0, 1)
+    return log
+
+
+def test_reopening_starts_over(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with TradeStore("run") as store:
+        store.append("a", trades(3, 10.0))
+        store.append("b", trades(2, 20.0))
+    with TradeStore("run") as store:
+        store.append("b", trades(1, 30.0))
+    stored = read_trades("run")
+    assert list(stored["settings"]) == ["b"]
+    assert list(stored["entry_price"]) == [30.0]
+
+
+def test_resume_keeps_finished_settings(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with TradeStore("run") as store:
+        store.append("a", trades(3, 10.0))
+        store.append("b", trades(2, 20.0))
+        store.append("c", trades(2, 30.0))
+    # c has trades on disk but never made it to the checkpoint, it runs again
+    with TradeStore("run", resume={"a": None, "b": None}) as store:
+        store.append("c", trades(1, 40.0))
+    stored = read_trades("run")
+    assert list(stored["settings"]) == ["a"] * 3 + ["b"] * 2 + ["c"]
+    assert list(stored["entry_price"]) == [10.0] * 3 + [20.0] * 2 + [40.0]
+    assert [entry["settings_id"] for entry in read_index("run").values()] == [0, 1, 2]
+
+
+def test_rerun_writes_each_setting_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bid, ask = synthetic_ohlc(2000, seed=3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ohlc_backtest(bid, ask, *GRID, 1, 3, "once")
+        for _ in range(2):
+            ohlc_backtest(bid, ask, *GRID, 1, 3, "twice")
+            ohlc_backtest(bid, ask, *GRID, 1, 3, "checkpointed", checkpoint="checkpointed.checkpoint")
+    once = read_trades("once")
+    assert len(once) != 0
+    pd.testing.assert_frame_equal(read_trades("twice"), once)
+    pd.testing.assert_frame_equal(read_trades("checkpointed"), once)
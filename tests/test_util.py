@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+import util
+
+ENGINES = ["c", pytest.param("pyarrow", marks=pytest.mark.skipif(util.tick_engine() != "pyarrow",
+                                                                 reason="pyarrow is not installed"))]
+
+
+def reference_resample(filename, timeframe):
+    # util.resample before the column-pruned reader, every column parsed by name
+    col_names = ["Timestamp", "Remove", "Remove", "Remove", "Remove", "B2", "B1", "B", "A", "A1", "A2"]
+    col_names += ["R{}".format(i) for i in range(36 - len(col_names))]
+    col_names = [name if name != "Remove" else "R-{}".format(i) for i, name in enumerate(col_names)]
+    df = pd.read_csv(filename, header=None, names=col_names)[50:-50]
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'] * 1e9).values + pd.to_timedelta(5.5, unit='h')
+    df.set_index(df['Timestamp'], inplace=True)
+    df[["B", "A"]] = df[["B", "A"]].astype(int)
+    return df["B"].resample(timeframe).ohlc(), df["A"].resample(timeframe).ohlc()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("timeframe", ["1Min", "7Min"])
+def test_resample_matches_the_reference(tick_log, engine, timeframe):
+    bid, ask = util.resample(tick_log, timeframe, engine=engine)
+    expected_bid, expected_ask = reference_resample(tick_log, timeframe)
+    pd.testing.assert_frame_equal(bid, expected_bid, check_dtype=False, check_freq=False)
+    pd.testing.assert_frame_equal(ask, expected_ask, check_dtype=False, check_freq=False)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_read_tick_log_columns(tick_log, engine):
+    ticks = util.read_tick_log(tick_log, depth=True, engine=engine)
+    assert list(ticks.columns) == ["B", "A", "B2", "B1", "A1", "A2"]
+    assert (ticks.dtypes == "int32").all()
+    assert ((ticks["A"] - ticks["B"]) == 100).all()
+    assert ((ticks["B"] - ticks["B2"]) == 200).all()
+
+
+@pytest.mark.parametrize("timeframe, chunk_rows", [("7Min", 37), ("1Min", 997), ("7Min", 997), ("1h", 997),
+                                                   ("1Min", 6013), ("1h", 6013)])
+def test_chunked_matches_resample(tick_log, timeframe, chunk_rows):
+    # Chunks end inside bars (the carried bar), shorter ones than the edge lines held back, and
+    # some of them hold a gap of hours (the empty bars between chunks)
+    bid, ask = util.resample(tick_log, timeframe)
+    chunked_bid, chunked_ask = util.resample(tick_log, timeframe, chunk_rows=chunk_rows)
+    assert bid.isna().any().any()
+    pd.testing.assert_frame_equal(chunked_bid, bid, check_dtype=False, check_freq=False)
+    pd.testing.assert_frame_equal(chunked_ask, ask, check_dtype=False, check_freq=False)
+
+
+def test_chunked_reads_with_the_c_engine(tick_log, monkeypatch):
+    engines = []
+    read_csv = pd.read_csv
+
+    def recorded(*args, **kwargs):
+        engines.append(kwargs.get("engine"))
+        return read_csv(*args, **kwargs)
+    monkeypatch.setattr(pd, "read_csv", recorded)
+    util.resample(tick_log, "1Min", chunk_rows=5000)
+    assert engines == [util.tick_engine(chunked=True)] == ["c"]
+
+
+@pytest.mark.parametrize("timeframes", [["1Min", "5Min", "15Min", "1h"], ["1Min", "7Min", "21Min"],
+                                        ["5Min", "7Min", "2h"]])
+@pytest.mark.parametrize("chunk_rows", [None, 997])
+def test_timeframes_match_resample(tick_log, timeframes, chunk_rows):
+    # Rolled up from the finest timeframe, or from the longest one they are all multiples of (1Min for 5Min
+    # and 7Min), with timeframes that don't divide a day (7Min, 21Min) and bars left empty by the gaps
+    bars = util.resample_timeframes(tick_log, timeframes, chunk_rows=chunk_rows)
+    assert list(bars) == sorted(timeframes, key=util.timeframe_nanoseconds)
+    for timeframe in timeframes:
+        bid, ask = util.resample(tick_log, timeframe)
+        assert bid.isna().any().any()
+        pd.testing.assert_frame_equal(bars[timeframe][0], bid, check_dtype=False, check_freq=False)
+        pd.testing.assert_frame_equal(bars[timeframe][1], ask, check_dtype=False, check_freq=False)
+
+
+@pytest.mark.parametrize("timeframe", ["1Min", "7Min"])
+def test_roll_up_matches_resample(tick_log, timeframe):
+    bid, ask = util.resample(tick_log, "1Min")
+    for bars, expected in zip((bid, ask), util.resample(tick_log, timeframe)):
+        pd.testing.assert_frame_equal(util.roll_up(bars, timeframe), expected, check_dtype=False, check_freq=False)
+
+
+@pytest.mark.parametrize("timeframe", ["1Min", "7Min"])
+def test_merged_files_match_resample(tick_log, tmp_path, timeframe):
+    # A log split in two inside a bar, each part with the edge lines read_tick_log drops on its own,
+    # so the parts keep the ticks of the whole log between them and share the bar they were cut in
+    with open(tick_log) as infile:
+        lines = infile.readlines()
+    cut = 9001
+    files = [str(tmp_path / "first.log"), str(tmp_path / "second.log")]
+    for filename, part in zip(files, (lines[:cut + util.EDGE_ROWS], lines[cut - util.EDGE_ROWS:])):
+        with open(filename, "w") as outfile:
+            outfile.writelines(part)
+    first, second = util.resample(files[0], timeframe), util.resample(files[1], timeframe)
+    assert first[0].index[-1] == second[0].index[0]
+
+    bid, ask = util.resample(tick_log, timeframe)
+    # In any order
+    for merged, expected in zip((util.merge_ohlc([second[0], first[0]]), util.merge_ohlc([second[1], first[1]])),
+                                (bid, ask)):
+        pd.testing.assert_frame_equal(merged, expected, check_dtype=False, check_freq=False)
+    merged_bid, merged_ask = util.resample_files(files, timeframe, workers=2)
+    pd.testing.assert_frame_equal(merged_bid, bid, check_dtype=False, check_freq=False)
+    pd.testing.assert_frame_equal(merged_ask, ask, check_dtype=False, check_freq=False)
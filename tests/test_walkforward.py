@@ -0,0 +1,32 @@
+import io
+import contextlib
+import pandas as pd
+from trade import ohlc_grid, settings_name
+from metrics import trade_metrics, sample_span
+from walkforward import walk_forward, walk_windows
+
+GRID = ([14, 21], [40, 45], [55, 60], [7, 14, 28, 42], [150, 300], [100], [True])
+
+
+def test_folds_cut_bid_by_time(tmp_path, monkeypatch, gapped_bars, window_trades):
+    # Bid misses other rows than ask, each fold's test trades are those of frames cut by time
+    monkeypatch.chdir(tmp_path)
+    bid, ask = gapped_bars
+    with contextlib.redirect_stdout(io.StringIO()):
+        folds, summary = walk_forward(bid, ask, *GRID, 1, 3, "walk", train=400, test=150, workers=2)
+    rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets, stops, overlaps = GRID
+    settings = {settings_name(config + (target, stop)): config + (target, stop)
+                for config in ohlc_grid(overlaps, rsi_windows, rsi_overbought_bounds, rsi_oversold_bounds, ema_values)
+                for target in targets for stop in stops if stop < target}
+
+    windows = walk_windows(len(ask), 400, 150)
+    checked = 0
+    for fold, (train_start, train_end, test_start, test_end) in zip(folds, windows):
+        if fold["settings"] is None:
+            continue
+        longs, shorts = window_trades(bid, ask, settings[fold["settings"]], test_start, test_end, 1, 3)
+        expected = trade_metrics(longs, shorts, span=sample_span(ask.iloc[test_start:test_end]))
+        for field, value in expected.items():
+            assert fold[field] == value or (pd.isna(value) and pd.isna(fold[field])), field
+        checked += 1
+    assert checked != 0
@@ -0,0 +1,165 @@
+import os
+import glob
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from util import read_tick_log, bin_anchor, timeframe_nanoseconds, TICK_COLUMNS, IST_OFFSET, EDGE_ROWS
+from barcache import CACHE_DIR, source_key, path_key
+
+# Index from ohlc bars to the ticks they were built from.
+# For every bar of a log the index keeps the byte range of its lines in the raw
+# .log file, so the ticks of one bar are read back with a seek and a short
+# read instead of parsing the whole log again. Exits use it to settle the few
+# bars whose high/low reach a target or stop at tick resolution (see
+# exits.tick_exit_grid). The index of a log is built once, with
+# util.read_tick_log, and kept next to the bar cache. Ticks are put in bars
+# with the bins util.resample uses (util.bin_anchor), and mapped back to the
+# lines of the file they came from, skipping the blank lines read_csv skips.
+
+MAX_CACHED_BARS = 4096
+SIDES = {"B": TICK_COLUMNS["B"], "A": TICK_COLUMNS["A"]}
+
+
+def line_starts(filename):
+    # Byte offset of every line of a file, plus the end of the file, and whether each line has data.
+    # Lines of nothing but whitespace are skipped by read_csv, so they are not rows of the log
+    raw = np.fromfile(filename, dtype=np.uint8)
+    ends = np.flatnonzero(raw == ord("\n")) + 1
+    if len(raw) != 0 and raw[-1] != ord("\n"):
+        ends = np.append(ends, len(raw))
+    starts = np.concatenate(([0], ends))
+    if len(ends) == 0:
+        return starts, np.zeros(0, dtype=bool)
+    solid = ~np.isin(raw, np.frombuffer(b" \t\r\n", dtype=np.uint8))
+    return starts, np.add.reduceat(solid, starts[:-1]) != 0
+
+
+def bar_starts(timestamps, timeframe):
+    # Start (int64 nanoseconds) of the bar util.resample puts every timestamp of a log in
+    length = timeframe_nanoseconds(timeframe)
+    origin = bin_anchor(timeframe, pd.Timestamp(int(timestamps[0]))).get("origin")
+    origin = 0 if origin is None else origin.value
+    return origin + (timestamps - origin) // length * length
+
+
+def index_log(filename, timeframe):
+    # (bar timestamps, byte starts, byte ends) of the runs of lines of every bar of a log
+    ticks = read_tick_log(filename)
+    starts, has_data = line_starts(filename)
+    # Line of every tick, read_tick_log drops EDGE_ROWS rows at both ends
+    rows = np.flatnonzero(has_data)[EDGE_ROWS:EDGE_ROWS + len(ticks)]
+    timestamps = ticks.index.values.astype("datetime64[ns]").view("int64")
+    if len(timestamps) == 0:
+        return timestamps, timestamps, timestamps
+    bars = bar_starts(timestamps, timeframe)
+    # A new run starts wherever the bar changes from one line to the next
+    first = np.flatnonzero(np.concatenate(([True], bars[1:] != bars[:-1])))
+    last = np.append(first[1:], len(bars))
+    return bars[first], starts[rows[first]], starts[rows[last - 1] + 1]
+
+
+def parse_ticks(data):
+    # Timestamps (int64 nanoseconds, Indian time), bids and asks of raw log lines, like read_tick_log
+    timestamps, bids, asks = [], [], []
+    for line in data.split(b"\n"):
+        if len(line.strip()) == 0:
+            continue
+        fields = line.split(b",")
+        epoch = fields[TICK_COLUMNS["Timestamp"]]
+        if epoch.isdigit():
+            timestamps.append(int(epoch) * 1000000000)
+        else:
+            timestamps.append(pd.Timestamp(float(epoch), unit="s").value)
+        bids.append(int(float(fields[SIDES["B"]])))
+        asks.append(int(float(fields[SIDES["A"]])))
+    return (np.array(timestamps, dtype="int64") + IST_OFFSET.value,
+            np.array(bids, dtype="int64"), np.array(asks, dtype="int64"))
+
+
+class TickIndex:
+
+    def __init__(self, files, sources, bars, starts, ends):
+        # Runs of every log, sorted by bar with the logs in order within a bar
+        order = np.lexsort((sources, bars))
+        self.files = files
+        self.sources = sources[order]
+        self.bars = bars[order]
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self._handles = {}
+        self._ticks = OrderedDict()
+
+    def ticks(self, bar):
+        # Timestamps, bids and asks of the ticks of the bar starting at bar (int64 nanoseconds), in time order
+        found = self._ticks.get(bar)
+        if found is not None:
+            self._ticks.move_to_end(bar)
+            return found
+        parts = []
+        for run in range(np.searchsorted(self.bars, bar, side="left"), np.searchsorted(self.bars, bar, side="right")):
+            handle = self._handle(self.sources[run])
+            handle.seek(self.starts[run])
+            parts.append(parse_ticks(handle.read(self.ends[run] - self.starts[run])))
+        if len(parts) == 0:
+            found = (np.empty(0, dtype="int64"),) * 3
+        else:
+            found = tuple(np.concatenate(column) for column in zip(*parts))
+            order = np.argsort(found[0], kind="mergesort")
+            found = tuple(column[order] for column in found)
+        self._ticks[bar] = found
+        if len(self._ticks) > MAX_CACHED_BARS:
+            self._ticks.popitem(last=False)
+        return found
+
+    def first_touch(self, bar, side, upper, lower):
+        # (timestamp, price) of the first tick of the bar with a price >= upper or <= lower, None if no tick does.
+        # side is "B" for bids and "A" for asks
+        timestamps, bids, asks = self.ticks(bar)
+        prices = bids if side == "B" else asks
+        hits = np.flatnonzero((prices >= upper) | (prices <= lower))
+        if len(hits) == 0:
+            return None
+        return int(timestamps[hits[0]]), float(prices[hits[0]])
+
+    def _handle(self, source):
+        handle = self._handles.get(source)
+        if handle is None:
+            handle = open(self.files[source], "rb")
+            self._handles[source] = handle
+        return handle
+
+    def close(self):
+        for handle in self._handles.values():
+            handle.close()
+        self._handles = {}
+
+    def __getstate__(self):
+        # Sent to sweep workers without the open files and the decoded ticks
+        state = self.__dict__.copy()
+        state["_handles"] = {}
+        state["_ticks"] = OrderedDict()
+        return state
+
+
+def tick_index(file_list, timeframe='1Min', cache_dir=CACHE_DIR):
+    # TickIndex of the bars util.resample makes of these logs with timeframe, built once per log
+    os.makedirs(cache_dir, exist_ok=True)
+    sources, bars, starts, ends = [], [], [], []
+    for source, filename in enumerate(file_list):
+        name = "{}.{}.ticks.{}".format(os.path.basename(filename), timeframe, path_key([filename]))
+        path = os.path.join(cache_dir, "{}.{}.npz".format(name, source_key([filename], timeframe)))
+        if not os.path.exists(path):
+            file_bars, file_starts, file_ends = index_log(filename, timeframe)
+            # Indexes of older versions of the log are stale now, logs of the same name elsewhere keep theirs
+            for old_path in glob.glob(os.path.join(cache_dir, glob.escape(name) + ".*.npz")):
+                os.remove(old_path)
+            tmp_path = path + ".tmp{}.npz".format(os.getpid())
+            np.savez(tmp_path, bars=file_bars, starts=file_starts, ends=file_ends)
+            os.replace(tmp_path, path)
+        with np.load(path) as entry:
+            bars.append(entry["bars"])
+            starts.append(entry["starts"])
+            ends.append(entry["ends"])
+        sources.append(np.full(len(bars[-1]), source, dtype="int32"))
+    return TickIndex([os.path.abspath(filename) for filename in file_list], np.concatenate(sources),
+                     np.concatenate(bars), np.concatenate(starts), np.concatenate(ends))
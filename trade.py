@@ -1,354 +1,281 @@
 import pandas as pd
-import talib
-import matplotlib.pyplot as plt
-from util import resample, write_trades, write_result
-import csv
-import os
-from statistics import mean
+from util import write_result
+from exits import exit_arrays, exit_grid, tick_exit_grid, find_exit
+from indicators import IndicatorCache
+from positions import OpenPositions
+from strategies import ema_rsi, entry_positions, strategy_name
+from tradestore import TradeStore
+from writer import BackgroundWriter
+from metrics import trade_metrics, sample_span
+from checkpoint import Checkpoint, sweep_key
+from records import TradeLog, ExitType, NAT, to_nanoseconds, timestamp_nanoseconds
+from runstats import RunStats
+from signalcache import SignalCache, fingerprint
 import numpy as np
-import datetime
-from tqdm import tqdm
 
 
-def make_long(longs, dataframe, row, lots=10, overlap=False, target=900, stop=300, max_lots=10):
+def make_long(longs, dataframe, row, lots=10, overlap=False, target=900, stop=300, max_lots=10, book=None,
+              exits=None):
     # longs is a set of all longs
     # dataframe is a pandas dataframe of asks, used to market exit positions
     # row has our timestamp, entry price at row[0] and row[1] respectively
+    # book is the OpenPositions of longs and exits the exits.exit_arrays of dataframe. A caller that calls
+    # this for every signal of a run keeps both and passes them in, so a signal doesn't go through the
+    # whole frame and every earlier trade again
+    # Returns the trade as a dict, use make_longs to simulate a whole run
+    if book is None:
+        book = OpenPositions.from_trades(longs)
+    if exits is None:
+        exits = exit_arrays(dataframe)
+    log = TradeLog(1, capacity=1)
+    index, opens = exits
+    long_trade(book, log, index, opens, timestamp_nanoseconds(row[0]), row[1]['close'], lots=lots, overlap=overlap,
+               target=target, stop=stop, max_lots=max_lots)
+    return log.to_dicts()[0]
+
+
+def make_longs(dataframe, ask, positions, lots=10, overlap=False, target=900, stop=300, max_lots=10,
+               exit_positions=None, exit_prices=None, exit_times=None):
+    # Longs for a batch of entry positions (in time order) of the ask frame, as a TradeLog.
+    # dataframe is used to market exit positions as in make_long.
+    # exit_positions optionally gives the exit bar of every entry for this target and stop (see exits.exit_grid)
+    # exit_prices, exit_times give tick fills inside those bars (see exits.tick_exit_grid)
+    book = OpenPositions()
+    log = TradeLog(1, capacity=max(len(positions), 1))
+    index, opens = exit_arrays(dataframe)
+    entry_times = to_nanoseconds(ask.index)
+    entry_prices = ask['close'].to_numpy()
+    if exit_positions is None:
+        exit_positions = [None] * len(positions)
+    for k, (p, e) in enumerate(zip(positions, exit_positions)):
+        fill = None if exit_prices is None else (exit_prices[k], exit_times[k])
+        long_trade(book, log, index, opens, entry_times[p], entry_prices[p], lots=lots, overlap=overlap,
+                   target=target, stop=stop, max_lots=max_lots, exit_position=e, fill=fill)
+    return log
+
+
+def long_trade(book, log, index, opens, timestamp_of_entry, entry_price, lots=10, overlap=False, target=900,
+               stop=300, max_lots=10, exit_position=None, fill=None):
+    # Appends the trade to log (a TradeLog).
+    # index, opens are the exit_arrays of the frame used to market exit positions
+    # exit_position is the exit bar from exits.exit_grid when it was already worked out
+    # fill is the (price, timestamp) of a tick-accurate exit inside that bar
 
     # we need to iterate through the dataframe such that when target or stop == open we must close trade
 
     # check if there is an existing long trade (trade overlap)
-    timestamp_of_entry = row[0]
     current_lots = 0
     # print(timestamp_of_entry)
     if overlap is not True:
         # CASE OF NO PYRAMIDING
-        if len(longs) != 0:
-            for trade in longs:
-                if "timestamp_of_exit" in list(trade.keys()) and trade["timestamp_of_exit"] is not None:
-                    if timestamp_of_entry < trade["timestamp_of_exit"]:
-                        return {"timestamp_of_entry": timestamp_of_entry,
-                                "timestamp_of_exit": None,
-                                "entry_price": None,
-                                "target_price": None,
-                                "stop_price": None,
-                                "type_of_exit": "Overlap",
-                                "pnl": None,
-                                "open_lots": current_lots * lots}
+        if book.any_open(timestamp_of_entry):
+            log.append(timestamp_of_entry, NAT, np.nan, np.nan, np.nan, ExitType.OVERLAP, np.nan,
+                       current_lots * lots)
+            return
     else:
         # CASE OF PYRAMIDING
-        if len(longs) != 0:
-            for trade in longs:
-                if "timestamp_of_exit" in list(trade.keys()) and trade["timestamp_of_exit"] is not None:
-                    if (timestamp_of_entry < trade["timestamp_of_exit"]) and \
-                            (timestamp_of_entry > trade["timestamp_of_entry"]):
-                        current_lots += 1
+        current_lots = book.count_open(timestamp_of_entry)
 
     if current_lots * lots >= max_lots:
-        return {"timestamp_of_entry": timestamp_of_entry,
-                "timestamp_of_exit": None,
-                "entry_price": None,
-                "target_price": None,
-                "stop_price": None,
-                "type_of_exit": "Lot limit",
-                "pnl": None,
-                "open_lots": current_lots * lots}
+        log.append(timestamp_of_entry, NAT, np.nan, np.nan, np.nan, ExitType.LOT_LIMIT, np.nan, current_lots * lots)
+        return
 
     # This part of the code will be unreachable if there is a trade overlap
-    entry_price = row[1]['close']
     target_price = entry_price + target  # 9 rupees up for crude
     stop_price = entry_price - stop  # 3 rupees down for crude
     timestamp_of_exit = None
-    type_of_exit = None
+    type_of_exit = ExitType.NONE
     pnl = 0
 
     # type of exit and PNL calculation
-    for item in dataframe.iterrows():
-        if item[0] > timestamp_of_entry:
-            current_price = item[1]['open']
-            if current_price >= target_price:  # If target is hit
-                type_of_exit = "Win"
-                pnl = ((current_price - entry_price) * lots * 100)
-                timestamp_of_exit = item[0]
-                break
-            elif current_price <= stop_price:  # If stop is hit
-                type_of_exit = "Loss"
-                pnl = ((current_price - entry_price) * lots * 100)
-                timestamp_of_exit = item[0]
-                break
+    if exit_position is None:
+        exit_position = find_exit(index, opens, timestamp_of_entry, target_price, stop_price)
+    if exit_position >= 0:
+        current_price = opens[exit_position]
+        exit_time = index[exit_position]
+        if fill is not None:
+            current_price, exit_time = fill
+        if current_price >= target_price:  # If target is hit
+            type_of_exit = ExitType.WIN
+        else:  # If stop is hit
+            type_of_exit = ExitType.LOSS
+        pnl = ((current_price - entry_price) * lots * 100)
+        timestamp_of_exit = index[exit_position]
+    # A trade that never reaches target or stop doesn't hold a position (None isn't added).
+    # The book goes by the exit bar, entries are at a bar's close so a tick exit inside it comes first
+    book.add(timestamp_of_exit)
     # print(pnl)
-    return {"timestamp_of_entry": timestamp_of_entry,
-            "timestamp_of_exit": timestamp_of_exit,
-            "entry_price": entry_price,
-            "target_price": target_price,
-            "stop_price": stop_price,
-            "type_of_exit": type_of_exit,
-            "pnl": pnl,
-            "open_lots": current_lots * lots}
+    log.append(timestamp_of_entry, NAT if timestamp_of_exit is None else exit_time, entry_price,
+               target_price, stop_price, type_of_exit, pnl, current_lots * lots)
 
 
-def make_short(shorts, dataframe, row, lots=10, overlap=False, target=900, stop=300, max_lots=10):
+def make_short(shorts, dataframe, row, lots=10, overlap=False, target=900, stop=300, max_lots=10, book=None,
+               exits=None):
     # shorts is a set of all shorts
     # dataframe is a pandas dataframe of bids, used to market exit positions
     # row has our timestamp, entry price at row[0] and row[1] respectively
+    # book is the OpenPositions of shorts and exits the exits.exit_arrays of dataframe, see make_long
+    # Returns the trade as a dict, use make_shorts to simulate a whole run
+    if book is None:
+        book = OpenPositions.from_trades(shorts)
+    if exits is None:
+        exits = exit_arrays(dataframe)
+    log = TradeLog(-1, capacity=1)
+    index, opens = exits
+    short_trade(book, log, index, opens, timestamp_nanoseconds(row[0]), row[1]['close'], lots=lots,
+                overlap=overlap, target=target, stop=stop, max_lots=max_lots)
+    return log.to_dicts()[0]
+
+
+def make_shorts(dataframe, ask, positions, lots=10, overlap=False, target=900, stop=300, max_lots=10,
+                exit_positions=None, exit_prices=None, exit_times=None):
+    # Shorts for a batch of entry positions (in time order) of the ask frame, as a TradeLog.
+    # dataframe is used to market exit positions as in make_short.
+    # exit_positions optionally gives the exit bar of every entry for this target and stop (see exits.exit_grid)
+    # exit_prices, exit_times give tick fills inside those bars (see exits.tick_exit_grid)
+    book = OpenPositions()
+    log = TradeLog(-1, capacity=max(len(positions), 1))
+    index, opens = exit_arrays(dataframe)
+    entry_times = to_nanoseconds(ask.index)
+    entry_prices = ask['close'].to_numpy()
+    if exit_positions is None:
+        exit_positions = [None] * len(positions)
+    for k, (p, e) in enumerate(zip(positions, exit_positions)):
+        fill = None if exit_prices is None else (exit_prices[k], exit_times[k])
+        short_trade(book, log, index, opens, entry_times[p], entry_prices[p], lots=lots, overlap=overlap,
+                    target=target, stop=stop, max_lots=max_lots, exit_position=e, fill=fill)
+    return log
+
+
+def short_trade(book, log, index, opens, timestamp_of_entry, entry_price, lots=10, overlap=False, target=900,
+                stop=300, max_lots=10, exit_position=None, fill=None):
+    # Appends the trade to log (a TradeLog).
+    # index, opens are the exit_arrays of the frame used to market exit positions
+    # exit_position is the exit bar from exits.exit_grid when it was already worked out
+    # fill is the (price, timestamp) of a tick-accurate exit inside that bar
 
     # we need to iterate through the dataframe such that when target or stop == open we must close trade
 
-    # check if there is an existing long trade (trade overlap)
-    timestamp_of_entry = row[0]
+    # check if there is an existing short trade (trade overlap)
     current_lots = 0
     # print(timestamp_of_entry)
     if overlap is not True:
-        if len(shorts) != 0:
-            for trade in shorts:
-                if "timestamp_of_exit" in list(trade.keys()):
-                    if "timestamp_of_exit" in list(trade.keys()) and trade["timestamp_of_exit"] is not None:
-                        return {"timestamp_of_entry": timestamp_of_entry,
-                                "timestamp_of_exit": None,
-                                "entry_price": None,
-                                "target_price": None,
-                                "stop_price": None,
-                                "type_of_exit": "Overlap",
-                                "pnl": 0.00,
-                                "open_lots": current_lots * lots
-                                }
+        # CASE OF NO PYRAMIDING
+        if book.any_open(timestamp_of_entry):
+            log.append(timestamp_of_entry, NAT, np.nan, np.nan, np.nan, ExitType.OVERLAP, 0.00,
+                       current_lots * lots)
+            return
     else:
         # CASE OF PYRAMIDING
-        if len(shorts) != 0:
-            for trade in shorts:
-                if "timestamp_of_exit" in list(trade.keys()) and trade["timestamp_of_exit"] is not None:
-                    if (timestamp_of_entry < trade["timestamp_of_exit"]) and \
-                            (timestamp_of_entry > trade["timestamp_of_entry"]):
-                        current_lots += 1
+        current_lots = book.count_open(timestamp_of_entry)
 
     if current_lots * lots >= max_lots:
-        return {"timestamp_of_entry": timestamp_of_entry,
-                "timestamp_of_exit": None,
-                "entry_price": None,
-                "target_price": None,
-                "stop_price": None,
-                "type_of_exit": "Lot limit",
-                "pnl": None,
-                "open_lots": -1 * current_lots * lots}
+        log.append(timestamp_of_entry, NAT, np.nan, np.nan, np.nan, ExitType.LOT_LIMIT, np.nan,
+                   -1 * current_lots * lots)
+        return
 
     # This part of the code will be unreachable if there is a trade overlap
-    entry_price = row[1]['close']
     target_price = entry_price - target  # 9 rupees down for crude
     stop_price = entry_price + stop  # 3 rupees up for crude
     timestamp_of_exit = None
-    type_of_exit = None
+    type_of_exit = ExitType.NONE
     pnl = 0
 
     # type of exit and PNL calculation
-    for item in dataframe.iterrows():
-        if item[0] > timestamp_of_entry:
-            current_price = item[1]['open']
-            if current_price <= target_price:  # If target is hit
-                type_of_exit = "Win"
-                pnl = (current_price - entry_price) * lots * (-1) * 100
-                timestamp_of_exit = item[0]
-                break
-            elif current_price >= stop_price:  # If stop is hit
-                type_of_exit = "Loss"
-                pnl = (current_price - entry_price) * lots * (-1) * 100
-                timestamp_of_exit = item[0]
-                break
+    if exit_position is None:
+        exit_position = find_exit(index, opens, timestamp_of_entry, stop_price, target_price)
+    if exit_position >= 0:
+        current_price = opens[exit_position]
+        exit_time = index[exit_position]
+        if fill is not None:
+            current_price, exit_time = fill
+        if current_price <= target_price:  # If target is hit
+            type_of_exit = ExitType.WIN
+        else:  # If stop is hit
+            type_of_exit = ExitType.LOSS
+        pnl = (current_price - entry_price) * lots * (-1) * 100
+        timestamp_of_exit = index[exit_position]
+    # A trade that never reaches target or stop doesn't hold a position (None isn't added).
+    # The book goes by the exit bar, entries are at a bar's close so a tick exit inside it comes first
+    book.add(timestamp_of_exit)
 
     # print(pnl)
-    return {"timestamp_of_entry": timestamp_of_entry,
-            "timestamp_of_exit": timestamp_of_exit,
-            "entry_price": entry_price,
-            "target_price": target_price,
-            "stop_price": stop_price,
-            "type_of_exit": type_of_exit,
-            "pnl": pnl,
-            "open_lots": -1 * current_lots * lots}
+    log.append(timestamp_of_entry, NAT if timestamp_of_exit is None else exit_time, entry_price,
+               target_price, stop_price, type_of_exit, pnl, -1 * current_lots * lots)
 
 
 def do_backtest(bid, ask, rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets, stops,
-                overlaps, lots, max_lots, filename_parent):
+                overlaps, lots, max_lots, filename_parent, cache=None, strategy=ema_rsi):
+    # strategy - entry signals of a configuration, see strategies.py
     print("Doing {}".format(filename_parent))
-
-    i = 0
+    if cache is None:
+        cache = IndicatorCache()
+    close = ask['close'].to_numpy(dtype=float)
+    span = sample_span(ask)
     results = []
-    for overlap in overlaps:
-        for rsi_window in rsi_windows:
-            for rsi_upper in rsi_overbought_bounds:
-                for rsi_lower in rsi_oversold_bounds:
-                    for slow_ema in ema_values:
-                        # if slow_ema > fast_ema:
-                        #     break
-                        for fast_ema in ema_values:
-                            if slow_ema < fast_ema:
-                                break
-                            for target in targets:
-                                # if stop > target:
-                                #     break
-                                for stop in stops:
-                                    if stop > target:
-                                        break
-
-                                    settings = "overlap_{}-rsiwindow_{}-rsiupper_{}-rsilower_{}-slowema_{}-fastema_{}-target_{}-stop_{}".format(
-                                        overlap, rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema, target, stop)
-                                    # print(settings)
-                                    ask['RSI'] = talib.RSI(ask['close'], timeperiod=rsi_window)
-                                    ask['MA_fast'] = talib.EMA(ask['close'], timeperiod=fast_ema)
-                                    ask['MA_slow'] = talib.EMA(ask['close'], timeperiod=slow_ema)
-
-                                    longs = []
-                                    shorts = []
-
-                                    # \ STRATEGY
-                                    # Return type is a dict with
-                                    # if valid : {timestamp of entry, timestamp of exit, entry price, target price, stop price, type of exit, pnl}
-                                    # if invalid : {timestamp_of_entry, type_of_exit}
-                                    # print(row[1]['RSI']) # RSI VALUES HERE, row[0] is index (timestamp)
-
-                                    for row in ask.iterrows():
-                                        if row[1]['MA_fast'] > row[1]['MA_slow']:
-                                            if row[1]['RSI'] < rsi_lower:  # Oversold condition
-                                                longs.append(
-                                                    make_long(longs, bid, row, lots=lots, target=target, stop=stop,
-                                                              overlap=overlap, max_lots=max_lots))
-                                        if row[1]['MA_fast'] < row[1]['MA_slow']:
-                                            if row[1]['RSI'] > rsi_upper:  # Overbought condition
-                                                shorts.append(
-                                                    make_short(shorts, ask, row, lots=lots, target=target,
-                                                               stop=stop,
-                                                               overlap=overlap, max_lots=max_lots))
-                                    if len(longs) == 0 or len(shorts) == 0:
-                                        break
-                                    num_longs, num_shorts = 0, 0
-                                    for item in longs:
-                                        if item["type_of_exit"] in ["Win", "Loss"]:
-                                            num_longs += 1
-                                    for item in shorts:
-                                        if item["type_of_exit"] in ["Win", "Loss"]:
-                                            num_shorts += 1
-
-                                    if num_shorts == 0:
-                                        break
-                                    if num_longs == 0:
-                                        break
-                                    # / STRATEGY
-
-                                    # PNL Calc
-                                    # PNL for longs
-
-                                    longs_pnl = 0
-                                    long_turnover = 0
-                                    for item in longs:
-                                        try:
-                                            longs_pnl += item["pnl"]
-                                            long_turnover += item["entry_price"] * lots
-                                        except:
-                                            pass
-                                    long_brokerage = long_turnover / 1000000000 * 838
-                                    net_long_pnl = longs_pnl - long_brokerage
-
-                                    # PNL for shorts
-                                    shorts_pnl = 0
-                                    short_turnover = 0
-
-                                    for item in shorts:
-                                        try:
-                                            shorts_pnl += item['pnl']
-                                            short_turnover += item["entry_price"] * lots
-                                        except:
-                                            pass
-
-                                    short_brokerage = short_turnover / 1000000000 * 838
-                                    net_short_pnl = shorts_pnl - short_brokerage
-                                    # print("Net PNL long is: " + str(net_long_pnl) + " and Net PNL short is: " + str(net_short_pnl))
-
-                                    if net_long_pnl + net_short_pnl < -6000:
-                                        # print("Bad PNL in {}, skipped".format(settings))
-                                        break
-
-                                    long_win, long_loss, short_win, short_loss = 0, 0, 0, 0
-                                    for item in longs:
-                                        if item["type_of_exit"] == "Win":
-                                            long_win += 1
-                                        if item["type_of_exit"] == "Loss":
-                                            long_loss += 1
-
-                                    for item in shorts:
-                                        if item["type_of_exit"] == "Win":
-                                            short_win += 1
-                                        if item["type_of_exit"] == "Loss":
-                                            short_loss += 1
-
-                                    profitability_longs = long_win / num_longs
-                                    profitability_shorts = short_win / num_shorts
-                                    profitability_total = (long_win + short_win) / (num_longs + num_shorts)
-
-                                    total_time_for_every_trade = []
-                                    for item in longs:
-                                        try:
-                                            total_time_for_every_trade.append(
-                                                item["timestamp_of_exit"] - item["timestamp_of_entry"])
-                                        except:
-                                            pass
-                                    for item in shorts:
-                                        try:
-                                            total_time_for_every_trade.append(
-                                                item["timestamp_of_exit"] - item["timestamp_of_entry"])
-                                        except:
-                                            pass
-
-                                    avg_time = sum(total_time_for_every_trade, datetime.timedelta(0)) / len(
-                                        total_time_for_every_trade)
-
-                                    net_pnl_list = []
-
-                                    for item in longs:
-                                        if "pnl" in list(item.keys()):
-                                            if item["pnl"] is not None:
-                                                net_pnl_list.append(item["pnl"])
-                                    for item in shorts:
-                                        if "pnl" in list(item.keys()):
-                                            if item["pnl"] is not None:
-                                                net_pnl_list.append(item["pnl"])
-
-                                    max_pnl = max(net_pnl_list)
-                                    max_dd = min(net_pnl_list)
-                                    avg_pnl = mean(net_pnl_list)
-
-                                    longs_concurrent = []
-                                    for item in longs:
-                                        longs_concurrent.append(item["open_lots"])
-                                    shorts_concurrent = []
-                                    for item in shorts:
-                                        shorts_concurrent.append(item["open_lots"])
-
-                                    # Logic to return data as a result
-                                    if net_long_pnl != 0.0:
-                                        if net_short_pnl != 0.0:
-                                            results.append({"settings": settings,
-                                                            "netlongpnl": net_long_pnl,
-                                                            "netshortpnl": net_short_pnl,
-                                                            "netpnl": net_short_pnl + net_long_pnl,
-                                                            "profitability_longs": profitability_longs,
-                                                            "profitability_shorts": profitability_shorts,
-                                                            "profitability_total": profitability_total,
-                                                            "number_of_trades": num_shorts + num_longs,
-                                                            "num_longs": num_longs,
-                                                            "num_shorts": num_shorts,
-                                                            "max_profit": max_pnl,
-                                                            "max_DD": max_dd,
-                                                            "average_pnl": avg_pnl,
-                                                            "apnl/max_DD": avg_pnl / abs(max_dd),
-                                                            "average_trade_time": avg_time,
-                                                            "long_max_concurrent": max(longs_concurrent),
-                                                            "short_max_concurrent": min(shorts_concurrent),
-                                                            })
-                                    # i += 1
-                                    # print(str(i) + " : " + str(profitability_total) + " : " + str(
-                                    #     net_short_pnl + net_long_pnl) + " : " + str(
-                                    #     num_longs + num_shorts) + " : " + settings)
-                                    # List of all trades
-                                    trades = longs + shorts
-                                    write_trades(settings, trades, filename_parent)
+    # The writer is closed and the store flushed also when the sweep fails half way
+    with TradeStore(filename_parent) as store, BackgroundWriter(store) as writer:
+        for overlap in overlaps:
+            for rsi_window in rsi_windows:
+                for rsi_upper in rsi_overbought_bounds:
+                    for rsi_lower in rsi_oversold_bounds:
+                        for slow_ema in ema_values:
+                            # if slow_ema > fast_ema:
+                            #     break
+                            for fast_ema in ema_values:
+                                if slow_ema < fast_ema:
+                                    break
+                                long_positions, short_positions = entry_positions(
+                                    *strategy(cache, filename_parent, close, rsi_window, rsi_upper, rsi_lower,
+                                              slow_ema, fast_ema))
+                                # Exits of every entry for all targets and stops in one pass
+                                long_exits = exit_grid(bid, ask, long_positions, targets, stops, 1)
+                                short_exits = exit_grid(ask, ask, short_positions, targets, stops, -1)
+                                for t, target in enumerate(targets):
+                                    # if stop > target:
+                                    #     break
+                                    for s, stop in enumerate(stops):
+                                        if stop > target:
+                                            break
+
+                                        settings = "overlap_{}-rsiwindow_{}-rsiupper_{}-rsilower_{}-slowema_{}-fastema_{}-target_{}-stop_{}".format(
+                                            overlap, rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema, target, stop)
+                                        # print(settings)
+
+                                        # \ STRATEGY
+                                        # Return type is a dict with
+                                        # if valid : {timestamp of entry, timestamp of exit, entry price, target price, stop price, type of exit, pnl}
+                                        # if invalid : {timestamp_of_entry, type_of_exit}
+
+                                        long_log = make_longs(bid, ask, long_positions, lots=lots, target=target,
+                                                              stop=stop, overlap=overlap, max_lots=max_lots,
+                                                              exit_positions=long_exits[:, t, s])
+                                        short_log = make_shorts(ask, ask, short_positions, lots=lots, target=target,
+                                                                stop=stop, overlap=overlap, max_lots=max_lots,
+                                                                exit_positions=short_exits[:, t, s])
+                                        if len(long_log) == 0 or len(short_log) == 0:
+                                            break
+                                        metrics = trade_metrics(long_log, short_log, turnover_lots=lots, span=span)
+                                        if metrics["num_shorts"] == 0:
+                                            break
+                                        if metrics["num_longs"] == 0:
+                                            break
+                                        # / STRATEGY
+
+                                        if metrics["netpnl"] < -6000:
+                                            # print("Bad PNL in {}, skipped".format(settings))
+                                            break
+
+                                        # Logic to return data as a result
+                                        if metrics["netlongpnl"] != 0.0:
+                                            if metrics["netshortpnl"] != 0.0:
+                                                results.append(dict(settings=settings, **metrics))
+                                        # i += 1
+                                        # print(str(i) + " : " + str(profitability_total) + " : " + str(
+                                        #     net_short_pnl + net_long_pnl) + " : " + str(
+                                        #     num_longs + num_shorts) + " : " + settings)
+                                        # List of all trades
+                                        writer.append(settings, long_log, short_log)
     return results
 
 
@@ -373,14 +300,12 @@ def get_default_backtest(bid_file, ask_file):
                           stops,
                           overlaps, lots, max_lots, filename_parent=bid_file)
 
-    status = write_result(results, bid_file)
+    status = write_result(results, bid_file, data_file=bid_file, lots=lots, max_lots=max_lots)
     return status
 
 
-def ohlc_backtest(bid, ask, rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets, stops,
-                  overlaps, lots, max_lots, filename_parent):
-    i = 0
-    results = []
+def ohlc_grid(overlaps, rsi_windows, rsi_overbought_bounds, rsi_oversold_bounds, ema_values):
+    # Indicator configurations swept by ohlc_backtest, in sweep order
     for overlap in overlaps:
         for rsi_window in rsi_windows:
             for rsi_upper in rsi_overbought_bounds:
@@ -395,187 +320,258 @@ def ohlc_backtest(bid, ask, rsi_windows, rsi_oversold_bounds, rsi_overbought_bou
                                 break
                             if fast_ema > 15:
                                 break
-                            for target in targets:
-                                # if stop > target:
-                                #     break
-                                for stop in stops:
-                                    if stop >= target:
-                                        break
-                                    # print(ask.tail(1).index)
-                                    settings = "overlap_{}-rsiwindow_{}-rsiupper_{}-rsilower_{}-slowema_{}-fastema_{}-target_{}-stop_{}".format(
-                                        overlap, rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema, target, stop)
-                                    print("At setting : " + settings)
-                                    ask['RSI'] = talib.RSI(ask['close'], timeperiod=rsi_window)
-                                    ask['MA_fast'] = talib.EMA(ask['close'], timeperiod=fast_ema)
-                                    ask['MA_slow'] = talib.EMA(ask['close'], timeperiod=slow_ema)
-                                    ask.to_csv("a.csv")
-                                    longs = []
-                                    shorts = []
-                                    # print(ask.tail(5)['RSI'])
-                                    # \ STRATEGY
-                                    # Return type is a dict with
-                                    # if valid : {timestamp of entry, timestamp of exit, entry price, target price, stop price, type of exit, pnl}
-                                    # if invalid : {timestamp_of_entry, type_of_exit}
-                                    # print(row[1]['RSI']) # RSI VALUES HERE, row[0] is index (timestamp)
-                                    print("Bridged 1")
-                                    for row in ask.iterrows():
-                                        if row[1]['MA_fast'] > row[1]['MA_slow']:
-                                            if row[1]['RSI'] < rsi_lower:  # Oversold condition
-                                                longs.append(
-                                                    make_long(longs, bid, row, lots=lots, target=target, stop=stop,
-                                                              overlap=overlap, max_lots=max_lots))
-                                        if row[1]['MA_fast'] < row[1]['MA_slow']:
-                                            if row[1]['RSI'] > rsi_upper:  # Overbought condition
-                                                shorts.append(
-                                                    make_short(shorts, ask, row, lots=lots, target=target,
-                                                               stop=stop,
-                                                               overlap=overlap, max_lots=max_lots))
-                                    print("Bridge 2 : " + str(len(longs)) + " : " + str(len(shorts)))
-
-                                    if len(longs) == 0 or len(shorts) == 0:
-                                        break
-                                    num_longs, num_shorts = 0, 0
-                                    for item in longs:
-                                        if item["type_of_exit"] in ["Win", "Loss"]:
-                                            num_longs += 1
-                                    for item in shorts:
-                                        if item["type_of_exit"] in ["Win", "Loss"]:
-                                            num_shorts += 1
-                                    print("Bridge 3")
-                                    if num_shorts == 0:
-                                        break
-                                    if num_longs == 0:
-                                        break
-                                    # / STRATEGY
-                                    print("Bridge 4")
-                                    # PNL Calc
-                                    # PNL for longs
-
-                                    longs_pnl = 0
-                                    long_turnover = 0
-                                    for item in longs:
-                                        try:
-                                            longs_pnl += item["pnl"]
-                                            long_turnover += item["entry_price"]
-                                        except:
-                                            pass
-                                    long_brokerage = long_turnover / 1000000000 * 838
-                                    net_long_pnl = longs_pnl - long_brokerage
-
-                                    # PNL for shorts
-                                    shorts_pnl = 0
-                                    short_turnover = 0
-                                    print("Bridge 5")
-                                    for item in shorts:
-                                        try:
-                                            shorts_pnl += item['pnl']
-                                            short_turnover += item["entry_price"]
-                                        except:
-                                            pass
-
-                                    short_brokerage = short_turnover / 1000000000 * 838
-                                    net_short_pnl = shorts_pnl - short_brokerage
-                                    # print("Net PNL long is: " + str(net_long_pnl) + " and Net PNL short is: " + str(net_short_pnl))
-
-                                    # if net_long_pnl+net_short_pnl < -6000:
-                                    #     # print("Bad PNL in {}, skipped".format(settings))
-                                    #     break
-                                    print("Bridge 6")
-                                    long_win, long_loss, short_win, short_loss = 0, 0, 0, 0
-                                    for item in longs:
-                                        if item["type_of_exit"] == "Win":
-                                            long_win += 1
-                                        if item["type_of_exit"] == "Loss":
-                                            long_loss += 1
-
-                                    for item in shorts:
-                                        if item["type_of_exit"] == "Win":
-                                            short_win += 1
-                                        if item["type_of_exit"] == "Loss":
-                                            short_loss += 1
-
-                                    profitability_longs = long_win / num_longs
-                                    profitability_shorts = short_win / num_shorts
-                                    profitability_total = (long_win + short_win) / (num_longs + num_shorts)
-                                    print("Bridge 7")
-
-                                    if profitability_total < 0.3 or (net_short_pnl + net_long_pnl) < 0:
-                                        print("Bad profitability, skipped\n")
-                                        break
-
-                                    total_time_for_every_trade = []
-                                    for item in longs:
-                                        if item["timestamp_of_exit"] is not None and item["timestamp_of_entry"] is not None:
-                                            duration = pd.to_datetime(item["timestamp_of_exit"]) - pd.to_datetime(item["timestamp_of_entry"])
-                                            print(duration)
-                                            total_time_for_every_trade.append(duration)
-
-                                    for item in shorts:
-                                        if item["timestamp_of_exit"] is not None and item[
-                                            "timestamp_of_entry"] is not None:
-                                            duration = pd.to_datetime(item["timestamp_of_exit"]) - pd.to_datetime(
-                                                item["timestamp_of_entry"])
-                                            print(duration)
-                                            total_time_for_every_trade.append(duration)
-
-                                    print("Bridge 8")
-
-                                    print(total_time_for_every_trade)
-
-                                    avg_time = sum(total_time_for_every_trade, datetime.timedelta(0)) / len(
-                                        total_time_for_every_trade)
-
-                                    net_pnl_list = []
-
-                                    for item in longs:
-                                        if "pnl" in list(item.keys()):
-                                            if item["pnl"] is not None:
-                                                net_pnl_list.append(item["pnl"])
-                                    for item in shorts:
-                                        if "pnl" in list(item.keys()):
-                                            if item["pnl"] is not None:
-                                                net_pnl_list.append(item["pnl"])
-                                    print("Bridge 9")
-
-                                    max_pnl = max(net_pnl_list)
-                                    max_dd = min(net_pnl_list)
-                                    avg_pnl = mean(net_pnl_list)
-
-                                    longs_concurrent = []
-                                    for item in longs:
-                                        longs_concurrent.append(item["open_lots"])
-                                    shorts_concurrent = []
-                                    for item in shorts:
-                                        shorts_concurrent.append(item["open_lots"])
-                                    print("End bridge")
-
-                                    # Logic to return data as a result
-                                    if net_long_pnl != 0.0:
-                                        if net_short_pnl != 0.0:
-                                            results.append({"settings": settings,
-                                                            "netlongpnl": net_long_pnl,
-                                                            "netshortpnl": net_short_pnl,
-                                                            "netpnl": net_short_pnl + net_long_pnl,
-                                                            "profitability_longs": profitability_longs,
-                                                            "profitability_shorts": profitability_shorts,
-                                                            "profitability_total": profitability_total,
-                                                            "number_of_trades": num_shorts + num_longs,
-                                                            "num_longs": num_longs,
-                                                            "num_shorts": num_shorts,
-                                                            "max_profit": max_pnl,
-                                                            "max_DD": max_dd,
-                                                            "average_pnl": avg_pnl,
-                                                            "apnl/max_DD": avg_pnl / abs(max_dd),
-                                                            "average_trade_time": avg_time,
-                                                            "long_max_concurrent": max(longs_concurrent),
-                                                            "short_max_concurrent": min(shorts_concurrent),
-                                                            })
-                                    i += 1
-                                    print(str(i) + " : " + str(profitability_total) + " : " + str(
-                                        net_short_pnl + net_long_pnl) + " : " + str(
-                                        num_longs + num_shorts) + " : " + settings)
-                                    # List of all trades
-                                    trades = longs + shorts
-                                    write_trades(settings, trades, filename_parent)
+                            yield overlap, rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema
+
+
+def settings_name(setting):
+    # Settings string of ohlc_backtest for (overlap, rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema, target, stop)
+    return "overlap_{}-rsiwindow_{}-rsiupper_{}-rsilower_{}-slowema_{}-fastema_{}-target_{}-stop_{}".format(*setting)
+
+
+def run_ohlc_config(bid, ask, config, targets, stops, lots, max_lots, filename_parent, cache, store, close=None,
+                    span=None, checkpoint=None, ticks=None, stats=None, signals=None, strategy=ema_rsi):
+    # Sweep targets and stops for one indicator configuration of ohlc_backtest,
+    # the trades of every setting go to store.
+    # Settings already in checkpoint (a checkpoint.Checkpoint) are replayed from it instead of simulated.
+    # With ticks (a tickindex.TickIndex) trades exit at the first tick past the target or stop instead
+    # of the open of the next bar. stats is the runstats.RunStats of the sweep.
+    # signals (a signalcache.SignalCache) reuses exits and trades of configurations with the same entries.
+    # strategy gives the entry signals of the configuration, see strategies.py
+    overlap = config[0]
+    if close is None:
+        close = ask['close'].to_numpy(dtype=float)
+    if span is None:
+        span = sample_span(ask)
+    if stats is None:
+        stats = RunStats(progress_seconds=None)
+    entries = None
+
+    results = []
+    for t, target in enumerate(targets):
+        # if stop > target:
+        #     break
+        pairs = target_stop_pairs([target], stops)
+        for s, stop in enumerate(stops):
+            if stop >= target:
+                break
+            settings = settings_name(config + (target, stop))
+            outcome = checkpoint.outcome(settings) if checkpoint is not None else None
+            if outcome is None:
+                with stats.profiled(settings):
+                    if entries is None:
+                        with stats.span("signals"):
+                            long_positions, short_positions = entry_positions(
+                                *strategy(cache, filename_parent, close, *config[1:]))
+                        found = None
+                        if signals is not None:
+                            entry_key = fingerprint(filename_parent, signals.bars_key(bid, ask), long_positions,
+                                                    short_positions)
+                            grid_key = (entry_key, tuple(targets), tuple(stops), ticks is not None)
+                            found = signals.exits(grid_key)
+                        if found is None:
+                            found = entry_exits(bid, ask, long_positions, short_positions, targets, stops, ticks,
+                                                stats)
+                            if signals is not None:
+                                signals.put_exits(grid_key, *found)
+                        else:
+                            stats.count("exit_grids_saved")
+                        entries = (long_positions, short_positions) + found
+                    outcome_key = None
+                    if signals is not None:
+                        outcome_key = (entry_key, target, stop, overlap, lots, max_lots, ticks is not None)
+                    outcome = run_ohlc_setting(bid, ask, settings, overlap, target, stop, lots, max_lots, span,
+                                               store, *entries, t, s, stats=stats, signals=signals,
+                                               outcome_key=outcome_key)
+                stats.count("settings_run")
+                if checkpoint is not None:
+                    with stats.span("io"):
+                        checkpoint.record(settings, *outcome)
+            else:
+                stats.count("settings_replayed")
+            result, stopped = outcome
+            if result is not None:
+                results.append(result)
+            if stopped:
+                stats.count("settings_skipped", pairs - s - 1)
+                break
+        stats.settings_done(pairs)
     return results
 
+
+def entry_exits(bid, ask, long_positions, short_positions, targets, stops, ticks=None, stats=None):
+    # Exits of every entry for all targets and stops in one pass, as (exit bars, exit prices, exit times)
+    # grids of the longs and the shorts. The prices and times are None without ticks
+    if stats is None:
+        stats = RunStats(progress_seconds=None)
+    with stats.span("exits"):
+        if ticks is None:
+            return ((exit_grid(bid, ask, long_positions, targets, stops, 1), None, None),
+                    (exit_grid(ask, ask, short_positions, targets, stops, -1), None, None))
+        return (tick_exit_grid(bid, ask, long_positions, targets, stops, 1, ticks),
+                tick_exit_grid(ask, ask, short_positions, targets, stops, -1, ticks))
+
+
+def target_stop_pairs(targets, stops):
+    # Number of settings run_ohlc_config goes through for a configuration, when none stops early
+    pairs = 0
+    for target in targets:
+        for stop in stops:
+            if stop >= target:
+                break
+            pairs += 1
+    return pairs
+
+
+def run_ohlc_setting(bid, ask, settings, overlap, target, stop, lots, max_lots, span, store, long_positions,
+                     short_positions, long_exits, short_exits, t, s, stats=None, signals=None, outcome_key=None):
+    # One setting of run_ohlc_config, returns its result (or None) and whether it ends the stop loop.
+    # long_exits / short_exits are (exit bars, exit prices, exit times) grids, the prices and times None without ticks.
+    # With signals the trades and metrics are looked up under outcome_key first
+    if stats is None:
+        stats = RunStats(progress_seconds=None)
+    found = signals.outcome(outcome_key) if signals is not None else None
+    if found is not None:
+        long_log, short_log, metrics = found
+        stats.count("simulations_saved")
+        stats.count_trades(long_log, short_log)
+        return ohlc_outcome(settings, long_log, short_log, span, store, stats, metrics=metrics)
+    # \ STRATEGY
+    # Return type is a dict with
+    # if valid : {timestamp of entry, timestamp of exit, entry price, target price, stop price, type of exit, pnl}
+    # if invalid : {timestamp_of_entry, type_of_exit}
+    long_bars, long_prices, long_times = grid_cell(long_exits, t, s)
+    short_bars, short_prices, short_times = grid_cell(short_exits, t, s)
+    with stats.span("trades"):
+        long_log = make_longs(bid, ask, long_positions, lots=lots, target=target, stop=stop,
+                              overlap=overlap, max_lots=max_lots, exit_positions=long_bars,
+                              exit_prices=long_prices, exit_times=long_times)
+        short_log = make_shorts(ask, ask, short_positions, lots=lots, target=target, stop=stop,
+                                overlap=overlap, max_lots=max_lots, exit_positions=short_bars,
+                                exit_prices=short_prices, exit_times=short_times)
+    stats.count_trades(long_log, short_log)
+    metrics = None
+    if len(long_log) != 0 and len(short_log) != 0:
+        with stats.span("metrics"):
+            metrics = trade_metrics(long_log, short_log, span=span)
+    if signals is not None:
+        signals.put_outcome(outcome_key, long_log, short_log, metrics)
+    return ohlc_outcome(settings, long_log, short_log, span, store, stats, metrics=metrics)
+
+
+def grid_cell(grids, t, s):
+    # Values of one target and stop from a tuple of exit grids, None grids stay None
+    return tuple(None if grid is None else grid[:, t, s] for grid in grids)
+
+
+def ohlc_outcome(settings, long_log, short_log, span, store, stats=None, metrics=None):
+    # Result (or None) of a setting of ohlc_backtest from its trades, and whether it ends the stop loop.
+    # The trades go to store unless it does. metrics are the trade_metrics of the trades when already known
+    if stats is None:
+        stats = RunStats(progress_seconds=None)
+    if len(long_log) == 0 or len(short_log) == 0:
+        stats.count("stopped_no_signals")
+        return None, True
+    if metrics is None:
+        with stats.span("metrics"):
+            metrics = trade_metrics(long_log, short_log, span=span)
+    if metrics["num_shorts"] == 0:
+        stats.count("stopped_no_closed_trades")
+        return None, True
+    if metrics["num_longs"] == 0:
+        stats.count("stopped_no_closed_trades")
+        return None, True
+    # / STRATEGY
+
+    # if metrics["netpnl"] < -6000:
+    #     # print("Bad PNL in {}, skipped".format(settings))
+    #     return None, True
+    if metrics["profitability_total"] < 0.3 or metrics["netpnl"] < 0:
+        stats.count("stopped_bad_profitability")
+        return None, True
+
+    # Logic to return data as a result
+    result = None
+    if is_result(metrics):
+        result = dict(settings=settings, **metrics)
+        stats.count("results")
+    # List of all trades
+    with stats.span("io"):
+        store.append(settings, long_log, short_log)
+    return result, False
+
+
+def is_result(metrics):
+    # Whether a setting that passed the checks is a result, both sides have to have made or lost something
+    return metrics["netlongpnl"] != 0.0 and metrics["netshortpnl"] != 0.0
+
+
+def write_indicators(ask, rsi, ma_fast, ma_slow, file="a.csv"):
+    # Debug dump of the ask frame with the indicators of one configuration
+    ask.assign(RSI=rsi, MA_fast=ma_fast, MA_slow=ma_slow).to_csv(file)
+
+
+def open_checkpoint(checkpoint, bid, ask, lots, max_lots, filename_parent, ticks=None, strategy=ema_rsi):
+    # checkpoint is a file name, or None to run without one
+    if checkpoint is None:
+        return None
+    arguments = (lots, max_lots, filename_parent)
+    if ticks is not None:
+        # Tick exits give other results than bar exits
+        arguments += ("ticks",)
+    if strategy is not ema_rsi:
+        # And another strategy other results than ema_rsi, checkpoints of ema_rsi sweeps keep their key
+        arguments += (strategy_name(strategy),)
+    return Checkpoint(checkpoint, sweep_key(bid, ask, *arguments))
+
+
+def ohlc_backtest(bid, ask, rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets, stops,
+                  overlaps, lots, max_lots, filename_parent, cache=None, dump_indicators=False, checkpoint=None,
+                  ticks=None, stats=None, reuse_signals=True, instrument=None, strategy=ema_rsi):
+    # checkpoint - file to record finished settings in, a rerun with the same data and
+    # arguments skips them (see checkpoint.py)
+    # ticks - tickindex.tick_index of the logs bid / ask were resampled from, for exits at tick resolution
+    # stats - runstats.RunStats for progress, profiling and the summary printed at the end
+    # reuse_signals - simulate configurations with the same entries once (see signalcache.py)
+    # instrument - name of bid / ask in cache, filename_parent by default. Runs on the same data with
+    # their own filename_parent (e.g. one per max_lots) share the indicator series under one name
+    # strategy - entry signals of a configuration, ema_rsi by default (see strategies.py)
+    if cache is None:
+        cache = IndicatorCache()
+    if instrument is None:
+        instrument = filename_parent
+    close = ask['close'].to_numpy(dtype=float)
+    span = sample_span(ask)
+    configs = list(ohlc_grid(overlaps, rsi_windows, rsi_overbought_bounds, rsi_oversold_bounds, ema_values))
+    if stats is None:
+        stats = RunStats()
+    stats.total = len(configs) * target_stop_pairs(targets, stops)
+    cache_state = RunStats.cache_state(cache)
+    checkpoint = open_checkpoint(checkpoint, bid, ask, lots, max_lots, filename_parent, ticks, strategy)
+    signals = SignalCache() if reuse_signals else None
+
+    results = []
+    # A resumed sweep keeps the trades of the settings it skips
+    resume = checkpoint.done if checkpoint is not None else None
+    # Trades are written by a background thread while the sweep carries on
+    with TradeStore(filename_parent, resume=resume) as store, BackgroundWriter(store) as writer:
+        if checkpoint is not None:
+            checkpoint.bind(store, writer)
+        try:
+            for config in configs:
+                if dump_indicators:
+                    overlap, rsi_window, rsi_upper, rsi_lower, slow_ema, fast_ema = config
+                    writer.submit(write_indicators, ask, cache.rsi(instrument, close, rsi_window),
+                                  cache.ema(instrument, close, fast_ema),
+                                  cache.ema(instrument, close, slow_ema))
+                results += run_ohlc_config(bid, ask, config, targets, stops, lots, max_lots, instrument, cache,
+                                           writer, close=close, span=span, checkpoint=checkpoint, ticks=ticks,
+                                           stats=stats, signals=signals, strategy=strategy)
+        finally:
+            # Also on an interruption, so whatever finished is kept
+            if checkpoint is not None:
+                checkpoint.commit()
+    if checkpoint is not None:
+        checkpoint.close()
+    stats.add_cache(cache, cache_state)
+    stats.report()
+    return results
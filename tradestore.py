@@ -0,0 +1,192 @@
+import os
+import csv
+import numpy as np
+import pandas as pd
+from records import TradeLog, TRADE_DTYPE, ExitType, EXIT_NAMES, EXIT_CODES, to_nanoseconds
+
+# Append-only columnar store for the trades of a sweep.
+# One store per run replaces the csv per setting written by util.write_trades.
+# Every column is a raw binary file that batches of trades are appended to, and
+# settings.csv maps each setting to its settings_id and to the contiguous row
+# range holding its trades, so one setting can be read back by slicing
+# memory-mapped columns without touching the rest. Opening a store starts it
+# over, unless the sweep resumes from a checkpoint (see TradeStore).
+
+COLUMNS = {"settings_id": "int32",
+           "side": "int8",  # 1 for longs, -1 for shorts
+           "timestamp_of_entry": "int64",  # nanoseconds, NaT for missing
+           "timestamp_of_exit": "int64",
+           "entry_price": "float64",
+           "target_price": "float64",
+           "stop_price": "float64",
+           "type_of_exit": "int8",  # records.ExitType
+           "pnl": "float64",
+           "open_lots": "int32"}
+
+INDEX_FILE = "settings.csv"
+INDEX_FIELDS = ["settings_id", "settings", "start", "count"]
+
+
+def store_path(name):
+    # Same directory util.write_trades used for a run
+    return name.split('.log')[0]
+
+
+def to_floats(values):
+    return np.array([np.nan if value is None else value for value in values], dtype="float64")
+
+
+def trade_columns(trades, side, settings_id):
+    # Column arrays for a TradeLog, or a list of trade dicts as returned by make_long / make_short
+    if isinstance(trades, TradeLog):
+        records = trades.records
+        columns = {name: records[name] for name in TRADE_DTYPE.names}
+    else:
+        columns = {"timestamp_of_entry": to_nanoseconds([t["timestamp_of_entry"] for t in trades]),
+                   "timestamp_of_exit": to_nanoseconds([t["timestamp_of_exit"] for t in trades]),
+                   "entry_price": to_floats([t["entry_price"] for t in trades]),
+                   "target_price": to_floats([t["target_price"] for t in trades]),
+                   "stop_price": to_floats([t["stop_price"] for t in trades]),
+                   "type_of_exit": np.array([EXIT_CODES[t["type_of_exit"]] for t in trades], dtype="int8"),
+                   "pnl": to_floats([t["pnl"] for t in trades]),
+                   "open_lots": np.array([t["open_lots"] for t in trades], dtype="int32")}
+    n = len(trades)
+    columns["settings_id"] = np.full(n, settings_id, dtype="int32")
+    columns["side"] = np.full(n, side, dtype="int8")
+    return columns
+
+
+class TradeStore:
+
+    def __init__(self, name, batch_rows=100000, resume=None):
+        # resume - settings whose trades are kept from an earlier run in the same directory, the
+        # finished settings of the checkpoint the sweep resumes from. None starts the store over
+        self.path = store_path(name)
+        self.batch_rows = batch_rows
+        os.makedirs(self.path, exist_ok=True)
+
+        # Settings are appended in grid order, so the store keeps the settings of resume up to the
+        # first one that isn't there. Rows past the last kept setting belong to settings that will
+        # run again, or to a batch that was interrupted half way, and are dropped.
+        kept = []
+        if resume is not None:
+            for entry in sorted(read_index(self.path).values(), key=lambda entry: entry["start"]):
+                if entry["settings"] not in resume:
+                    break
+                kept.append(entry)
+        self.settings = {entry["settings"]: entry for entry in kept}
+        self.next_id = max([entry["settings_id"] for entry in kept], default=-1) + 1
+        self.rows = max([entry["start"] + entry["count"] for entry in kept], default=0)
+        for column, dtype in COLUMNS.items():
+            if column_length(self.path, column) > self.rows:
+                os.truncate(os.path.join(self.path, column + ".bin"), self.rows * np.dtype(dtype).itemsize)
+        if len(kept) != len(read_index(self.path)):
+            write_index(self.path, kept)
+        self._pending = []
+        self._pending_rows = 0
+
+    def append(self, settings, longs, shorts=()):
+        # Queue the trades of one setting, they are written once batch_rows trades are pending
+        settings_id = self.next_id
+        self.next_id += 1
+        batch = [trade_columns(longs, 1, settings_id), trade_columns(shorts, -1, settings_id)]
+        count = len(longs) + len(shorts)
+        self._pending.append(({"settings_id": settings_id, "settings": settings,
+                               "start": self.rows + self._pending_rows, "count": count}, batch))
+        self._pending_rows += count
+        if self._pending_rows >= self.batch_rows:
+            self.flush()
+        return settings_id
+
+    def flush(self):
+        if len(self._pending) == 0:
+            return
+        for column, dtype in COLUMNS.items():
+            values = np.concatenate([part[column] for entry, batch in self._pending for part in batch])
+            with open(os.path.join(self.path, column + ".bin"), "ab") as outfile:
+                values.astype(dtype).tofile(outfile)
+        # The index goes last, a setting is only visible once all of its columns are on disk
+        index_file = os.path.join(self.path, INDEX_FILE)
+        new_file = not os.path.exists(index_file)
+        with open(index_file, "a", newline="") as outfile:
+            dict_writer = csv.DictWriter(outfile, INDEX_FIELDS)
+            if new_file:
+                dict_writer.writeheader()
+            for entry, batch in self._pending:
+                dict_writer.writerow(entry)
+                self.settings[entry["settings"]] = entry
+        self.rows += self._pending_rows
+        self._pending = []
+        self._pending_rows = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_index(path):
+    index_file = os.path.join(path, INDEX_FILE)
+    settings = {}
+    if os.path.exists(index_file):
+        with open(index_file, newline="") as infile:
+            for row in csv.DictReader(infile):
+                settings[row["settings"]] = {"settings_id": int(row["settings_id"]),
+                                             "settings": row["settings"],
+                                             "start": int(row["start"]),
+                                             "count": int(row["count"])}
+    return settings
+
+
+def write_index(path, entries):
+    # Replace the index with entries, through a temporary file so an interruption leaves one or the other
+    index_file = os.path.join(path, INDEX_FILE)
+    if len(entries) == 0:
+        if os.path.exists(index_file):
+            os.remove(index_file)
+        return
+    with open(index_file + ".tmp", "w", newline="") as outfile:
+        dict_writer = csv.DictWriter(outfile, INDEX_FIELDS)
+        dict_writer.writeheader()
+        dict_writer.writerows(entries)
+    os.replace(index_file + ".tmp", index_file)
+
+
+def column_length(path, column):
+    column_file = os.path.join(path, column + ".bin")
+    if not os.path.exists(column_file):
+        return 0
+    return os.path.getsize(column_file) // np.dtype(COLUMNS[column]).itemsize
+
+
+def read_trades(name, settings=None):
+    # Trades of one setting (a settings string), several settings (a list) or the whole run (None)
+    path = store_path(name)
+    index = read_index(path)
+    if settings is None:
+        entries = sorted(index.values(), key=lambda entry: entry["start"])
+    else:
+        if isinstance(settings, str):
+            settings = [settings]
+        entries = [index[s] for s in settings]
+
+    columns = {}
+    for column, dtype in COLUMNS.items():
+        rows = column_length(path, column)
+        data = np.memmap(os.path.join(path, column + ".bin"), dtype=dtype, mode="r", shape=(rows,)) \
+            if rows != 0 else np.empty(0, dtype=dtype)
+        parts = [data[entry["start"]:entry["start"] + entry["count"]] for entry in entries]
+        columns[column] = np.concatenate(parts) if len(parts) != 0 else np.empty(0, dtype=dtype)
+
+    trades = pd.DataFrame(columns)
+    names = {entry["settings_id"]: entry["settings"] for entry in index.values()}
+    trades.insert(0, "settings", trades["settings_id"].map(names))
+    for column in ["timestamp_of_entry", "timestamp_of_exit"]:
+        # NaT is stored as the smallest int64, which is what numpy uses for NaT
+        trades[column] = trades[column].to_numpy().view("datetime64[ns]")
+    trades["type_of_exit"] = trades["type_of_exit"].map(lambda code: EXIT_NAMES[ExitType(code)])
+    return trades
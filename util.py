@@ -1,3 +1,4 @@
+import math
 import pandas as pd
 import talib
 import matplotlib.pyplot as plt
@@ -6,34 +7,89 @@ from os import listdir
 from os.path import isfile, join
 import os
 import csv
+import multiprocessing
+from tqdm import tqdm
+from resultcatalog import CATALOG_FILE, add_results
+
+# Column positions in the raw .log files (36 columns, we only need a few)
+TICK_COLUMNS = {"Timestamp": 0, "B2": 5, "B1": 6, "B": 7, "A": 8, "A1": 9, "A2": 10}
+DEPTH_COLUMNS = ["B2", "B1", "A1", "A2"]
+
+# Logs are in epoch seconds, we work in Indian time
+IST_OFFSET = pd.Timedelta(hours=5, minutes=30)
+
+# Lines per chunk of resample_chunked, a chunk takes about 16 bytes a line once parsed
+CHUNK_ROWS = 500000
+
+# read_tick_log drops this many lines at the start and at the end of a log
+EDGE_ROWS = 50
+
+
+def tick_engine(chunked=False):
+    # pyarrow's csv reader is several times faster on big logs, use it when it is installed.
+    # It can't read a file in chunks, resample_chunked reads with the c engine
+    if chunked:
+        return "c"
+    try:
+        import pyarrow
+        return "pyarrow"
+    except ImportError:
+        return "c"
+
+
+def read_tick_log(filename, depth=False, engine=None):
+    # Top of book bid/ask ticks of a .log file, indexed by Indian datetime.
+    # Only Timestamp, B and A (plus B2, B1, A1, A2 with depth) are parsed, as compact integers.
+    names = ["Timestamp", "B", "A"]
+    if depth:
+        names += DEPTH_COLUMNS
+    usecols = sorted(TICK_COLUMNS[name] for name in names)
+    column_names = {TICK_COLUMNS[name]: name for name in names}
+    if engine is None:
+        engine = tick_engine()
+
+    dtypes = {TICK_COLUMNS[name]: "int32" for name in names}
+    dtypes[TICK_COLUMNS["Timestamp"]] = "int64"
+    try:
+        df = pd.read_csv(filename, header=None, usecols=usecols, dtype=dtypes, engine=engine)
+    except ValueError:
+        # Fractional epochs or prices, parse as floats and truncate prices like before
+        df = pd.read_csv(filename, header=None, usecols=usecols, dtype="float64", engine=engine)
+    df = tick_columns(df, usecols, column_names)[EDGE_ROWS:-EDGE_ROWS]
+    return tick_frame(df, names)
 
-def resample(filename, timeframe='15Min'):
-    # Get top bid ask
-    col_names = ["Timestamp", "Remove", "Remove", "Remove", "Remove", "B2", "B1", "B", "A", "A1", "A2"]
-    filler = ["Remove"] * (36 - len(col_names))
-    for item in filler:
-        col_names.append(item)
-    df = pd.read_csv(filename, header=None, names=col_names)[50:-50]
 
-    # Cleaning
-    df.drop(["Remove"], axis=1, inplace=True)
-    for x in range(1, 51):
-        try:
-            df.drop(["Remove.{}".format(str(x))], axis=1, inplace=True)
-        except:
-            pass
+def tick_columns(df, usecols, column_names):
+    # Log columns read with usecols under their names, as compact integers when they are whole.
+    # The c engine keeps the column positions as labels but pyarrow numbers the columns 0, 1, 2... and
+    # ignores dtypes given by position, so columns are named by their order and the dtypes applied here
+    df.columns = [column_names[column] for column in usecols]
+    for name in df.columns:
+        if df[name].dtype.kind == "i":
+            df[name] = df[name].astype("int64" if name == "Timestamp" else "int32")
+    return df
 
-    # Convert epoch to Indian datetime
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'] * 1e9).values + pd.to_timedelta(5.5, unit='h')
 
-    # Set index as Timestamp
-    df.set_index(df['Timestamp'], inplace=True)
+def tick_frame(df, names):
+    # Ticks indexed by Indian datetime from the parsed log columns of read_tick_log
+    # Convert epoch to Indian datetime, in integer nanoseconds when the epochs are whole seconds
+    epochs = df['Timestamp'].to_numpy()
+    if epochs.dtype.kind == "i":
+        timestamps = pd.to_datetime(epochs * 1000000000)
+    else:
+        timestamps = pd.to_datetime(epochs, unit="s")
+    ticks = df[names[1:]].astype("int32")
+    ticks.index = pd.DatetimeIndex(timestamps + IST_OFFSET, name="Timestamp")
+    return ticks
 
-    # Drop duplicate Timestamp column
-    df.drop(['Timestamp'], axis=1, inplace=True)
 
-    # Convert Bid-Ask to int
-    df[["B", "A"]] = df[["B", "A"]].astype(int)
+def resample(filename, timeframe='15Min', engine=None, chunk_rows=None):
+    # chunk_rows - read the log that many lines at a time, see resample_chunked
+    if chunk_rows is not None:
+        return resample_chunked(filename, timeframe, chunk_rows, engine=engine)
+
+    # Get top bid ask
+    df = read_tick_log(filename, engine=engine)
 
     # Get bid ohlc
     bid = df["B"].resample(timeframe).ohlc()
@@ -44,12 +100,174 @@ def resample(filename, timeframe='15Min'):
     # Return bid, ask
     return bid, ask
 
-def write_result(results,file):
+def resample_chunked(filename, timeframe='15Min', chunk_rows=CHUNK_ROWS, engine=None):
+    # Same bars as resample, reading the log chunk_rows lines at a time so memory doesn't grow with the log.
+    # Every chunk is resampled on its own and its last bar, which the next chunk may add ticks to,
+    # is carried over and merged with the first bar of the next chunk. Bins are anchored to the
+    # midnight before the first tick, as resample anchors them.
+    if engine is None:
+        engine = tick_engine(chunked=True)
+    try:
+        return _resample_chunks(filename, timeframe, chunk_rows, engine, integers=True)
+    except ValueError:
+        # Fractional epochs or prices, start over with floats like read_tick_log
+        return _resample_chunks(filename, timeframe, chunk_rows, engine, integers=False)
+
+
+def _resample_chunks(filename, timeframe, chunk_rows, engine, integers):
+    names = ["Timestamp", "B", "A"]
+    usecols = sorted(TICK_COLUMNS[name] for name in names)
+    column_names = {TICK_COLUMNS[name]: name for name in names}
+    dtypes = "float64"
+    if integers:
+        dtypes = {TICK_COLUMNS[name]: "int32" for name in names}
+        dtypes[TICK_COLUMNS["Timestamp"]] = "int64"
+
+    skip = EDGE_ROWS
+    held = None  # last EDGE_ROWS lines so far, only resampled once more lines follow them
+    anchor = None
+    carry = None  # last bid and ask bar so far, the next chunk may still add ticks to it
+    bids, asks = [], []
+    with pd.read_csv(filename, header=None, usecols=usecols, dtype=dtypes, engine=engine,
+                     chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            chunk = tick_columns(chunk, usecols, column_names)
+            if skip > 0:
+                dropped = min(skip, len(chunk))
+                chunk = chunk[dropped:]
+                skip -= dropped
+            if held is not None:
+                chunk = pd.concat([held, chunk])
+            held = chunk[-EDGE_ROWS:]
+            chunk = chunk[:-EDGE_ROWS]
+            if len(chunk) == 0:
+                continue
+
+            ticks = tick_frame(chunk, names)
+            if anchor is None:
+                anchor = bin_anchor(timeframe, ticks.index[0])
+            bid = ticks["B"].resample(timeframe, **anchor).ohlc().dropna()
+            ask = ticks["A"].resample(timeframe, **anchor).ohlc().dropna()
+            if carry is not None:
+                bid = carry_bar(carry[0], bid)
+                ask = carry_bar(carry[1], ask)
+            carry = (bid[-1:], ask[-1:])
+            bids.append(bid[:-1])
+            asks.append(ask[:-1])
+
+    if carry is None:
+        # No ticks, the empty bars of resample
+        ticks = tick_frame(pd.DataFrame({name: pd.Series(dtype="int64") for name in names}), names)
+        return ticks["B"].resample(timeframe).ohlc(), ticks["A"].resample(timeframe).ohlc()
+    bids.append(carry[0])
+    asks.append(carry[1])
+    return full_bars(bids, timeframe), full_bars(asks, timeframe)
+
+
+def bin_anchor(timeframe, first):
+    # resample arguments that anchor bins to the midnight before first, as resample does for the whole log.
+    # Calendar timeframes (days, weeks...) are anchored to the calendar already
+    if isinstance(pd.tseries.frequencies.to_offset(timeframe), pd.offsets.Tick):
+        return {"origin": first.normalize()}
+    return {}
+
+
+def carry_bar(carried, bars):
+    # bars of a chunk with the bar carried over from the chunk before put in front, merged if it is the same bar
+    if carried.index[0] != bars.index[0]:
+        return pd.concat([carried, bars])
+    merged = bars[:1].copy()
+    merged.iloc[0, merged.columns.get_loc("open")] = carried["open"].iloc[0]
+    merged.iloc[0, merged.columns.get_loc("high")] = max(carried["high"].iloc[0], bars["high"].iloc[0])
+    merged.iloc[0, merged.columns.get_loc("low")] = min(carried["low"].iloc[0], bars["low"].iloc[0])
+    return pd.concat([merged, bars[1:]])
+
+
+def full_bars(frames, timeframe):
+    # Bars of every chunk as one frame, with the empty bars resample has between them
+    bars = merge_ohlc([pd.concat(frames)])
+    return bars.reindex(pd.date_range(bars.index[0], bars.index[-1], freq=timeframe, name="Timestamp"))
+
+
+def timeframe_nanoseconds(timeframe):
+    # Length of a fixed timeframe ('1Min', '1h', '1D'...) in nanoseconds
+    return pd.Timedelta(timeframe).value
+
+
+def resample_timeframes(filename, timeframes, engine=None, chunk_rows=None):
+    # {timeframe: (bid, ask)} of several timeframes from one read of the log, the same bars resample gives.
+    # The ticks are resampled once, into the longest timeframe all of them are multiples of, and every
+    # timeframe is rolled up from the longest one already built that it is a multiple of
+    # (15Min from 5Min, 5Min from 1Min). Timeframes need a fixed length, so no weeks or months.
+    lengths = {timeframe: timeframe_nanoseconds(timeframe) for timeframe in timeframes}
+    base = "{}ns".format(math.gcd(*lengths.values()))
+    for timeframe, length in lengths.items():
+        if length == timeframe_nanoseconds(base):
+            base = timeframe
+    built = [(timeframe_nanoseconds(base), resample(filename, base, engine=engine, chunk_rows=chunk_rows))]
+
+    bars = {}
+    for timeframe in sorted(timeframes, key=lengths.get):
+        length = lengths[timeframe]
+        source_length, (bid, ask) = max((entry for entry in built if length % entry[0] == 0), key=lambda e: e[0])
+        if source_length != length:
+            bid, ask = roll_up(bid, timeframe), roll_up(ask, timeframe)
+            built.append((length, (bid, ask)))
+        bars[timeframe] = (bid, ask)
+    return bars
+
+
+def roll_up(bars, timeframe):
+    # ohlc bars of a longer timeframe from the bars of a shorter one it is a multiple of
+    if len(bars) == 0:
+        return bars.resample(timeframe).agg({"open": "first", "high": "max", "low": "min", "close": "last"})
+    rolled = bars.resample(timeframe, **bin_anchor(timeframe, bars.index[0])).agg(
+        {"open": "first", "high": "max", "low": "min", "close": "last"})
+    # Bars made from ticks are integers unless some of them are empty
+    if not rolled.isna().any().any():
+        rolled = rolled.astype("int32")
+    return rolled
+
+
+def _resample_file(args):
+    filename, timeframe = args
+    return resample(filename, timeframe)
+
+
+def merge_ohlc(frames):
+    # Combine per-file ohlc frames into one sorted frame.
+    # A bar that shows up in more than one file (a session split across logs) is merged:
+    # open of the earliest file, high/low over all of them and close of the latest.
+    frames = [frame for frame in frames if len(frame) != 0]
+    frames.sort(key=lambda frame: frame.index[0])
+    combined = pd.concat(frames)
+    # Stable sort so bars with the same timestamp stay in file order
+    combined = combined.sort_index(kind="mergesort")
+    if combined.index.is_unique:
+        return combined
+    return combined.groupby(level=0).agg({"open": "first", "high": "max", "low": "min", "close": "last"})
+
+
+def resample_files(file_list, timeframe='15Min', workers=None):
+    # Resample every log on a process pool, returns the merged bid and ask ohlc
+    with multiprocessing.Pool(workers) as pool:
+        pairs = list(tqdm(pool.imap(_resample_file, [(filename, timeframe) for filename in file_list]),
+                          total=len(file_list)))
+    bids = [bid for bid, ask in pairs]
+    asks = [ask for bid, ask in pairs]
+    return merge_ohlc(bids), merge_ohlc(asks)
+
+
+def write_result(results,file,catalog=CATALOG_FILE,**metadata):
+    # Results go to {file}.csv and to the result catalog as run file, with metadata
+    # (data_file, timeframe, lots, max_lots, see resultcatalog.add_results). catalog None for the csv only
     with open("{}.csv".format(file), "w+", newline="") as outfile:
         keys = results[0].keys()
         dict_writer = csv.DictWriter(outfile,keys)
         dict_writer.writeheader()
         dict_writer.writerows(results)
+    if catalog is not None:
+        add_results(results, file, catalog, **metadata)
     print("Done for {}".format(file))
 
 def get_list_of_files(relative_path,extension):
@@ -66,8 +284,8 @@ def get_list_of_files(relative_path,extension):
 
 def write_trades(settings,trades,name):
     filename = name.split('.log')
-    if not os.path.exists("{}".format(filename[0])):
-        os.makedirs("{}".format(filename[0]))
+    # exist_ok as parallel sweeps may create the directory at the same time
+    os.makedirs("{}".format(filename[0]), exist_ok=True)
     keys = trades[0].keys()
     with open('./{}/{}.csv'.format(filename[0],settings),'w+',newline='') as outfile:
         dict_writer = csv.DictWriter(outfile,keys)
@@ -0,0 +1,161 @@
+import os
+import multiprocessing
+import numpy as np
+import pandas as pd
+from trade import ohlc_grid, settings_name
+from halving import evaluate
+from indicators import IndicatorCache
+from records import TradeLog
+from metrics import trade_metrics, sample_span
+from sweep import share_frame, attach_frame, share_array, attach_array
+from tradestore import TradeStore
+from writer import BackgroundWriter
+from strategies import ema_rsi
+
+# Walk-forward optimization over the ohlc_backtest grid.
+# The bars are cut into folds of a train window followed by a test window,
+# rolling (the train window moves with the test window) or anchored (it always
+# starts at the first bar). Every setting runs on the train window, the best
+# one by score runs on the test window, and the test trades of all folds are
+# stitched into one out-of-sample run.
+#
+# The RSI / EMA series are computed once over all the bars by the parent and
+# shared with the workers, so a window sees warmed-up indicators and a fold
+# only slices them. Folds run on a process pool with the frames in shared
+# memory, as in sweep.py. Trades of a window only exit inside that window, on
+# the bid bars of the window's time (halving.time_window).
+
+INSTRUMENT = "walk-forward"
+
+# Per-process state set up by _init_worker
+_worker = {}
+
+
+def walk_windows(bars, train, test, step=None, anchored=False):
+    # (train start, train end, test start, test end) bar positions of every fold, ends excluded.
+    # step is how far the windows move between folds, test bars by default
+    if step is None:
+        step = test
+    windows = []
+    start = 0
+    while start + train + test <= bars:
+        windows.append((0 if anchored else start, start + train, start + train, start + train + test))
+        start += step
+    return windows
+
+
+def wanted_series(rsi_windows, ema_values):
+    return [("RSI", period) for period in rsi_windows] + [("EMA", period) for period in ema_values]
+
+
+def _init_worker(bid_spec, ask_spec, series_spec, series, settings, lots, max_lots, score, strategy):
+    bid, bid_blocks = attach_frame(bid_spec)
+    ask, ask_blocks = attach_frame(ask_spec)
+    values, values_block = attach_array(series_spec)
+    close = ask['close'].to_numpy(dtype=float)
+    cache = IndicatorCache()
+    for (indicator, period), row in zip(series, values):
+        cache.put(INSTRUMENT, indicator, period, row, close)
+    _worker.update({"bid": bid,
+                    "ask": ask,
+                    "close": close,
+                    # keep the blocks referenced for as long as the arrays live
+                    "blocks": bid_blocks + ask_blocks + [values_block],
+                    "cache": cache,
+                    "settings": settings,
+                    "lots": lots,
+                    "max_lots": max_lots,
+                    "score": score,
+                    "strategy": strategy})
+
+
+def _run_fold(window):
+    # Best setting on the train window and its trades on the test window
+    train_start, train_end, test_start, test_end = window
+    best = None
+    best_score = -np.inf
+    for setting, metrics, long_log, short_log in evaluate(
+            _worker["bid"], _worker["ask"], _worker["settings"], train_end, _worker["lots"], _worker["max_lots"],
+            INSTRUMENT, _worker["cache"], _worker["close"], start=train_start, strategy=_worker["strategy"]):
+        if metrics is None or metrics["num_longs"] == 0 or metrics["num_shorts"] == 0:
+            continue
+        value = metrics[_worker["score"]]
+        # Ties keep the first setting in grid order
+        if value is not None and not np.isnan(value) and value > best_score:
+            best, best_score = setting, value
+    if best is None:
+        return window, None, None, None, None
+
+    for setting, metrics, long_log, short_log in evaluate(
+            _worker["bid"], _worker["ask"], [best], test_end, _worker["lots"], _worker["max_lots"], INSTRUMENT,
+            _worker["cache"], _worker["close"], start=test_start, strategy=_worker["strategy"]):
+        return window, best, best_score, long_log, short_log
+
+
+def walk_forward(bid, ask, rsi_windows, rsi_oversold_bounds, rsi_overbought_bounds, ema_values, targets, stops,
+                 overlaps, lots, max_lots, filename_parent, train, test, step=None, anchored=False, score="netpnl",
+                 workers=None, strategy=ema_rsi):
+    # Grid arguments as ohlc_backtest, then the windows in bars (see walk_windows), the result field
+    # that picks the best setting of a train window and the number of worker processes (None uses every core).
+    # strategy gives the entry signals of a configuration (see strategies.py), a module level function as it
+    # is sent to the workers. Series it asks the cache for that aren't the RSI / EMA of the grid are computed
+    # by the workers on all the bars.
+    # Returns a result per fold and the result of the stitched out-of-sample trades
+    if workers is None:
+        workers = os.cpu_count() or 1
+    windows = walk_windows(len(ask), train, test, step, anchored)
+    if len(windows) == 0:
+        return [], None
+    settings = [config + (target, stop)
+                for config in ohlc_grid(overlaps, rsi_windows, rsi_overbought_bounds, rsi_oversold_bounds, ema_values)
+                for target in targets for stop in stops if stop < target]
+
+    # Every indicator series the grid needs, computed once over all the bars
+    close = ask['close'].to_numpy(dtype=float)
+    cache = IndicatorCache()
+    series = wanted_series(rsi_windows, ema_values)
+    values = np.vstack([cache.get(INSTRUMENT, indicator, period, close) for indicator, period in series])
+
+    timestamps = pd.to_datetime(ask.index)
+    folds = []
+    stitched = (TradeLog(1), TradeLog(-1))
+    blocks = []
+    try:
+        bid_blocks, bid_spec = share_frame(bid)
+        blocks += bid_blocks
+        ask_blocks, ask_spec = share_frame(ask)
+        blocks += ask_blocks
+        values_block, values_spec = share_array(values)
+        blocks.append(values_block)
+
+        with multiprocessing.Pool(min(workers, len(windows)), initializer=_init_worker,
+                                  initargs=(bid_spec, ask_spec, values_spec, series, settings, lots, max_lots,
+                                            score, strategy)) as pool, \
+                TradeStore(filename_parent) as store, BackgroundWriter(store) as writer:
+            # imap keeps the folds in time order, which is the order the trades are stitched in
+            for fold, (window, best, best_score, long_log, short_log) in enumerate(pool.imap(_run_fold, windows)):
+                train_start, train_end, test_start, test_end = window
+                result = {"fold": fold,
+                          "train_start": timestamps[train_start],
+                          "train_end": timestamps[train_end - 1],
+                          "test_start": timestamps[test_start],
+                          "test_end": timestamps[test_end - 1],
+                          "settings": None if best is None else settings_name(best),
+                          "train_score": best_score}
+                if best is not None:
+                    result.update(trade_metrics(long_log, short_log, span=sample_span(ask.iloc[test_start:test_end])))
+                    stitched[0].extend(long_log.records)
+                    stitched[1].extend(short_log.records)
+                    writer.append("fold_{}-{}".format(fold, result["settings"]), long_log, short_log)
+                print("Fold {} : {} : {}".format(fold, result["settings"], result.get("netpnl")))
+                folds.append(result)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    summary = None
+    if len(stitched[0]) != 0 and len(stitched[1]) != 0:
+        first, last = windows[0][2], windows[-1][3]
+        summary = dict(settings="walk-forward", **trade_metrics(*stitched, span=sample_span(ask.iloc[first:last])))
+    return folds, summary
@@ -0,0 +1,86 @@
+import queue
+import threading
+
+# Background writer for sweep output.
+# The sweeps hand trades (and any other write, like write_result) to a bounded
+# queue and carry on computing; a dedicated thread drains the queue in batches
+# into the TradeStore. When the queue is full the sweep waits, so memory stays
+# bounded if the disk falls behind. Closing the writer (or leaving the with
+# block, also on an exception) writes everything still queued and flushes the
+# store, and an error raised in the thread is raised again in the sweep.
+
+_STOP = object()
+
+
+class BackgroundWriter:
+
+    def __init__(self, store=None, max_pending=256, batch_size=64):
+        # store is a TradeStore, or None if the writer is only used with submit()
+        self.store = store
+        self.batch_size = batch_size
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="BackgroundWriter", daemon=True)
+        self._thread.start()
+
+    def append(self, settings, longs, shorts=()):
+        # Same as TradeStore.append, without waiting for the disk
+        self._put((self.store.append, (settings, longs, shorts), {}))
+
+    def submit(self, function, *args, **kwargs):
+        # Run any other write, e.g. submit(write_result, results, file, max_lots=max_lots)
+        self._put((function, args, kwargs))
+
+    def _put(self, item):
+        self._check()
+        self._queue.put(item)  # blocks while the queue is full
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError("Background writer failed") from self.error
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            # Take whatever is queued, up to batch_size items, and write it in one go
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is _STOP:
+                    stopping = True
+                    continue
+                # After a failure keep draining so the sweep never blocks on a full queue
+                if self.error is None:
+                    function, args, kwargs = item
+                    try:
+                        function(*args, **kwargs)
+                    except Exception as e:
+                        self.error = e
+        if self.store is not None and self.error is None:
+            try:
+                self.store.flush()
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep what was already computed, but don't hide the original error
+            try:
+                self.close()
+            except RuntimeError:
+                pass